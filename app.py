@@ -3,16 +3,61 @@ from tkinter import ttk, messagebox, filedialog
 import requests
 import threading
 import time
-from datetime import datetime, timedelta
+from datetime import datetime
+import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 from matplotlib.figure import Figure
 from matplotlib.dates import DateFormatter
-from queue import Queue
-from functools import lru_cache
+from queue import Queue, Empty, Full
+from types import MappingProxyType
+from collections import OrderedDict, defaultdict, deque
+from contextlib import contextmanager
+from typing import Optional
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeoutError
 import os
+import errno
 import json
+import csv
+import gzip
+import bz2
+import lzma
+import hashlib
+import itertools
+import bisect
+import argparse
+import random
 from pathlib import Path
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+try:
+    import websocket  # websocket-client, нужен только для потокового режима
+except ImportError:
+    websocket = None
+
+try:
+    import orjson  # ускоренный разбор JSON
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec  # типизированный разбор JSON по схемам эндпоинтов
+except ImportError:
+    msgspec = None
+
+try:
+    import httpx  # нужен только для HTTP/2 (pip install httpx[http2])
+    import h2
+except ImportError:
+    httpx = h2 = None
+
+try:
+    import pyarrow as pa  # нужен только для экспорта в Parquet
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
 
 # ==============================================
 # КОНСТАНТЫ И НАСТРОЙКИ
@@ -25,6 +70,133 @@ TEXT_COLOR = "#ffffff"    # Цвет текста
 GREEN_COLOR = "#4ad66d"   # Цвет для позитивных значений
 RED_COLOR = "#f72585"     # Цвет для негативных значений
 SAVE_COLOR = "#2ecc71"    # Цвет кнопки сохранения
+STALE_COLOR = "#6c7a99"   # Цвет устаревших значений
+
+# Настройки параллельной загрузки
+FETCH_WORKERS = 12        # Число потоков для параллельных запросов
+CYCLE_DEADLINE = 8        # Дедлайн одного цикла обновления (сек)
+SNAPSHOT_DEADLINE = 2     # Дедлайн снимка котировок: медленные биржи берутся из прошлых данных (сек)
+STALE_AFTER = 15          # Значения старше этого показываются приглушенными с возрастом (сек)
+
+# HTTP-транспорт
+HTTP_USER_AGENT = "CryptoAggregator/1.0"
+HTTP_POOL_SIZE = FETCH_WORKERS # Соединений в пуле на один хост (все параллельные запросы цикла)
+HTTP_MAX_HOSTS = 16       # Число хостов, для которых пулы держатся открытыми
+HTTP_CONNECT_TIMEOUT = 3  # Таймаут установки соединения (сек)
+HTTP_READ_TIMEOUT = 5     # Таймаут чтения по умолчанию (сек), у адаптеров - ExchangeAdapter.timeout
+HTTP_RETRIES = 2          # Повторы GET при сетевых ошибках и ответах 502/503/504
+HTTP_BACKOFF = 0.2        # Базовая пауза перед повтором (сек)
+USE_HTTP2 = False         # HTTP/2 через httpx, если он установлен; иначе requests
+
+# Разбор ответов бирж: "auto" - msgspec (по схемам) и orjson, если установлены,
+# "orjson" - без схем, "json" - только стандартная библиотека
+JSON_BACKEND = "auto"
+
+# Ограничение частоты запросов к биржам
+RATE_LIMIT_HEADROOM = 0.9  # Доля лимита биржи, которую разрешено расходовать
+RATE_LIMIT_MAX_WAIT = 3    # Дольше этого запрос не ждет токенов и отменяется (сек)
+RATE_LIMIT_BAN_DEFAULT = 60 # Пауза после 429/418 без заголовка Retry-After (сек)
+# Приоритеты запросов: при нехватке лимита первыми откладываются менее важные
+PRIORITY_REALTIME = 0     # Снимок котировок для графиков реального времени
+PRIORITY_BEST = 1         # Цены покупки/продажи выбранной монеты
+PRIORITY_TOP10 = 2        # Лучшие цены всех пар (топ-10, арбитраж)
+PRIORITY_KLINES = 3       # Исторические свечи
+RATE_LIMIT_RESERVE = {    # Доля ведра, недоступная запросам этого приоритета
+    PRIORITY_REALTIME: 0.0,
+    PRIORITY_BEST: 0.1,
+    PRIORITY_TOP10: 0.2,
+    PRIORITY_KLINES: 0.35,
+}
+
+# Биржи: порядок столбцов в таблицах и графиках. Доступные адаптеры - EXCHANGE_REGISTRY
+QUOTE_ASSET = "USDT"
+ENABLED_EXCHANGES = ["Bybit", "MEXC", "Binance"]
+TOP_SYMBOLS = ["BTC", "ETH", "BNB", "SOL", "XRP", "ADA", "DOGE", "DOT", "AVAX"]
+# Переопределение настроек подключения адаптеров, например
+# {"Binance": {"base_url": "https://api1.binance.com", "timeout": 3}}
+EXCHANGE_SETTINGS = {}
+
+# Поиск арбитража
+ARBITRAGE_TOP_N = 10       # Число лучших возможностей в таблице
+ARBITRAGE_MAX_PERCENT = 20 # Больший спред почти всегда означает разные монеты с одинаковым тикером
+
+# Кэш исторических свечей
+KLINE_CACHE_SIZE = 64     # Максимальное число серий свечей в кэше
+KLINE_TTL = {             # Как долго серия считается свежей, по интервалу (сек)
+    "1m": 5,
+    "1h": 60,
+    "1d": 300,
+}
+KLINE_INTERVAL_SECONDS = {"1m": 60, "1h": 3600, "1d": 86400}
+
+# Потоковый режим (WebSocket) для бирж с supports_streaming. Без websocket-client
+# или при обрыве связи данные берутся через REST
+USE_STREAMING = True
+STREAM_STALE_AFTER = 10   # Поток без сообщений дольше этого считается неживым (сек)
+STREAM_PING_INTERVAL = 20 # Интервал пингов для удержания соединения (сек)
+STREAM_BACKOFF_MAX = 60   # Максимальная пауза между переподключениями (сек)
+
+# Локальные стаканы и средневзвешенная цена сделки (VWAP)
+USE_DEPTH_STREAMS = True  # Потоки изменений стаканов для бирж с supports_depth_stream
+DEPTH_LEVELS = 50         # Глубина снимка стакана (уровней на сторону)
+DEPTH_PENDING_MAX = 1000  # Сколько изменений хранить до прихода снимка
+TRADE_NOTIONAL = 10000    # Объем сделки по умолчанию для расчета VWAP (USDT)
+REST_BOOKS_EXTRA = 32     # Сколько стаканов REST хранить для монет не из списка (старые вытесняются)
+
+# Хранилище тиков на диске
+USE_TICK_STORE = True
+TICK_STORE_DIR = Path.home() / ".crypto_aggregator" / "ticks"
+TICK_STORE_CHUNK = 65536  # Шаг роста файлов хранилища (записей)
+REALTIME_HISTORY = 20     # Число точек на графике реального времени (от 20 до 100000)
+REALTIME_MIN_POINTS = 20
+REALTIME_MAX_POINTS = 100000
+REALTIME_HEADROOM = 0.5   # Запас по оси времени при масштабировании (доля видимого окна)
+REALTIME_MIN_SPAN = 60    # Минимальная ширина окна по времени (сек)
+RENDER_MAX_FPS = 20       # Максимальная частота перерисовки интерфейса (кадров/сек)
+
+# Локальная история свечей: глубокая история загружается один раз, затем докачиваются новые свечи
+USE_CANDLE_STORE = True
+CANDLE_STORE_DIR = Path.home() / ".crypto_aggregator" / "candles"
+CANDLE_STORE_CHUNK = 4096 # Шаг роста файлов истории (свечей)
+HISTORY_BACKFILL = {      # Сколько свечей загружать при первом запуске, по интервалу
+    "1m": 1440,           # сутки
+    "1h": 1440,           # 60 дней
+    "1d": 730,            # два года
+}
+HISTORY_PAGE = 200        # Свечей в одном запросе (не больше лимита любой из бирж)
+HISTORY_SYNC_INTERVAL = 60 # Пауза между проходами докачки (сек)
+HISTORY_PERIODS = {       # Периоды исторических графиков: (интервал свечей, длительность в сек)
+    "Неделя": ("1h", 7 * 86400),
+    "Месяц": ("1h", 30 * 86400),
+    "Год": ("1d", 365 * 86400),
+}
+
+# Экспорт данных (сохранение и непрерывная запись)
+EXPORT_FORMAT = "csv"     # "csv", "jsonl" или "parquet" (нужен pyarrow)
+EXPORT_COMPRESSION = None # Для csv/jsonl: None, "gzip", "bz2", "xz"; для parquet - кодек ("snappy", "zstd"...)
+EXPORT_ROLL_SIZE = 64 * 1024 * 1024 # Объем данных (до сжатия), после которого начинается новый файл записи (байт)
+EXPORT_ROLL_SECONDS = 3600 # Длительность записи в один файл (сек)
+EXPORT_QUEUE_SIZE = 10000 # Максимум пачек в очереди записи; лишние отбрасываются, интерфейс не ждет
+EXPORT_CHUNK_ROWS = 65536 # Строк в одной операции записи
+
+# Запись и воспроизведение сессий: ответы бирж пишутся в файл и воспроизводятся без сети
+SESSION_RECORD_FILE = None # Файл записи (--record-session), None - не записывать
+SESSION_REPLAY_FILE = None # Файл воспроизведения (--replay), None - работа с биржами
+REPLAY_SPEED = 1.0        # Скорость воспроизведения: 1, 10...; None - максимальная (без пауз)
+SESSION_QUEUE_SIZE = 10000 # Максимум ответов в очереди записи; лишние отбрасываются
+# Параметры времени не входят в ключ ответа: при воспроизведении они всегда другие
+SESSION_TIME_PARAMS = {"start", "end", "startTime", "endTime", "before", "after", "from", "to", "startAt", "endAt"}
+
+# Метрики производительности: панель диагностики и формат Prometheus
+USE_METRICS = True
+METRICS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10) # Границы корзин гистограмм (сек)
+METRICS_PORT = None       # Порт /metrics в оконном режиме (--metrics-port), None - не запускать; в --headless - на порту API
+DIAGNOSTICS_INTERVAL = 1  # Период обновления панели диагностики (сек)
+
+# Фоновый режим без окна (--headless): локальный HTTP/JSON API
+DAEMON_HOST = "127.0.0.1" # Только локальные подключения
+DAEMON_PORT = 8765
+DAEMON_UPDATE_INTERVAL = 10 # Интервал загрузки лучших цен и арбитража (сек)
 
 # ==============================================
 # КЛАСС ОКНА АВТОРИЗАЦИИ
@@ -248,172 +420,4373 @@ class LoadingAnimation:
         self.animation_id = self.canvas.after(300, lambda: self.animate(next_index))
 
 # ==============================================
-# ОСНОВНОЙ КЛАСС ПРИЛОЖЕНИЯ
+# МЕТРИКИ ПРОИЗВОДИТЕЛЬНОСТИ
 # ==============================================
-class CryptoAggregatorApp:
-    """Основной класс приложения-агрегатора криптовалют"""
+METRIC_HELP = {
+    'request_seconds': ('histogram', "Длительность HTTP-запроса к бирже"),
+    'request_errors_total': ('counter', "Ошибки запросов к биржам по причинам"),
+    'rate_limit_wait_seconds': ('histogram', "Ожидание лимита запросов перед отправкой"),
+    'cycle_seconds': ('histogram', "Длительность параллельного цикла запросов"),
+    'cycle_timeouts_total': ('counter', "Циклы, прерванные дедлайном"),
+    'cycle_late_requests_total': ('counter', "Запросы, не успевшие к дедлайну цикла"),
+    'task_errors_total': ('counter', "Запросы цикла, завершившиеся исключением"),
+    'update_errors_total': ('counter', "Ошибки этапов обновления данных и интерфейса"),
+    'ui_queue_depth': ('gauge', "Задач в очереди интерфейса в начале кадра"),
+    'ui_queue_wait_seconds': ('histogram', "Ожидание задачи в очереди интерфейса"),
+    'ui_frame_seconds': ('histogram', "Длительность кадра обработки очереди и отрисовки"),
+    'render_seconds': ('histogram', "Отрисовка виджета по виду"),
+    'render_delay_seconds': ('histogram', "Задержка от публикации данных до отрисовки"),
+    'chart_draw_seconds': ('histogram', "Перерисовка canvas графика"),
+}
+
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами: число наблюдений, сумма и максимум"""
     
-    def __init__(self, root):
-        """Инициализация основного приложения"""
-        self.root = root
-        self.root.title("Агрегатор криптовалюты")
-        self.root.geometry("1350x1100")
-        self.root.configure(bg=DARK_BG)
+    __slots__ = ('bounds', 'counts', 'sum', 'count', 'max')
+    
+    def __init__(self, bounds=METRICS_BUCKETS):
+        """Инициализация пустой гистограммы"""
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # Последняя корзина - больше всех границ
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+    
+    def observe(self, value):
+        """Добавление наблюдения"""
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+        if value > self.max:
+            self.max = value
+    
+    def quantile(self, q):
+        """Оценка квантиля линейной интерполяцией внутри корзины"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                low = self.bounds[i - 1] if i > 0 else 0.0
+                high = self.bounds[i] if i < len(self.bounds) else self.max
+                return min(low + (high - low) * (rank - seen) / n, self.max)
+            seen += n
+        return self.max
+
+
+class MetricsRegistry:
+    """
+    Счетчики, текущие значения и гистограммы длительностей горячих путей
+    
+    Метрика определяется именем и метками (биржа, эндпоинт, вид виджета...).
+    Запись - одно обновление словаря под блокировкой, поэтому вызывать можно
+    из любого потока, в том числе из потока Tk. Имена и описания - METRIC_HELP.
+    """
+    
+    PREFIX = "crypto_aggregator_"
+    
+    def __init__(self, enabled=USE_METRICS, buckets=METRICS_BUCKETS):
+        """Инициализация пустого реестра"""
+        self.enabled = enabled
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+    
+    @staticmethod
+    def _key(name, labels):
+        """Ключ метрики: имя и отсортированные метки"""
+        return name, tuple(sorted(labels.items())) if labels else ()
+    
+    def inc(self, name, amount=1, **labels):
+        """Увеличение счетчика"""
+        if not self.enabled:
+            return
+        key = self._key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+    
+    def set(self, name, value, **labels):
+        """Установка текущего значения"""
+        if not self.enabled:
+            return
+        key = self._key(name, labels)
+        with self.lock:
+            self.gauges[key] = value
+    
+    def observe(self, name, seconds, **labels):
+        """Добавление длительности в гистограмму"""
+        if not self.enabled:
+            return
+        key = self._key(name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(self.buckets)
+            histogram.observe(seconds)
+    
+    @contextmanager
+    def timer(self, name, **labels):
+        """Измерение длительности блока with (исключения тоже учитываются)"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+    
+    def timed(self, func, name, **labels):
+        """Обертка функции, измеряющая длительность каждого вызова"""
+        def wrapper(*args, **kwargs):
+            with self.timer(name, **labels):
+                return func(*args, **kwargs)
+        return wrapper
+    
+    @staticmethod
+    def error_reason(error):
+        """Причина ошибки запроса для метки reason"""
+        name = type(error).__name__
+        if isinstance(error, RateLimitError):
+            return "rate_limited"
+        if isinstance(error, TimeoutError) or "Timeout" in name:
+            return "timeout"
+        # Ошибки разбора JSON, несоответствие схеме и коды ошибок в теле ответа биржи
+        if isinstance(error, (ValueError, KeyError, TypeError)) or "Decode" in name or "Validation" in name:
+            return "bad_response"
+        return "network"
+    
+    def reset(self):
+        """Очистка всех метрик"""
+        with self.lock:
+            self.counters.clear()
+            self.gauges.clear()
+            self.histograms.clear()
+    
+    def summary(self):
+        """
+        Сводка для панели диагностики
         
-        # Настройка приложения
-        self._setup_styles()
-        self._create_ui()
+        Returns:
+            Словарь {'histograms': [(имя, метки, число, среднее, p50, p95, максимум)],
+            'counters': [(имя, метки, значение)], 'gauges': [(имя, метки, значение)]}
+        """
+        with self.lock:
+            histograms = [
+                (name, dict(labels), h.count, h.sum / h.count if h.count else 0.0,
+                 h.quantile(0.5), h.quantile(0.95), h.max)
+                for (name, labels), h in sorted(self.histograms.items())
+            ]
+            counters = [(name, dict(labels), value) for (name, labels), value in sorted(self.counters.items())]
+            gauges = [(name, dict(labels), value) for (name, labels), value in sorted(self.gauges.items())]
+        return {'histograms': histograms, 'counters': counters, 'gauges': gauges}
+    
+    @staticmethod
+    def _labels_text(labels, extra=None):
+        """Метки в формате Prometheus: {a="1",b="2"}"""
+        items = list(labels) + ([extra] if extra else [])
+        if not items:
+            return ""
+        parts = []
+        for name, value in items:
+            value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+            parts.append(f'{name}="{value}"')
+        return "{" + ",".join(parts) + "}"
+    
+    def prometheus(self):
+        """Все метрики в текстовом формате Prometheus (версия 0.0.4)"""
+        with self.lock:
+            series = {}
+            for (name, labels), value in self.counters.items():
+                series.setdefault(name, []).append((labels, value))
+            for (name, labels), value in self.gauges.items():
+                series.setdefault(name, []).append((labels, value))
+            for (name, labels), h in self.histograms.items():
+                series.setdefault(name, []).append((labels, (list(h.counts), h.sum, h.count)))
         
-        # Инициализация HTTP-сессии
-        self.session = requests.Session()
-        self.session.headers.update({'User-Agent': 'CryptoAggregator/1.0'})
+        lines = []
+        for name in sorted(series):
+            kind, text = METRIC_HELP.get(name, ('untyped', name))
+            full = self.PREFIX + name
+            lines.append(f"# HELP {full} {text}")
+            lines.append(f"# TYPE {full} {kind}")
+            for labels, value in sorted(series[name]):
+                if kind != 'histogram':
+                    lines.append(f"{full}{self._labels_text(labels)} {value}")
+                    continue
+                counts, total, count = value
+                cumulative = 0
+                for bound, n in zip(self.buckets, counts):
+                    cumulative += n
+                    lines.append(f"{full}_bucket{self._labels_text(labels, ('le', bound))} {cumulative}")
+                lines.append(f"{full}_bucket{self._labels_text(labels, ('le', '+Inf'))} {count}")
+                lines.append(f"{full}_sum{self._labels_text(labels)} {total}")
+                lines.append(f"{full}_count{self._labels_text(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+# Общий реестр: метрики пишут адаптеры, движок запросов, планировщик отрисовки и окно
+METRICS = MetricsRegistry()
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    """Обработчик запросов к /metrics в формате Prometheus"""
+    
+    server_version = "CryptoAggregator/1.0"
+    
+    def do_GET(self):
+        """Ответ метриками на /metrics, 404 на остальные адреса"""
+        if urlsplit(self.path).path.rstrip('/') == '/metrics':
+            self.send_metrics()
+            return
+        self.send_error(404)
+    
+    def send_metrics(self):
+        """Отправка всех метрик"""
+        body = METRICS.prometheus().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, format, *args):
+        """Журнал запросов отключен, чтобы опрос Prometheus не засорял вывод"""
+        pass
+
+
+class MetricsServer:
+    """Локальный HTTP-сервер, отдающий только /metrics (для оконного режима)"""
+    
+    def __init__(self, host=DAEMON_HOST, port=METRICS_PORT):
+        """Создание сервера (port=0 - выбрать свободный)"""
+        self.server = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+        self.server.daemon_threads = True
+        self.host, self.port = self.server.server_address[:2]
+    
+    @property
+    def url(self):
+        """Адрес метрик"""
+        return f"http://{self.host}:{self.port}/metrics"
+    
+    def start(self):
+        """Запуск сервера в фоновом потоке"""
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+    
+    def stop(self):
+        """Остановка сервера"""
+        self.server.shutdown()
+        self.server.server_close()
+
+# ==============================================
+# КОЛЬЦЕВОЙ БУФЕР ДАННЫХ РЕАЛЬНОГО ВРЕМЕНИ
+# ==============================================
+def chart_time(timestamp):
+    """Перевод времени Unix в секундах (число или массив) в локальную дату matplotlib"""
+    offset = datetime.now().astimezone().utcoffset().total_seconds()
+    return (timestamp + offset) / 86400.0
+
+
+class RingBuffer:
+    """
+    Кольцевой буфер фиксированной вместимости на массиве NumPy
+    
+    Каждое значение пишется дважды: в позицию i и i + capacity. Поэтому
+    последние значения всегда лежат в массиве непрерывно, и view()
+    возвращает срез без копирования, а добавление выполняется за O(1).
+    """
+    
+    def __init__(self, capacity, dtype=np.float64):
+        """Выделение массива на 2 * capacity элементов"""
+        self.capacity = capacity
+        self.data = np.zeros(2 * capacity, dtype=dtype)
+        self.start = 0
+        self.count = 0
+    
+    def __len__(self):
+        """Число хранимых значений"""
+        return self.count
+    
+    def append(self, value):
+        """Добавление значения, при заполнении вытесняется самое старое"""
+        end = (self.start + self.count) % self.capacity
+        self.data[end] = value
+        self.data[end + self.capacity] = value
+        if self.count < self.capacity:
+            self.count += 1
+        else:
+            self.start = (self.start + 1) % self.capacity
+    
+    def extend(self, values):
+        """Заполнение буфера последними значениями массива"""
+        values = np.asarray(values, dtype=self.data.dtype)[-self.capacity:]
+        count = len(values)
+        self.data[:count] = values
+        self.data[self.capacity:self.capacity + count] = values
+        self.start = 0
+        self.count = count
+    
+    def view(self):
+        """Значения от старых к новым (срез без копирования, только для чтения)"""
+        view = self.data[self.start:self.start + self.count]
+        view.flags.writeable = False
+        return view
+    
+    def clear(self):
+        """Удаление всех значений"""
+        self.start = 0
+        self.count = 0
+
+
+class RealtimeSeries:
+    """Ряд графика реального времени: время (дата matplotlib) и цена в кольцевых буферах"""
+    
+    def __init__(self, capacity=REALTIME_HISTORY):
+        """Создание буферов с вместимостью в пределах [REALTIME_MIN_POINTS, REALTIME_MAX_POINTS]"""
+        capacity = min(max(capacity, REALTIME_MIN_POINTS), REALTIME_MAX_POINTS)
+        self.times = RingBuffer(capacity, np.float64)
+        self.prices = RingBuffer(capacity, np.float64)
+        self.lock = threading.Lock()
+    
+    def __len__(self):
+        """Число точек ряда"""
+        return len(self.prices)
+    
+    def append(self, timestamp, price):
+        """Добавление точки; timestamp - время Unix в секундах"""
+        with self.lock:
+            self.times.append(chart_time(timestamp))
+            self.prices.append(price)
+    
+    def extend(self, timestamps, prices):
+        """Заполнение ряда массивами времени Unix (сек) и цен"""
+        with self.lock:
+            self.times.extend(chart_time(np.asarray(timestamps, dtype=np.float64)))
+            self.prices.extend(prices)
+    
+    def views(self):
+        """Согласованная пара срезов (время, цены) без копирования"""
+        with self.lock:
+            return self.times.view(), self.prices.view()
+
+# ==============================================
+# КЛАСС ГРАФИКА РЕАЛЬНОГО ВРЕМЕНИ
+# ==============================================
+class RealtimeChart:
+    """
+    График реального времени с инкрементальной перерисовкой
+    
+    Оформление осей и линия создаются один раз. Новые точки передаются
+    через set_data, пределы осей меняются только когда данные выходят за них,
+    а в остальных случаях на canvas перерисовывается только линия (blitting).
+    """
+    
+    def __init__(self, master, exchange):
+        """
+        Создание фигуры, осей и линии графика
         
-        # Очередь для безопасного обновления UI из других потоков
-        self.ui_queue = Queue()
+        Args:
+            master: Tk-контейнер для canvas или None для отрисовки в памяти (замеры без окна)
+            exchange: Название биржи для заголовка
+        """
+        self.exchange = exchange
+        self.symbol = None
         
-        # Структуры для хранения данных
-        self.price_history = {'Bybit': [], 'MEXC': [], 'Binance': []}
-        self.time_history = []
-        self.realtime_data = {
-            'Bybit': {'prices': [], 'times': []},
-            'MEXC': {'prices': [], 'times': []},
-            'Binance': {'prices': [], 'times': []}
-        }
+        # Создание фигуры matplotlib
+        self.figure = Figure(figsize=(4, 2.5), dpi=100, facecolor=CARD_BG)
+        self.ax = self.figure.add_subplot(111)
+        self.ax.set_facecolor(CARD_BG)
         
-        # Настройки обновления
-        self.running = True
-        self.update_interval = 10  # Интервал основного обновления (сек)
-        self.realtime_interval = 3  # Интервал обновления реального времени (сек)
+        # Настройка осей
+        self.ax.tick_params(axis='x', colors=TEXT_COLOR, labelsize=7, rotation=45)
+        self.ax.tick_params(axis='y', colors=TEXT_COLOR, labelsize=8)
+        self.ax.yaxis.set_major_formatter(plt.FormatStrFormatter('%.2f'))
+        self.ax.xaxis.set_major_formatter(DateFormatter('%H:%M'))
+        self.ax.set_xlabel('Время', color=TEXT_COLOR, fontsize=8)
+        self.ax.set_ylabel('Цена (USD)', color=TEXT_COLOR, fontsize=8)
+        self.ax.set_title(f'{exchange} (Real-time)', color=TEXT_COLOR, fontsize=9)
+        self.figure.subplots_adjust(bottom=0.25, left=0.15)
         
-        # Инициализация анимации загрузки
-        self._init_loading_animation()
+        # Настройка границ
+        for spine in self.ax.spines.values():
+            spine.set_color(ACCENT_COLOR)
         
-        # Запуск фоновых потоков
-        self._start_background_threads()
+        # Линия рисуется отдельно от фона, поэтому помечается как анимированная
+        self.line, = self.ax.plot([], [], color=GREEN_COLOR, linewidth=1, animated=True)
+        self.background = None
+        self.needs_full_draw = True
         
-        # Обработчики событий
-        self.root.after(100, self.process_ui_queue)
-        self.root.after(150, self.initial_loading)
-        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+        # Встраивание в Tkinter
+        if master is None:
+            self.canvas = FigureCanvasAgg(self.figure)
+        else:
+            self.canvas = FigureCanvasTkAgg(self.figure, master=master)
+        self.canvas.mpl_connect('draw_event', self._on_draw)
+        # Полная перерисовка выполняется Tk позже (draw_idle), поэтому измеряется сам canvas.draw
+        self.canvas.draw = METRICS.timed(self.canvas.draw, 'chart_draw_seconds', chart='realtime')
+        self.canvas.draw()
+        if master is not None:
+            self.canvas.get_tk_widget().pack(fill="both", expand=True)
     
-    def _init_loading_animation(self):
-        """Инициализация анимации загрузки"""
-        self.loading_canvas = tk.Canvas(
-            self.main_frame.scrollable_frame, 
-            bg=DARK_BG, 
-            height=30, 
-            highlightthickness=0
-        )
-        self.loading_animation = LoadingAnimation(
-            self.loading_canvas, 
-            x=50, 
-            y=5, 
-            size=8, 
-            color=ACCENT_COLOR
-        )
-        self.loading_canvas.pack_forget()
+    def _on_draw(self, event):
+        """Сохранение фона после полной перерисовки и отрисовка линии поверх него"""
+        self.background = self.canvas.copy_from_bbox(self.ax.bbox)
+        self.ax.draw_artist(self.line)
     
-    def _start_background_threads(self):
-        """Запуск фоновых потоков для обновления данных"""
-        # Поток для основного обновления данных
-        self.update_thread = threading.Thread(target=self.auto_update, daemon=True)
-        self.update_thread.start()
+    def set_symbol(self, symbol):
+        """Смена заголовка при выборе другой криптовалюты"""
+        if symbol == self.symbol:
+            return
+        self.symbol = symbol
+        self.ax.set_title(f'{self.exchange} - {symbol} (Real-time)', color=TEXT_COLOR, fontsize=9)
+        self.needs_full_draw = True
+    
+    def set_data(self, times, prices):
+        """
+        Замена данных линии
         
-        # Поток для обновления данных в реальном времени
-        self.realtime_thread = threading.Thread(target=self.auto_update_realtime, daemon=True)
-        self.realtime_thread.start()
+        Args:
+            times: Массив дат matplotlib (см. chart_time)
+            prices: Массив цен
+        """
+        self.line.set_data(times, prices)
+        # Линия сразу делает собственную копию точек, поэтому срезы кольцевого
+        # буфера можно передавать без копирования
+        self.line.recache(always=True)
+        if len(prices) and self._out_of_limits(times, prices):
+            self._rescale(times, prices)
     
-    def initial_loading(self):
-        """Показ анимации загрузки при старте"""
-        self.show_loading()
-        self.root.after(1000, self.hide_loading)
+    def _out_of_limits(self, x, prices):
+        """Проверка выхода данных за текущие пределы осей"""
+        x_min, x_max = self.ax.get_xlim()
+        y_min, y_max = self.ax.get_ylim()
+        return (x[0] < x_min or x[-1] > x_max
+                or prices.min() < y_min or prices.max() > y_max)
     
-    def show_loading(self):
-        """Показать анимацию загрузки"""
-        self.loading_canvas.pack(fill='x', pady=10)
-        self.loading_animation.start()
-        self.root.update()
+    def _rescale(self, x, prices):
+        """Новые пределы осей с запасом, чтобы следующие точки в них поместились"""
+        span = max(x[-1] - x[0], REALTIME_MIN_SPAN / 86400)
+        self.ax.set_xlim(x[0], x[-1] + span * REALTIME_HEADROOM)
+        
+        low, high = prices.min(), prices.max()
+        pad = max((high - low) * 0.25, abs(high) * 1e-4, 1e-8)
+        self.ax.set_ylim(low - pad, high + pad)
+        self.needs_full_draw = True
     
-    def hide_loading(self):
-        """Скрыть анимацию загрузки"""
-        self.loading_animation.stop()
-        self.loading_canvas.pack_forget()
-        self.root.update()
+    def reset(self):
+        """Очистка линии и заголовка"""
+        self.symbol = None
+        self.line.set_data([], [])
+        self.ax.set_title(f'{self.exchange} (Real-time)', color=TEXT_COLOR, fontsize=9)
+        self.needs_full_draw = True
     
-    def _setup_styles(self):
-        """Настройка стилей для элементов интерфейса"""
-        style = ttk.Style()
-        style.theme_use('clam')
+    def draw(self):
+        """Перерисовка: полная при смене осей, иначе только линия поверх сохраненного фона"""
+        if self.needs_full_draw or self.background is None:
+            self.needs_full_draw = False
+            self.canvas.draw_idle()
+            return
+        with METRICS.timer('chart_draw_seconds', chart='realtime_blit'):
+            self.canvas.restore_region(self.background)
+            self.ax.draw_artist(self.line)
+            self.canvas.blit(self.ax.bbox)
+
+# ==============================================
+# ПЛАНИРОВЩИК ОТРИСОВКИ
+# ==============================================
+class RenderScheduler:
+    """
+    Объединение обновлений данных в кадры отрисовки в потоке Tk
+    
+    Фоновые потоки только публикуют данные для виджета. Для каждого виджета
+    хранится лишь последняя публикация (флаг "грязный" вместе с данными),
+    поэтому сколько бы обновлений ни пришло между кадрами, виджет
+    перерисовывается один раз за кадр, а частота кадров ограничена.
+    """
+    
+    def __init__(self, max_fps=RENDER_MAX_FPS):
+        """Инициализация планировщика"""
+        self.frame_interval = max(1, int(1000 / max_fps))
+        self.renderers = {}
+        self.pending = {}
+        self.lock = threading.Lock()
+    
+    def register(self, kind, renderer):
+        """Регистрация функции отрисовки renderer(ключ, данные) для вида виджетов"""
+        self.renderers[kind] = renderer
+    
+    def publish(self, kind, key, data):
+        """Публикация данных для виджета (можно вызывать из любого потока)"""
+        with self.lock:
+            self.pending[(kind, key)] = (data, time.perf_counter())
+    
+    def discard(self, kind):
+        """Отмена неотрисованных публикаций указанного вида"""
+        with self.lock:
+            for item in [item for item in self.pending if item[0] == kind]:
+                del self.pending[item]
+    
+    def render_frame(self):
+        """
+        Отрисовка всех изменившихся виджетов (только в потоке Tk)
         
-        # Базовые стили
-        style.configure('.', background=DARK_BG, foreground=TEXT_COLOR)
-        style.configure('TFrame', background=DARK_BG)
-        style.configure('TLabel', background=DARK_BG, foreground=TEXT_COLOR, font=('Arial', 10))
-        style.configure('TButton', background=CARD_BG, foreground=TEXT_COLOR, 
-                       font=('Arial', 10, 'bold'), borderwidth=0)
-        style.map('TButton', background=[('active', ACCENT_COLOR)])
+        Returns:
+            Число перерисованных виджетов
+        """
+        with self.lock:
+            if not self.pending:
+                return 0
+            pending, self.pending = self.pending, {}
         
-        # Специальные стили
-        style.configure('Accent.TButton', background=ACCENT_COLOR, foreground=DARK_BG)
-        style.configure('Save.TButton', background=SAVE_COLOR, foreground=DARK_BG)
-        style.map('Save.TButton', 
-                 background=[('active', '#3aa856')],
-                 foreground=[('active', DARK_BG)])
-        style.configure('Header.TLabel', font=('Arial', 16, 'bold'), foreground=ACCENT_COLOR)
-        style.configure('Buy.TLabel', foreground=GREEN_COLOR, font=('Arial', 12, 'bold'))
-        style.configure('Sell.TLabel', foreground=RED_COLOR, font=('Arial', 12, 'bold'))
-        style.configure('Table.TLabel', font=('Arial', 11), anchor='center')
-        style.configure('TableHeader.TLabel', font=('Arial', 11, 'bold'), anchor='center')
-        style.configure('Loading.TCanvas', background=DARK_BG)
+        for (kind, key), (data, published) in pending.items():
+            start = time.perf_counter()
+            METRICS.observe('render_delay_seconds', start - published, kind=kind)
+            try:
+                self.renderers[kind](key, data)
+            except Exception as e:
+                METRICS.inc('update_errors_total', stage=f"render_{kind}")
+                print(f"Ошибка отрисовки {kind} {key}: {e}")
+            METRICS.observe('render_seconds', time.perf_counter() - start, kind=kind)
+        return len(pending)
+
+# ==============================================
+# ДВИЖОК ПАРАЛЛЕЛЬНЫХ ЗАПРОСОВ
+# ==============================================
+class FetchEngine:
+    """Параллельное выполнение всех запросов цикла обновления с общим дедлайном"""
     
-    def _create_ui(self):
-        """Создание пользовательского интерфейса"""
-        self.main_frame = ModernScrollableFrame(self.root)
-        self.main_frame.pack(fill="both", expand=True)
-        
-        # Создание всех компонентов интерфейса
-        self._create_header()
-        self._create_best_price_card()
-        self._create_centered_price_table()
-        self._create_realtime_charts()
-        self._create_weekly_charts()
-        self._create_top10_table()
+    def __init__(self, max_workers=FETCH_WORKERS):
+        """Инициализация пула потоков для запросов"""
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="fetch")
+        # Отдельный пул для задач, которые сами запускают запросы в основном пуле:
+        # в основном пуле они ждали бы собственные подзадачи, стоящие за ними в очереди
+        self.nested_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="fetch-nested")
     
-    def _create_header(self):
-        """Создание верхней панели приложения"""
-        header_frame = ModernCard(self.main_frame.scrollable_frame)
-        header_frame.pack(fill="x", padx=10, pady=10)
+    def run_cycle(self, tasks, on_result=None, deadline=CYCLE_DEADLINE, on_late=None, name="cycle", nested=None):
+        """
+        Запуск всех задач цикла одновременно
         
-        # Заголовок приложения
-        title_label = tk.Label(
-            header_frame.card_container, 
-            text="АГРЕГАТОР КРИПТОВАЛЮТЫ", 
-            bg=CARD_BG, 
-            fg=TEXT_COLOR,
-            font=('Arial', 20, 'bold')
-        )
-        title_label.pack(side="left", padx=10, pady=5)
+        Args:
+            tasks: Словарь {ключ: (функция, аргументы)}
+            on_result: Callback(ключ, результат), вызывается по мере готовности каждого запроса
+            deadline: Максимальная длительность цикла (сек)
+            on_late: Callback(ключ, результат) для уже выполняющихся запросов, которые
+                завершатся после дедлайна (вызывается потоком пула); без него они не доставляются
+            name: Название цикла для метрик
+            nested: Словарь задач в том же формате, которые сами вызывают run_cycle
+                (выполняются в отдельном пуле)
         
-        # Панель управления
-        control_frame = tk.Frame(header_frame.card_container, bg=CARD_BG)
-        control_frame.pack(side="right", padx=10, pady=5)
+        Returns:
+            Словарь {ключ: результат} для запросов, успевших до дедлайна
+        """
+        start = time.perf_counter()
+        futures = {
+            self.nested_executor.submit(func, *args): key
+            for key, (func, args) in (nested or {}).items()
+        }
+        futures.update({
+            self.executor.submit(func, *args): key
+            for key, (func, args) in tasks.items()
+        })
+        results = {}
         
-        # Кнопка сохранения данных
-        save_btn = ttk.Button(
-            control_frame, 
-            text="💾 Сохранить", 
-            style='Save.TButton', 
-            command=self.save_data_to_file
-        )
-        save_btn.pack(side="left", padx=5)
+        try:
+            for future in as_completed(futures, timeout=deadline):
+                key = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    METRICS.inc('task_errors_total', cycle=name)
+                    print(f"Ошибка запроса {key}: {e}")
+                    result = None
+                
+                results[key] = result
+                if on_result is not None:
+                    try:
+                        on_result(key, result)
+                    except Exception as e:
+                        print(f"Ошибка обработки результата {key}: {e}")
+        except FuturesTimeoutError:
+            # Незавершенные запросы отменяются, в UI остаются последние значения
+            late = [key for future, key in futures.items() if not future.done()]
+            METRICS.inc('cycle_timeouts_total', cycle=name)
+            METRICS.inc('cycle_late_requests_total', len(late), cycle=name)
+            print(f"Дедлайн цикла истек, не успели {len(late)} запросов: {late}")
+            # Запросы из очереди отменяются, а уже начатые при on_late доставляются по завершении
+            for future, key in futures.items():
+                if key not in results and not future.cancel() and on_late is not None:
+                    future.add_done_callback(lambda f, key=key: self._deliver_late(key, f, on_late))
         
-        # Выбор криптовалюты
-        self.crypto_var = tk.StringVar(value="BTC")
-        crypto_menu = ttk.Combobox(
-            control_frame,
-            textvariable=self.crypto_var,
-            values=["BTC", "ETH", "BNB", "SOL", "XRP", "ADA", "DOGE", "DOT", "AVAX"],
-            state="readonly",
+        METRICS.observe('cycle_seconds', time.perf_counter() - start, cycle=name)
+        return results
+    
+    @staticmethod
+    def _deliver_late(key, future, on_late):
+        """Доставка результата запроса, завершившегося после дедлайна"""
+        try:
+            result = future.result()
+        except Exception as e:
+            print(f"Ошибка запроса {key}: {e}")
+            result = None
+        try:
+            on_late(key, result)
+        except Exception as e:
+            print(f"Ошибка обработки результата {key}: {e}")
+    
+    def shutdown(self):
+        """Остановка пулов потоков"""
+        self.nested_executor.shutdown(wait=False, cancel_futures=True)
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+# ==============================================
+# HTTP-ТРАНСПОРТ
+# ==============================================
+class HttpTransport:
+    """
+    Общий HTTP-клиент всех адаптеров бирж
+    
+    Держит пул постоянных соединений на каждый хост (keep-alive, без повторных
+    TLS-рукопожатий в установившемся режиме), разделяет таймауты соединения и
+    чтения и повторяет GET при сетевых ошибках и ответах 502/503/504 с
+    экспоненциальной паузой со случайным разбросом. Ответы 429/418 не
+    повторяются: их обрабатывает RateLimitGovernor.
+    
+    При USE_HTTP2 и установленном httpx[http2] запросы идут по HTTP/2,
+    иначе через requests.
+    """
+    
+    RETRY_STATUSES = (502, 503, 504)
+    
+    def __init__(self, pool_size=HTTP_POOL_SIZE, retries=HTTP_RETRIES, http2=USE_HTTP2):
+        """
+        Инициализация транспорта
+        
+        Args:
+            pool_size: Число соединений в пуле на один хост
+            retries: Число повторов GET после неудачной попытки
+            http2: Использовать HTTP/2, если доступен httpx[http2]
+        """
+        self.retries = retries
+        self.http2 = http2 and httpx is not None and h2 is not None
+        self.lock = threading.Lock()
+        self.stats = {'requests': 0, 'retries': 0, 'errors': 0}
+        
+        if self.http2:
+            self.client = httpx.Client(
+                http2=True,
+                headers={'User-Agent': HTTP_USER_AGENT},
+                limits=httpx.Limits(
+                    max_connections=pool_size * HTTP_MAX_HOSTS,
+                    max_keepalive_connections=pool_size * HTTP_MAX_HOSTS
+                )
+            )
+            # Для HTTP/2 новые соединения определяются по объекту сетевого потока ответа
+            self.streams = {}
+        else:
+            self.client = requests.Session()
+            self.client.headers.update({'User-Agent': HTTP_USER_AGENT})
+            # Пул должен вмещать все параллельные запросы к одной бирже
+            self.pool_adapter = requests.adapters.HTTPAdapter(
+                pool_connections=HTTP_MAX_HOSTS, pool_maxsize=pool_size
+            )
+            self.client.mount('https://', self.pool_adapter)
+            self.client.mount('http://', self.pool_adapter)
+    
+    def get(self, url, params=None, timeout=None):
+        """
+        GET-запрос с повторами
+        
+        Args:
+            url: Адрес
+            params: Параметры запроса
+            timeout: Таймаут чтения (сек); таймаут соединения - HTTP_CONNECT_TIMEOUT
+        
+        Returns:
+            Ответ requests.Response или httpx.Response (status_code, headers, json(), raise_for_status())
+        """
+        read_timeout = timeout if timeout is not None else HTTP_READ_TIMEOUT
+        attempt = 0
+        while True:
+            with self.lock:
+                self.stats['requests'] += 1
+            try:
+                response = self._send(url, params, min(HTTP_CONNECT_TIMEOUT, read_timeout), read_timeout)
+                if response.status_code not in self.RETRY_STATUSES or attempt >= self.retries:
+                    return response
+            except self._network_errors():
+                if attempt >= self.retries:
+                    with self.lock:
+                        self.stats['errors'] += 1
+                    raise
+            
+            # Пауза растет вдвое с каждой попыткой, разброс разводит повторы параллельных потоков
+            attempt += 1
+            with self.lock:
+                self.stats['retries'] += 1
+            time.sleep(random.uniform(0, HTTP_BACKOFF * 2 ** attempt))
+    
+    def _send(self, url, params, connect_timeout, read_timeout):
+        """Одна попытка запроса"""
+        if self.http2:
+            timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+            response = self.client.get(url, params=params, timeout=timeout)
+            self._count_stream(url, response)
+            return response
+        return self.client.get(url, params=params, timeout=(connect_timeout, read_timeout))
+    
+    def _network_errors(self):
+        """Исключения, после которых запрос можно повторить"""
+        if self.http2:
+            return (httpx.TransportError,)
+        return (requests.ConnectionError, requests.Timeout)
+    
+    def _count_stream(self, url, response):
+        """Учет нового или переиспользованного соединения HTTP/2"""
+        stream = response.extensions.get('network_stream')
+        host = urlsplit(url).netloc
+        with self.lock:
+            counters = self.streams.setdefault(host, {'requests': 0, 'connections': 0, 'seen': set()})
+            counters['requests'] += 1
+            if stream is not None and id(stream) not in counters['seen']:
+                counters['seen'].add(id(stream))
+                counters['connections'] += 1
+    
+    def pool_stats(self):
+        """
+        Попадания в пул по хостам
+        
+        Returns:
+            Словарь {хост: {'requests', 'new_connections', 'reused'}}; при работе
+            без холодных рукопожатий new_connections перестает расти
+        """
+        result = {}
+        if self.http2:
+            with self.lock:
+                items = [(host, c['requests'], c['connections']) for host, c in self.streams.items()]
+        else:
+            pools = self.pool_adapter.poolmanager.pools
+            items = []
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is not None:
+                    items.append((f"{pool.host}:{pool.port}", pool.num_requests, pool.num_connections))
+        for host, requests_count, connections in items:
+            result[host] = {
+                'requests': requests_count,
+                'new_connections': connections,
+                'reused': requests_count - connections,
+            }
+        return result
+    
+    def status(self):
+        """Счетчики транспорта для диагностики"""
+        with self.lock:
+            stats = dict(self.stats)
+        return {"http2": self.http2, "pools": self.pool_stats(), **stats}
+    
+    def close(self):
+        """Закрытие всех соединений"""
+        self.client.close()
+
+# ==============================================
+# ОГРАНИЧЕНИЕ ЧАСТОТЫ ЗАПРОСОВ
+# ==============================================
+class RateLimitError(Exception):
+    """Запрос не отправлен: лимит биржи исчерпан или действует блокировка"""
+
+
+class TokenBucket:
+    """
+    Ведро токенов для одного лимита биржи
+    
+    Токены (единицы веса запросов) восполняются равномерно: capacity за window секунд.
+    Не используется отдельно от RateLimitGovernor, все вызовы идут под его блокировкой.
+    """
+    
+    def __init__(self, capacity, window):
+        """
+        Args:
+            capacity: Лимит биржи (вес за окно)
+            window: Длительность окна лимита (сек)
+        """
+        self.limit = capacity
+        self.capacity = capacity * RATE_LIMIT_HEADROOM
+        self.rate = self.capacity / window
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+    
+    def refill(self, now):
+        """Восполнение токенов за прошедшее время"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+    
+    def required(self, weight, priority):
+        """Сколько токенов должно быть в ведре, чтобы запрос с таким приоритетом прошел"""
+        reserve = self.capacity * RATE_LIMIT_RESERVE[priority]
+        return min(weight + reserve, self.capacity)
+    
+    def sync(self, remaining):
+        """Учет остатка лимита, сообщенного биржей (запас RATE_LIMIT_HEADROOM сохраняется)"""
+        self.tokens = min(self.tokens, remaining - (self.limit - self.capacity))
+
+
+class RateLimitGovernor:
+    """
+    Общий регулятор запросов ко всем биржам
+    
+    Для каждой биржи держит ведро общего лимита (ExchangeAdapter.rate_limit) и ведра
+    лимитов отдельных эндпоинтов (ExchangeAdapter.endpoint_limits). Перед запросом
+    списывается его вес; если токенов не хватает, запрос ждет восполнения не дольше
+    RATE_LIMIT_MAX_WAIT. Часть ведра зарезервирована за более важными запросами:
+    при почти исчерпанном лимите первыми откладываются свечи, затем топ-10 и лучшие
+    цены, а котировки реального времени проходят до последнего токена.
+    
+    Остаток лимита из заголовков ответов биржи уточняет состояние ведер, а ответы
+    429/418 блокируют биржу на время из Retry-After.
+    """
+    
+    def __init__(self, max_wait=RATE_LIMIT_MAX_WAIT):
+        """Инициализация регулятора"""
+        self.max_wait = max_wait
+        self.buckets = {}
+        self.banned_until = {}
+        self.condition = threading.Condition()
+        self.local = threading.local()
+        self.stats = {'waits': 0, 'deferred': 0, 'bans': 0}
+    
+    @contextmanager
+    def priority(self, level):
+        """Приоритет запросов, выполняемых в этом потоке внутри блока with"""
+        previous = getattr(self.local, 'priority', None)
+        self.local.priority = level
+        try:
+            yield
+        finally:
+            self.local.priority = previous
+    
+    def call(self, level, func, *args):
+        """Вызов функции с заданным приоритетом запросов (для задач FetchEngine)"""
+        with self.priority(level):
+            return func(*args)
+    
+    def _buckets_for(self, adapter, path):
+        """Ведра, из которых списывается вес запроса (создаются при первом обращении)"""
+        buckets = []
+        limits = [((adapter.name, None), adapter.rate_limit), ((adapter.name, path), adapter.endpoint_limits.get(path))]
+        for key, limit in limits:
+            if limit is None:
+                continue
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = self.buckets[key] = TokenBucket(*limit)
+            buckets.append(bucket)
+        return buckets
+    
+    def acquire(self, adapter, path, weight):
+        """
+        Списание веса запроса, при необходимости с ожиданием
+        
+        Raises:
+            RateLimitError: Если биржа заблокирована или токенов не будет дольше max_wait
+        """
+        priority = getattr(self.local, 'priority', None)
+        if priority is None:
+            priority = PRIORITY_TOP10
+        
+        started = time.monotonic()
+        with self.condition:
+            buckets = self._buckets_for(adapter, path)
+            waited = False
+            while True:
+                now = time.monotonic()
+                banned = self.banned_until.get(adapter.name, 0) - now
+                if banned > 0:
+                    raise RateLimitError(f"{adapter.name}: блокировка за превышение лимита еще {banned:.0f} с")
+                
+                delay = 0
+                for bucket in buckets:
+                    bucket.refill(now)
+                    missing = bucket.required(weight, priority) - bucket.tokens
+                    if missing > 0:
+                        delay = max(delay, missing / bucket.rate)
+                
+                if delay == 0:
+                    for bucket in buckets:
+                        bucket.tokens -= weight
+                    if waited:
+                        self.stats['waits'] += 1
+                    return
+                
+                if now - started + delay > self.max_wait:
+                    self.stats['deferred'] += 1
+                    raise RateLimitError(f"{adapter.name}: лимит запросов исчерпан, запрос {path} отложен")
+                waited = True
+                self.condition.wait(delay)
+    
+    def observe(self, adapter, path, response):
+        """Учет ответа биржи: блокировка при 429/418 и остаток лимита из заголовков"""
+        if response.status_code in (429, 418):
+            try:
+                retry_after = float(response.headers.get('Retry-After'))
+            except (TypeError, ValueError):
+                retry_after = RATE_LIMIT_BAN_DEFAULT
+            with self.condition:
+                self.banned_until[adapter.name] = time.monotonic() + retry_after
+                self.stats['bans'] += 1
+            print(f"{adapter.name}: превышен лимит запросов (HTTP {response.status_code}), пауза {retry_after:.0f} с")
+            return
+        
+        remaining = adapter.rate_limit_remaining(response.headers)
+        if remaining is None:
+            return
+        with self.condition:
+            # Остаток относится к общему лимиту биржи, а при его отсутствии - к эндпоинту
+            buckets = self._buckets_for(adapter, path)
+            if buckets:
+                buckets[0].refill(time.monotonic())
+                buckets[0].sync(remaining)
+    
+    def status(self):
+        """Состояние ведер и блокировок для диагностики"""
+        now = time.monotonic()
+        with self.condition:
+            buckets = {}
+            for (exchange, path), bucket in self.buckets.items():
+                bucket.refill(now)
+                buckets[f"{exchange} {path or '*'}"] = round(bucket.tokens / bucket.capacity, 3)
+            banned = {
+                exchange: round(until - now, 1)
+                for exchange, until in self.banned_until.items()
+                if until > now
+            }
+            return {"buckets": buckets, "banned": banned, **self.stats}
+
+# ==============================================
+# РАЗБОР JSON
+# ==============================================
+def decode_json(content):
+    """Разбор JSON из байтов ответа: orjson, если установлен, иначе стандартный json"""
+    if orjson is not None and JSON_BACKEND in ("auto", "orjson", "msgspec"):
+        return orjson.loads(content)
+    return json.loads(content)
+
+
+class JsonSchema:
+    """
+    Описание полей ответа эндпоинта, которые читают адаптеры
+    
+    Схема записывается как образец ответа: словарь - объект, список из одного
+    элемента - массив таких элементов, тип - значение. Например
+    [{"symbol": str, "lastPrice": str}] для списка тикеров Binance.
+    
+    При установленном msgspec по схеме строится типизированный декодер: поля,
+    которых нет в схеме, пропускаются без разбора, а результат имеет тот же вид
+    словарей и списков, что и json.loads, только без лишних полей. Поля схемы,
+    которых нет в ответе или которые равны null, в результат не попадают
+    (omit_defaults), поэтому адаптеры читают их через get(). Если ответ не совпал
+    со схемой (биржа изменила формат или вернула ошибку), он разбирается
+    полностью, как без схемы.
+    """
+    
+    def __init__(self, spec):
+        """Построение декодера по образцу ответа"""
+        self.spec = spec
+        self.decoder = None
+        if msgspec is not None and JSON_BACKEND in ("auto", "msgspec"):
+            self.decoder = msgspec.json.Decoder(self._type(spec, "Schema"))
+    
+    def _type(self, spec, name):
+        """Тип msgspec для части схемы"""
+        if isinstance(spec, dict):
+            fields = []
+            rename = {}
+            for i, (key, value) in enumerate(spec.items()):
+                # Имена полей бирж не всегда допустимы в Python, поэтому поля нумеруются
+                field = f"f{i}"
+                rename[field] = key
+                fields.append((field, Optional[self._type(value, f"{name}_{i}")], None))
+            return msgspec.defstruct(name, fields, rename=rename, omit_defaults=True)
+        if isinstance(spec, list):
+            return list[self._type(spec[0], name)] if spec else list
+        return spec
+    
+    def decode(self, content):
+        """Разбор ответа в словари и списки только с полями схемы"""
+        if self.decoder is not None:
+            try:
+                return msgspec.to_builtins(self.decoder.decode(content))
+            except msgspec.ValidationError:
+                pass
+        return decode_json(content)
+
+# ==============================================
+# МОДЕЛЬ ДАННЫХ
+# ==============================================
+class Quote:
+    """Котировка одной пары на одной бирже; отсутствующие значения - None"""
+    
+    __slots__ = ('exchange', 'symbol', 'bid', 'ask', 'last', 'ts')
+    
+    def __init__(self, exchange, symbol, bid=None, ask=None, last=None, ts=None):
+        """
+        Args:
+            exchange: Биржа
+            symbol: Монета
+            bid: Лучшая цена покупки
+            ask: Лучшая цена продажи
+            last: Цена последней сделки
+            ts: Время получения (time.time())
+        """
+        self.exchange = exchange
+        self.symbol = symbol
+        self.bid = bid
+        self.ask = ask
+        self.last = last
+        self.ts = ts
+    
+    def __repr__(self):
+        return (f"Quote({self.exchange!r}, {self.symbol!r}, bid={self.bid}, ask={self.ask}, "
+                f"last={self.last}, ts={self.ts})")
+    
+    @property
+    def has_book(self):
+        """Известны обе лучшие цены"""
+        return self.bid is not None and self.ask is not None
+    
+    @property
+    def spread(self):
+        """Спред ask - bid или None"""
+        return self.ask - self.bid if self.has_book else None
+    
+    @property
+    def spread_percent(self):
+        """Спред в процентах от bid или None"""
+        if not self.has_book:
+            return None
+        return (self.ask - self.bid) / self.bid * 100 if self.bid != 0 else 0
+    
+    def to_dict(self):
+        """Словарь для JSON"""
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class Candle:
+    """Свеча: время открытия в мс и цены OHLC с объемом (None, если биржа их не отдает)"""
+    
+    __slots__ = ('ts', 'open', 'high', 'low', 'close', 'volume')
+    
+    def __init__(self, ts, open=None, high=None, low=None, close=None, volume=None):
+        self.ts = ts
+        self.open = open
+        self.high = high
+        self.low = low
+        self.close = close
+        self.volume = volume
+    
+    def __repr__(self):
+        return (f"Candle({self.ts}, open={self.open}, high={self.high}, low={self.low}, "
+                f"close={self.close}, volume={self.volume})")
+    
+    def to_list(self):
+        """Список [ts, open, high, low, close, volume] для JSON"""
+        return [self.ts, self.open, self.high, self.low, self.close, self.volume]
+
+
+class QuoteBatch:
+    """
+    Столбцовый набор котировок: одна запись - пара на бирже
+    
+    Цены хранятся в массивах float64 (NaN - нет значения), биржи - кодами в
+    общем списке exchanges, поэтому спреды и выборки считаются по всему набору
+    одной операцией numpy, а на запись приходится несколько десятков байт
+    вместо отдельного объекта.
+    """
+    
+    __slots__ = ('exchanges', 'exchange_codes', 'symbols', 'bids', 'asks', 'lasts', 'ts')
+    
+    def __init__(self, exchanges, exchange_codes, symbols, bids, asks, lasts, ts):
+        """
+        Args:
+            exchanges: Список бирж, на который ссылаются коды
+            exchange_codes: Массив int кодов бирж
+            symbols: Массив монет
+            bids, asks, lasts: Массивы цен
+            ts: Массив времени получения
+        """
+        self.exchanges = list(exchanges)
+        self.exchange_codes = exchange_codes
+        self.symbols = symbols
+        self.bids = bids
+        self.asks = asks
+        self.lasts = lasts
+        self.ts = ts
+    
+    def __len__(self):
+        return len(self.symbols)
+    
+    @classmethod
+    def from_books(cls, books, ts=None, exchanges=None):
+        """
+        Набор из лучших цен бирж
+        
+        Args:
+            books: Словарь {биржа: {символ: (bid, ask)}}; None вместо словаря биржи пропускается
+            ts: Время получения (по умолчанию текущее)
+            exchanges: Порядок бирж (по умолчанию порядок books)
+        """
+        exchanges = list(exchanges if exchanges is not None else books)
+        codes, symbols, pairs = [], [], []
+        for code, exchange in enumerate(exchanges):
+            book = books.get(exchange)
+            if not book:
+                continue
+            codes.append(np.full(len(book), code, dtype=np.int32))
+            symbols.extend(book.keys())
+            pairs.extend(book.values())
+        
+        size = len(symbols)
+        prices = np.array(pairs, dtype=np.float64).reshape(size, 2)
+        return cls(
+            exchanges,
+            np.concatenate(codes) if codes else np.empty(0, dtype=np.int32),
+            np.array(symbols, dtype=object),
+            prices[:, 0].copy(),
+            prices[:, 1].copy(),
+            np.full(size, np.nan),
+            np.full(size, time.time() if ts is None else ts)
+        )
+    
+    @classmethod
+    def from_quotes(cls, quotes, exchanges=None):
+        """Набор из списка Quote"""
+        quotes = list(quotes)
+        if exchanges is None:
+            exchanges = list(dict.fromkeys(quote.exchange for quote in quotes))
+        index = {exchange: code for code, exchange in enumerate(exchanges)}
+        
+        def column(name):
+            return np.array([getattr(q, name) for q in quotes], dtype=np.float64)
+        
+        return cls(
+            exchanges,
+            np.array([index[q.exchange] for q in quotes], dtype=np.int32),
+            np.array([q.symbol for q in quotes], dtype=object),
+            column('bid'), column('ask'), column('last'), column('ts')
+        )
+    
+    def spreads(self):
+        """Спреды ask - bid всех записей"""
+        return self.asks - self.bids
+    
+    def spread_percents(self):
+        """Спреды в процентах от bid (NaN при нулевом bid)"""
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(self.bids != 0, (self.asks - self.bids) / self.bids * 100, np.nan)
+    
+    def quote(self, i):
+        """Запись i в виде Quote"""
+        def value(array):
+            return None if np.isnan(array[i]) else float(array[i])
+        
+        return Quote(self.exchanges[self.exchange_codes[i]], self.symbols[i],
+                     value(self.bids), value(self.asks), value(self.lasts), value(self.ts))
+
+
+class CandleBatch:
+    """Столбцовый набор свечей одной серии: массивы времени (мс, int64) и цен (float64, NaN - нет значения)"""
+    
+    __slots__ = ('ts', 'open', 'high', 'low', 'close', 'volume')
+    
+    def __init__(self, ts, open, high, low, close, volume):
+        self.ts = ts
+        self.open = open
+        self.high = high
+        self.low = low
+        self.close = close
+        self.volume = volume
+    
+    def __len__(self):
+        return len(self.ts)
+    
+    @classmethod
+    def from_candles(cls, candles):
+        """Набор из списка Candle"""
+        def column(name):
+            return np.array([getattr(c, name) for c in candles], dtype=np.float64)
+        
+        return cls(
+            np.array([c.ts for c in candles], dtype=np.int64),
+            column('open'), column('high'), column('low'), column('close'), column('volume')
+        )
+    
+    def candles(self):
+        """Список Candle"""
+        return [
+            Candle(int(ts), *(None if np.isnan(v) else float(v) for v in values))
+            for ts, *values in zip(self.ts, self.open, self.high, self.low, self.close, self.volume)
+        ]
+
+# ==============================================
+# РАСЧЕТ СПРЕДОВ И ЛУЧШИХ ЦЕН
+# ==============================================
+class QuoteMatrix:
+    """
+    Цены N монет x M бирж в матрицах float64
+    
+    Отсутствующие и неположительные цены хранятся как NaN. Все метрики
+    считаются методом metrics() по всей матрице сразу, без циклов по биржам;
+    форматирование чисел в текст выполняется только при отрисовке.
+    """
+    
+    __slots__ = ('symbols', 'exchanges', 'bids', 'asks', 'lasts', 'index')
+    
+    def __init__(self, symbols, exchanges, bids=None, asks=None, lasts=None):
+        """
+        Args:
+            symbols: Монеты (строки матриц)
+            exchanges: Биржи (столбцы матриц)
+            bids, asks, lasts: Матрицы N x M или None (все значения NaN)
+        """
+        self.symbols = list(symbols)
+        self.exchanges = list(exchanges)
+        shape = (len(self.symbols), len(self.exchanges))
+        self.bids = bids if bids is not None else np.full(shape, np.nan)
+        self.asks = asks if asks is not None else np.full(shape, np.nan)
+        self.lasts = lasts if lasts is not None else np.full(shape, np.nan)
+        self.index = {symbol: i for i, symbol in enumerate(self.symbols)}
+    
+    @classmethod
+    def from_batch(cls, batch, exchanges=None, min_venues=1):
+        """
+        Матрицы из столбцового набора котировок
+        
+        Args:
+            batch: QuoteBatch
+            exchanges: Порядок столбцов (по умолчанию batch.exchanges)
+            min_venues: Оставить только монеты, известные хотя бы на стольких биржах
+        """
+        exchanges = list(exchanges if exchanges is not None else batch.exchanges)
+        position = {exchange: col for col, exchange in enumerate(exchanges)}
+        remap = np.array([position.get(exchange, -1) for exchange in batch.exchanges], dtype=np.int64)
+        cols = remap[batch.exchange_codes] if len(batch) else np.empty(0, dtype=np.int64)
+        
+        # Неположительные цены - признак отсутствия котировки
+        columns = [np.where(prices > 0, prices, np.nan) for prices in (batch.bids, batch.asks, batch.lasts)]
+        # Биржа есть в списке, и у пары известны обе лучшие цены или последняя цена
+        present = (cols >= 0) & (np.isfinite(columns[0] + columns[1]) | np.isfinite(columns[2]))
+        symbols, rows = np.unique(batch.symbols[present], return_inverse=True)
+        cols = cols[present]
+        
+        shape = (len(symbols), len(exchanges))
+        matrices = []
+        for values in columns:
+            matrix = np.full(shape, np.nan)
+            matrix[rows, cols] = values[present]
+            matrices.append(matrix)
+        
+        keep = np.bincount(rows, minlength=len(symbols)) >= min_venues
+        bids, asks, lasts = (matrix[keep] for matrix in matrices)
+        return cls(symbols[keep].tolist(), exchanges, bids, asks, lasts)
+    
+    @classmethod
+    def from_snapshot(cls, snapshot, exchanges, symbols):
+        """Матрица последних цен выбранных монет из QuoteSnapshot (None - все значения NaN)"""
+        matrix = cls(symbols, exchanges)
+        if snapshot is not None:
+            for col, exchange in enumerate(matrix.exchanges):
+                prices = snapshot.exchange_prices(exchange)
+                matrix.lasts[:, col] = [prices.get(symbol, np.nan) for symbol in matrix.symbols]
+            with np.errstate(invalid='ignore'):
+                matrix.lasts[~(matrix.lasts > 0)] = np.nan
+        return matrix
+    
+    def row(self, symbol):
+        """Номер строки монеты или None"""
+        return self.index.get(symbol)
+    
+    def metrics(self):
+        """Спреды, лучшие биржи и межбиржевой базис за один проход"""
+        return MarketMetrics(self)
+
+
+class MarketMetrics:
+    """
+    Метрики QuoteMatrix
+    
+    spread, spread_percent - спред ask - bid на каждой бирже (N x M);
+    best_bid/best_ask - лучшие цены продажи и покупки по всем биржам и их столбцы
+    (*_venue, -1 - цены нет ни на одной бирже); basis, basis_percent - межбиржевой
+    базис best_bid - best_ask (положителен, если купить на одной бирже и продать на
+    другой выгодно); low_last/high_last - минимальная и максимальная последняя цена.
+    """
+    
+    __slots__ = ('exchanges', 'spread', 'spread_percent', 'best_bid', 'best_bid_venue',
+                 'best_ask', 'best_ask_venue', 'basis', 'basis_percent',
+                 'low_last', 'low_last_venue', 'high_last', 'high_last_venue')
+    
+    def __init__(self, matrix):
+        """Расчет всех метрик по матрице"""
+        self.exchanges = matrix.exchanges
+        with np.errstate(invalid='ignore', divide='ignore'):
+            self.spread = matrix.asks - matrix.bids
+            self.spread_percent = self.spread / matrix.bids * 100
+            
+            self.best_ask, self.best_ask_venue = self._extreme(matrix.asks, np.inf, np.argmin)
+            self.best_bid, self.best_bid_venue = self._extreme(matrix.bids, -np.inf, np.argmax)
+            self.basis = self.best_bid - self.best_ask
+            self.basis_percent = self.basis / self.best_ask * 100
+            
+            self.low_last, self.low_last_venue = self._extreme(matrix.lasts, np.inf, np.argmin)
+            self.high_last, self.high_last_venue = self._extreme(matrix.lasts, -np.inf, np.argmax)
+    
+    @staticmethod
+    def _extreme(values, fill, arg):
+        """Лучшее значение по строкам и его столбец; NaN не участвуют"""
+        if values.shape[1] == 0:
+            return np.full(values.shape[0], np.nan), np.full(values.shape[0], -1)
+        venue = arg(np.where(np.isnan(values), fill, values), axis=1)
+        best = values[np.arange(values.shape[0]), venue]
+        venue = np.where(np.isnan(best), -1, venue)
+        return best, venue
+    
+    def venue(self, code):
+        """Название биржи по номеру столбца (None для -1)"""
+        return self.exchanges[code] if code >= 0 else None
+
+# ==============================================
+# АДАПТЕРЫ БИРЖ
+# ==============================================
+EXCHANGE_REGISTRY = {}
+
+
+def register_exchange(cls):
+    """Декоратор регистрации адаптера биржи по ее названию"""
+    EXCHANGE_REGISTRY[cls.name] = cls
+    return cls
+
+
+def create_adapters(names, session, governor=None):
+    """Создание адаптеров для списка бирж с учетом EXCHANGE_SETTINGS"""
+    return {
+        name: EXCHANGE_REGISTRY[name](session, governor=governor, **EXCHANGE_SETTINGS.get(name, {}))
+        for name in names
+    }
+
+
+class ExchangeAdapter:
+    """
+    Базовый адаптер биржи: построение запросов и разбор ответов
+    
+    Флаги возможностей показывают, какие быстрые пути есть у биржи:
+    пакетные тикеры (все пары одним запросом), стакан, свечи и WebSocket-поток.
+    Настройки подключения (base_url, stream_url, timeout) задаются атрибутами
+    класса и могут быть переопределены через EXCHANGE_SETTINGS.
+    
+    Лимиты запросов: rate_limit - общий лимит биржи (вес, окно в секундах),
+    endpoint_limits - лимиты отдельных эндпоинтов, endpoint_weights - вес запросов
+    (по умолчанию 1). Их соблюдает RateLimitGovernor, если он передан адаптеру.
+    """
+    
+    name = None
+    base_url = None
+    stream_url = None
+    timeout = 5
+    pair_separator = ""
+    kline_intervals = {}
+    
+    # Лимиты запросов
+    rate_limit = None
+    endpoint_limits = {}
+    endpoint_weights = {}
+    
+    # Флаги возможностей
+    supports_bulk_ticker = False
+    supports_depth = False
+    supports_klines = False
+    supports_streaming = False
+    supports_depth_stream = False
+    
+    # Стакан в потоке: правило проверки номеров (см. OrderBook) и приходит ли
+    # снимок по тому же каналу (иначе он загружается через REST)
+    depth_sequence = 'contiguous'
+    depth_snapshot_in_stream = False
+    
+    def __init__(self, session, base_url=None, stream_url=None, timeout=None, governor=None):
+        """Инициализация адаптера с общим HTTP-транспортом (HttpTransport или requests.Session) и регулятором частоты запросов"""
+        self.session = session
+        self.governor = governor
+        if base_url is not None:
+            self.base_url = base_url
+        if stream_url is not None:
+            self.stream_url = stream_url
+        if timeout is not None:
+            self.timeout = timeout
+    
+    def get(self, path, params=None, schema=None):
+        """GET-запрос к REST API биржи с учетом лимитов и проверкой ответа; schema - JsonSchema нужных полей"""
+        labels = {'exchange': self.name, 'endpoint': path}
+        try:
+            if self.governor is not None:
+                with METRICS.timer('rate_limit_wait_seconds', exchange=self.name):
+                    self.governor.acquire(self, path, self.request_weight(path, params))
+            with METRICS.timer('request_seconds', **labels):
+                response = self.session.get(f"{self.base_url}{path}", params=params, timeout=self.timeout)
+            if self.governor is not None:
+                self.governor.observe(self, path, response)
+            if response.status_code >= 400:
+                METRICS.inc('request_errors_total', reason=f"http_{response.status_code}", **labels)
+                response.raise_for_status()
+            data = schema.decode(response.content) if schema is not None else decode_json(response.content)
+            return self.unwrap(data)
+        except Exception as e:
+            # Ответы с кодом ошибки уже учтены выше
+            if getattr(e, 'response', None) is None:
+                METRICS.inc('request_errors_total', reason=METRICS.error_reason(e), **labels)
+            raise
+    
+    def request_weight(self, path, params):
+        """Вес запроса в единицах лимита биржи"""
+        return self.endpoint_weights.get(path, 1)
+    
+    def rate_limit_remaining(self, headers):
+        """Остаток лимита из заголовков ответа или None, если биржа его не сообщает"""
+        return None
+    
+    def unwrap(self, data):
+        """Извлечение полезной нагрузки из ответа (с проверкой кода ошибки биржи)"""
+        return data
+    
+    def pair(self, symbol):
+        """Название пары к USDT в формате биржи"""
+        return f"{symbol}{self.pair_separator}{QUOTE_ASSET}"
+    
+    def symbol_of(self, pair):
+        """Символ монеты из названия пары или None для пар не к USDT"""
+        suffix = f"{self.pair_separator}{QUOTE_ASSET}"
+        if pair and pair.endswith(suffix):
+            return pair[:-len(suffix)]
+        return None
+    
+    def _collect(self, items, pair_field, *fields):
+        """Сбор словаря {символ: значения полей} по списку тикеров с пропуском пустых"""
+        suffix = f"{self.pair_separator}{QUOTE_ASSET}"
+        cut = -len(suffix)
+        result = {}
+        
+        # Пакетные ответы содержат тысячи пар: пары не к USDT отбрасываются до чтения полей,
+        # а для одного и двух полей нет промежуточных списков
+        if len(fields) == 1:
+            field, = fields
+            for item in items:
+                pair = item.get(pair_field)
+                if pair and pair.endswith(suffix):
+                    value = item.get(field)
+                    if value:
+                        result[pair[:cut]] = float(value)
+        elif len(fields) == 2:
+            first, second = fields
+            for item in items:
+                pair = item.get(pair_field)
+                if pair and pair.endswith(suffix):
+                    a, b = item.get(first), item.get(second)
+                    if a and b:
+                        result[pair[:cut]] = (float(a), float(b))
+        else:
+            for item in items:
+                pair = item.get(pair_field)
+                if pair and pair.endswith(suffix):
+                    values = [item.get(field) for field in fields]
+                    if all(values):
+                        result[pair[:cut]] = tuple(float(value) for value in values)
+        return result
+    
+    def fetch_tickers(self):
+        """Последние цены всех пар {символ: цена}"""
+        raise NotImplementedError
+    
+    def fetch_book_tickers(self):
+        """Лучшие цены всех пар {символ: (bid, ask)}"""
+        raise NotImplementedError
+    
+    def fetch_ticker(self, symbol):
+        """Последняя цена одной пары"""
+        raise NotImplementedError
+    
+    def fetch_depth(self, symbol, limit):
+        """Стакан пары: (asks, bids), каждый - список (цена, объем) от лучшей цены"""
+        raise NotImplementedError
+    
+    def fetch_depth_snapshot(self, symbol, limit):
+        """Снимок стакана для синхронизации с потоком: (asks, bids, номер обновления или None)"""
+        asks, bids = self.fetch_depth(symbol, limit)
+        return asks, bids, None
+    
+    def fetch_klines(self, symbol, interval, limit, start=None):
+        """
+        Свечи: список Candle от старых к новым
+        
+        Без start - последние limit свечей, со start (время открытия в мс) - не более
+        limit свечей, открытых не раньше start.
+        """
+        raise NotImplementedError
+    
+    @staticmethod
+    def _kline_end(interval, limit, start):
+        """Время открытия последней из limit свечей, начиная со start (мс)"""
+        return start + (limit - 1) * KLINE_INTERVAL_SECONDS[interval] * 1000
+    
+    @staticmethod
+    def _candles(rows, scale=1):
+        """Свечи из строк [время открытия, open, high, low, close, volume], упорядоченные по времени"""
+        candles = [
+            Candle(int(row[0]) * scale, float(row[1]), float(row[2]), float(row[3]), float(row[4]), float(row[5]))
+            for row in rows
+        ]
+        candles.sort(key=lambda candle: candle.ts)
+        return candles
+    
+    @staticmethod
+    def _levels(levels):
+        """Преобразование уровней стакана в список (цена, объем)"""
+        return [(float(level[0]), float(level[1])) for level in levels]
+    
+    def stream_connect_url(self, url, symbols):
+        """Адрес подключения к потоку"""
+        return url
+    
+    def stream_subscribe_messages(self, symbols):
+        """Сообщения подписки, отправляемые после подключения"""
+        return []
+    
+    def stream_ping(self, ws):
+        """Пинг для удержания соединения"""
+        ws.ping()
+    
+    def parse_stream_message(self, message):
+        """Разбор сообщения потока в список (символ, last, bid, ask); отсутствующие значения - None"""
+        return []
+    
+    def depth_stream_connect_url(self, url, symbols):
+        """Адрес подключения к потоку стаканов"""
+        return url
+    
+    def depth_stream_subscribe_messages(self, symbols):
+        """Сообщения подписки на изменения стаканов"""
+        return []
+    
+    def parse_depth_message(self, message):
+        """
+        Разбор сообщения потока стаканов
+        
+        Returns:
+            Список (символ, снимок ли это, bids, asks, первый номер, последний номер, предыдущий номер);
+            bids и asks - списки [цена, объем], объем 0 означает удаление уровня
+        """
+        return []
+
+
+@register_exchange
+class BybitAdapter(ExchangeAdapter):
+    """Адаптер Bybit (API v5, спот)"""
+    
+    name = "Bybit"
+    base_url = "https://api.bybit.com"
+    stream_url = "wss://stream.bybit.com/v5/public/spot"
+    kline_intervals = {"1m": "1", "1h": "60", "1d": "D"}
+    # 600 запросов за 5 секунд с одного IP
+    rate_limit = (600, 5)
+    supports_bulk_ticker = supports_depth = supports_klines = supports_streaming = True
+    # Снимок приходит первым сообщением подписки; номер u растет, но не подряд
+    supports_depth_stream = depth_snapshot_in_stream = True
+    depth_sequence = 'monotonic'
+    
+    def unwrap(self, data):
+        if data['retCode'] != 0:
+            raise ValueError(f"retCode {data['retCode']}: {data.get('retMsg')}")
+        return data['result']
+    
+    # Схемы ответов
+    tickers_schema = JsonSchema({"retCode": int, "retMsg": str, "result": {
+        "list": [{"symbol": str, "lastPrice": str, "bid1Price": str, "ask1Price": str}]
+    }})
+    depth_schema = JsonSchema({"retCode": int, "retMsg": str, "result": {"a": [[str]], "b": [[str]]}})
+    
+    def rate_limit_remaining(self, headers):
+        remaining = headers.get('X-Bapi-Limit-Status')
+        return int(remaining) if remaining else None
+    
+    def fetch_tickers(self):
+        items = self.get("/v5/market/tickers", {"category": "spot"}, self.tickers_schema)['list']
+        return self._collect(items, 'symbol', 'lastPrice')
+    
+    def fetch_book_tickers(self):
+        items = self.get("/v5/market/tickers", {"category": "spot"}, self.tickers_schema)['list']
+        return self._collect(items, 'symbol', 'bid1Price', 'ask1Price')
+    
+    def fetch_ticker(self, symbol):
+        items = self.get("/v5/market/tickers", {"category": "spot", "symbol": self.pair(symbol)})['list']
+        return float(items[0]['lastPrice']) if items else None
+    
+    def fetch_depth(self, symbol, limit):
+        data = self.get("/v5/market/orderbook", {"category": "spot", "symbol": self.pair(symbol), "limit": limit},
+                        self.depth_schema)
+        return self._levels(data['a']), self._levels(data['b'])
+    
+    def fetch_klines(self, symbol, interval, limit, start=None):
+        params = {
+            "category": "spot", "symbol": self.pair(symbol),
+            "interval": self.kline_intervals[interval], "limit": limit
+        }
+        if start is not None:
+            params.update(start=start, end=self._kline_end(interval, limit, start))
+        data = self.get("/v5/market/kline", params)
+        # Bybit отдает свечи от новых к старым
+        return self._candles(data['list'])
+    
+    def stream_subscribe_messages(self, symbols):
+        topics = []
+        for symbol in symbols:
+            pair = self.pair(symbol)
+            topics += [f"tickers.{pair}", f"orderbook.1.{pair}"]
+        # Bybit принимает не более 10 топиков в одном запросе подписки
+        return [
+            {"op": "subscribe", "args": topics[i:i + 10]}
+            for i in range(0, len(topics), 10)
+        ]
+    
+    def stream_ping(self, ws):
+        ws.send(json.dumps({"op": "ping"}))
+    
+    def parse_stream_message(self, message):
+        topic = message.get('topic', '')
+        data = message.get('data') or {}
+        if topic.startswith('tickers.'):
+            return [(self.symbol_of(data.get('symbol')), data.get('lastPrice'), None, None)]
+        if topic.startswith('orderbook.1.'):
+            # Пустой список в дельте означает, что уровень не изменился
+            bid = data['b'][0][0] if data.get('b') else None
+            ask = data['a'][0][0] if data.get('a') else None
+            return [(self.symbol_of(data.get('s')), None, bid, ask)]
+        return []
+    
+    def depth_stream_subscribe_messages(self, symbols):
+        topics = [f"orderbook.{DEPTH_LEVELS}.{self.pair(symbol)}" for symbol in symbols]
+        return [
+            {"op": "subscribe", "args": topics[i:i + 10]}
+            for i in range(0, len(topics), 10)
+        ]
+    
+    def parse_depth_message(self, message):
+        if not message.get('topic', '').startswith('orderbook.'):
+            return []
+        data = message.get('data') or {}
+        update_id = data.get('u')
+        # u = 1 - биржа перезапустила поток стакана, сообщение заменяет стакан целиком
+        is_snapshot = message.get('type') == 'snapshot' or update_id == 1
+        return [(self.symbol_of(data.get('s')), is_snapshot, data.get('b') or [], data.get('a') or [],
+                 None, update_id, None)]
+
+
+@register_exchange
+class BinanceAdapter(ExchangeAdapter):
+    """Адаптер Binance (API v3, спот)"""
+    
+    name = "Binance"
+    base_url = "https://api.binance.com"
+    stream_url = "wss://stream.binance.com:9443/stream"
+    kline_intervals = {"1m": "1m", "1h": "1h", "1d": "1d"}
+    # Вес запросов за минуту с одного IP
+    rate_limit = (6000, 60)
+    endpoint_weights = {"/api/v3/depth": 5, "/api/v3/klines": 2}
+    # Вес тикеров: (одна пара, все пары)
+    ticker_weights = {"/api/v3/ticker/24hr": (2, 80), "/api/v3/ticker/bookTicker": (2, 4)}
+    supports_bulk_ticker = supports_depth = supports_klines = supports_streaming = True
+    # Поток передает только изменения с номерами U..u, снимок загружается через REST
+    supports_depth_stream = True
+    
+    # Схемы ответов
+    tickers_schema = JsonSchema([{"symbol": str, "lastPrice": str}])
+    book_tickers_schema = JsonSchema([{"symbol": str, "bidPrice": str, "askPrice": str}])
+    depth_schema = JsonSchema({"lastUpdateId": int, "bids": [[str]], "asks": [[str]]})
+    
+    def request_weight(self, path, params):
+        if path in self.ticker_weights:
+            single, bulk = self.ticker_weights[path]
+            return single if params and 'symbol' in params else bulk
+        return super().request_weight(path, params)
+    
+    def rate_limit_remaining(self, headers):
+        used = headers.get('X-MBX-USED-WEIGHT-1M') or headers.get('X-MBX-USED-WEIGHT')
+        return self.rate_limit[0] - int(used) if used else None
+    
+    def fetch_tickers(self):
+        return self._collect(self.get("/api/v3/ticker/24hr", schema=self.tickers_schema), 'symbol', 'lastPrice')
+    
+    def fetch_book_tickers(self):
+        items = self.get("/api/v3/ticker/bookTicker", schema=self.book_tickers_schema)
+        return self._collect(items, 'symbol', 'bidPrice', 'askPrice')
+    
+    def fetch_ticker(self, symbol):
+        data = self.get("/api/v3/ticker/24hr", {"symbol": self.pair(symbol)})
+        return float(data['lastPrice']) if 'lastPrice' in data else None
+    
+    def fetch_depth(self, symbol, limit):
+        asks, bids, _ = self.fetch_depth_snapshot(symbol, limit)
+        return asks, bids
+    
+    def fetch_depth_snapshot(self, symbol, limit):
+        data = self.get("/api/v3/depth", {"symbol": self.pair(symbol), "limit": limit}, self.depth_schema)
+        return self._levels(data['asks']), self._levels(data['bids']), data.get('lastUpdateId')
+    
+    def fetch_klines(self, symbol, interval, limit, start=None):
+        params = {"symbol": self.pair(symbol), "interval": self.kline_intervals[interval], "limit": limit}
+        if start is not None:
+            params["startTime"] = start
+        return self._candles(self.get("/api/v3/klines", params))
+    
+    def stream_connect_url(self, url, symbols):
+        # Binance принимает список потоков прямо в адресе
+        streams = []
+        for symbol in symbols:
+            pair = self.pair(symbol).lower()
+            streams += [f"{pair}@ticker", f"{pair}@bookTicker"]
+        return f"{url}?streams={'/'.join(streams)}"
+    
+    def parse_stream_message(self, message):
+        data = message.get('data', message)
+        last = data.get('c') if data.get('e') == '24hrTicker' else None
+        return [(self.symbol_of(data.get('s')), last, data.get('b'), data.get('a'))]
+    
+    def depth_stream_connect_url(self, url, symbols):
+        streams = [f"{self.pair(symbol).lower()}@depth@100ms" for symbol in symbols]
+        return f"{url}?streams={'/'.join(streams)}"
+    
+    def parse_depth_message(self, message):
+        data = message.get('data', message)
+        if data.get('e') != 'depthUpdate':
+            return []
+        return [(self.symbol_of(data.get('s')), False, data.get('b') or [], data.get('a') or [],
+                 data.get('U'), data.get('u'), None)]
+
+
+@register_exchange
+class MexcAdapter(BinanceAdapter):
+    """
+    Адаптер MEXC (REST API повторяет формат Binance v3)
+    
+    WebSocket-поток MEXC передается только в protobuf, поэтому для этой биржи
+    всегда используется REST.
+    """
+    
+    name = "MEXC"
+    base_url = "https://api.mexc.com"
+    stream_url = None
+    kline_intervals = {"1m": "1m", "1h": "60m", "1d": "1d"}
+    # 500 единиц веса за 10 секунд на каждый эндпоинт
+    rate_limit = None
+    endpoint_limits = {
+        path: (500, 10)
+        for path in ("/api/v3/ticker/24hr", "/api/v3/ticker/bookTicker", "/api/v3/depth", "/api/v3/klines")
+    }
+    endpoint_weights = {}
+    ticker_weights = {"/api/v3/ticker/24hr": (1, 40), "/api/v3/ticker/bookTicker": (1, 1)}
+    supports_streaming = supports_depth_stream = False
+    
+    def rate_limit_remaining(self, headers):
+        # MEXC не сообщает использованный вес в заголовках
+        return None
+
+
+@register_exchange
+class OkxAdapter(ExchangeAdapter):
+    """Адаптер OKX (API v5, спот)"""
+    
+    name = "OKX"
+    base_url = "https://www.okx.com"
+    stream_url = "wss://ws.okx.com:8443/ws/v5/public"
+    pair_separator = "-"
+    # Дневные свечи OKX по умолчанию считаются по времени Гонконга, 1Dutc - по UTC
+    kline_intervals = {"1m": "1m", "1h": "1H", "1d": "1Dutc"}
+    # Лимиты OKX задаются отдельно для каждого эндпоинта: запросов за 2 секунды
+    endpoint_limits = {
+        "/api/v5/market/tickers": (20, 2),
+        "/api/v5/market/ticker": (20, 2),
+        "/api/v5/market/books": (40, 2),
+        "/api/v5/market/candles": (40, 2),
+    }
+    supports_bulk_ticker = supports_depth = supports_klines = supports_streaming = True
+    # Канал books: снимок, затем изменения со ссылкой prevSeqId на предыдущее
+    supports_depth_stream = depth_snapshot_in_stream = True
+    depth_sequence = 'prev'
+    
+    # Схемы ответов
+    tickers_schema = JsonSchema({"code": str, "msg": str, "data": [
+        {"instId": str, "last": str, "bidPx": str, "askPx": str}
+    ]})
+    depth_schema = JsonSchema({"code": str, "msg": str, "data": [{"asks": [[str]], "bids": [[str]]}]})
+    
+    def unwrap(self, data):
+        if data.get('code') != '0':
+            raise ValueError(f"code {data.get('code')}: {data.get('msg')}")
+        return data['data']
+    
+    def fetch_tickers(self):
+        items = self.get("/api/v5/market/tickers", {"instType": "SPOT"}, self.tickers_schema)
+        return self._collect(items, 'instId', 'last')
+    
+    def fetch_book_tickers(self):
+        items = self.get("/api/v5/market/tickers", {"instType": "SPOT"}, self.tickers_schema)
+        return self._collect(items, 'instId', 'bidPx', 'askPx')
+    
+    def fetch_ticker(self, symbol):
+        items = self.get("/api/v5/market/ticker", {"instId": self.pair(symbol)})
+        return float(items[0]['last']) if items else None
+    
+    def fetch_depth(self, symbol, limit):
+        book = self.get("/api/v5/market/books", {"instId": self.pair(symbol), "sz": limit}, self.depth_schema)[0]
+        return self._levels(book['asks']), self._levels(book['bids'])
+    
+    def fetch_klines(self, symbol, interval, limit, start=None):
+        params = {"instId": self.pair(symbol), "bar": self.kline_intervals[interval], "limit": limit}
+        if start is not None:
+            # before - свечи новее указанного времени, after - старше
+            params.update(before=start - 1, after=self._kline_end(interval, limit, start) + 1)
+        return self._candles(self.get("/api/v5/market/candles", params))
+    
+    def stream_subscribe_messages(self, symbols):
+        return [{
+            "op": "subscribe",
+            "args": [{"channel": "tickers", "instId": self.pair(symbol)} for symbol in symbols]
+        }]
+    
+    def stream_ping(self, ws):
+        ws.send("ping")
+    
+    def parse_stream_message(self, message):
+        if message.get('arg', {}).get('channel') != 'tickers':
+            return []
+        return [
+            (self.symbol_of(item.get('instId')), item.get('last'), item.get('bidPx'), item.get('askPx'))
+            for item in message.get('data', [])
+        ]
+    
+    def depth_stream_subscribe_messages(self, symbols):
+        return [{
+            "op": "subscribe",
+            "args": [{"channel": "books", "instId": self.pair(symbol)} for symbol in symbols]
+        }]
+    
+    def parse_depth_message(self, message):
+        arg = message.get('arg', {})
+        if arg.get('channel') != 'books' or 'action' not in message:
+            return []
+        symbol = self.symbol_of(arg.get('instId'))
+        return [
+            (symbol, message['action'] == 'snapshot', item.get('bids') or [], item.get('asks') or [],
+             None, item.get('seqId'), item.get('prevSeqId'))
+            for item in message.get('data', [])
+        ]
+
+
+@register_exchange
+class KucoinAdapter(ExchangeAdapter):
+    """
+    Адаптер KuCoin (API v1, спот)
+    
+    Для WebSocket KuCoin требует предварительно получать токен подключения,
+    поэтому потоковый режим для этой биржи не используется.
+    """
+    
+    name = "KuCoin"
+    base_url = "https://api.kucoin.com"
+    pair_separator = "-"
+    kline_intervals = {"1m": "1min", "1h": "1hour", "1d": "1day"}
+    # Общий пул публичных запросов: вес за 30 секунд
+    rate_limit = (2000, 30)
+    endpoint_weights = {
+        "/api/v1/market/allTickers": 15,
+        "/api/v1/market/orderbook/level1": 2,
+        "/api/v1/market/orderbook/level2_20": 2,
+        "/api/v1/market/orderbook/level2_100": 4,
+        "/api/v1/market/candles": 3,
+    }
+    supports_bulk_ticker = supports_depth = supports_klines = True
+    
+    def unwrap(self, data):
+        if data.get('code') != '200000':
+            raise ValueError(f"code {data.get('code')}: {data.get('msg')}")
+        return data['data']
+    
+    # Схемы ответов
+    tickers_schema = JsonSchema({"code": str, "msg": str, "data": {
+        "ticker": [{"symbol": str, "last": str, "buy": str, "sell": str}]
+    }})
+    depth_schema = JsonSchema({"code": str, "msg": str, "data": {"asks": [[str]], "bids": [[str]]}})
+    
+    def rate_limit_remaining(self, headers):
+        remaining = headers.get('gw-ratelimit-remaining')
+        return int(remaining) if remaining else None
+    
+    def fetch_tickers(self):
+        items = self.get("/api/v1/market/allTickers", schema=self.tickers_schema)['ticker']
+        return self._collect(items, 'symbol', 'last')
+    
+    def fetch_book_tickers(self):
+        # buy - лучшая цена покупки (bid), sell - лучшая цена продажи (ask)
+        items = self.get("/api/v1/market/allTickers", schema=self.tickers_schema)['ticker']
+        return self._collect(items, 'symbol', 'buy', 'sell')
+    
+    def fetch_ticker(self, symbol):
+        data = self.get("/api/v1/market/orderbook/level1", {"symbol": self.pair(symbol)})
+        return float(data['price']) if data and data.get('price') else None
+    
+    def fetch_depth(self, symbol, limit):
+        # KuCoin отдает стакан только фиксированной глубины: 20 или 100 уровней
+        depth = 20 if limit <= 20 else 100
+        data = self.get(f"/api/v1/market/orderbook/level2_{depth}", {"symbol": self.pair(symbol)}, self.depth_schema)
+        return self._levels(data['asks'])[:limit], self._levels(data['bids'])[:limit]
+    
+    def fetch_klines(self, symbol, interval, limit, start=None):
+        # Параметра limit нет: диапазон ограничивается временем начала и конца (в секундах)
+        params = {"symbol": self.pair(symbol), "type": self.kline_intervals[interval]}
+        if start is None:
+            params["startAt"] = int(time.time()) - KLINE_INTERVAL_SECONDS[interval] * (limit + 1)
+        else:
+            params.update(startAt=start // 1000, endAt=self._kline_end(interval, limit, start) // 1000 + 1)
+        data = self.get("/api/v1/market/candles", params)
+        # Время в секундах, порядок полей: open, close, high, low, volume
+        rows = [(item[0], item[1], item[3], item[4], item[2], item[5]) for item in data]
+        candles = self._candles(rows, scale=1000)
+        return candles[-limit:] if start is None else candles[:limit]
+
+
+@register_exchange
+class GateAdapter(ExchangeAdapter):
+    """Адаптер Gate (API v4, спот)"""
+    
+    name = "Gate"
+    base_url = "https://api.gateio.ws/api/v4"
+    stream_url = "wss://api.gateio.ws/ws/v4/"
+    pair_separator = "_"
+    kline_intervals = {"1m": "1m", "1h": "1h", "1d": "1d"}
+    # 200 запросов за 10 секунд на каждый публичный эндпоинт
+    endpoint_limits = {
+        path: (200, 10)
+        for path in ("/spot/tickers", "/spot/order_book", "/spot/candlesticks")
+    }
+    supports_bulk_ticker = supports_depth = supports_klines = supports_streaming = True
+    
+    # Схемы ответов
+    tickers_schema = JsonSchema([{"currency_pair": str, "last": str, "highest_bid": str, "lowest_ask": str}])
+    depth_schema = JsonSchema({"asks": [[str]], "bids": [[str]]})
+    
+    def rate_limit_remaining(self, headers):
+        remaining = headers.get('X-Gate-RateLimit-Requests-Remain')
+        return int(remaining) if remaining else None
+    
+    def fetch_tickers(self):
+        return self._collect(self.get("/spot/tickers", schema=self.tickers_schema), 'currency_pair', 'last')
+    
+    def fetch_book_tickers(self):
+        items = self.get("/spot/tickers", schema=self.tickers_schema)
+        return self._collect(items, 'currency_pair', 'highest_bid', 'lowest_ask')
+    
+    def fetch_ticker(self, symbol):
+        items = self.get("/spot/tickers", {"currency_pair": self.pair(symbol)})
+        return float(items[0]['last']) if items else None
+    
+    def fetch_depth(self, symbol, limit):
+        data = self.get("/spot/order_book", {"currency_pair": self.pair(symbol), "limit": limit}, self.depth_schema)
+        return self._levels(data['asks']), self._levels(data['bids'])
+    
+    def fetch_klines(self, symbol, interval, limit, start=None):
+        params = {"currency_pair": self.pair(symbol), "interval": self.kline_intervals[interval]}
+        if start is None:
+            params["limit"] = limit
+        else:
+            # limit нельзя передавать вместе с диапазоном from/to (в секундах)
+            params.update({"from": start // 1000, "to": self._kline_end(interval, limit, start) // 1000})
+        data = self.get("/spot/candlesticks", params)
+        # Время в секундах, порядок полей: объем в USDT, close, high, low, open, объем в монетах
+        rows = [(item[0], item[5], item[3], item[4], item[2], item[6]) for item in data]
+        return self._candles(rows, scale=1000)
+    
+    def stream_subscribe_messages(self, symbols):
+        pairs = [self.pair(symbol) for symbol in symbols]
+        return [
+            {"time": int(time.time()), "channel": channel, "event": "subscribe", "payload": pairs}
+            for channel in ("spot.tickers", "spot.book_ticker")
+        ]
+    
+    def stream_ping(self, ws):
+        ws.send(json.dumps({"time": int(time.time()), "channel": "spot.ping"}))
+    
+    def parse_stream_message(self, message):
+        if message.get('event') != 'update':
+            return []
+        result = message.get('result') or {}
+        if message.get('channel') == 'spot.tickers':
+            return [(self.symbol_of(result.get('currency_pair')), result.get('last'),
+                     result.get('highest_bid'), result.get('lowest_ask'))]
+        if message.get('channel') == 'spot.book_ticker':
+            return [(self.symbol_of(result.get('s')), None, result.get('b'), result.get('a'))]
+        return []
+
+# ==============================================
+# ПАКЕТНАЯ ЗАГРУЗКА ТИКЕРОВ
+# ==============================================
+class BulkTickerProvider:
+    """Загрузка цен всех монет биржи одним запросом вместо запроса на каждую монету"""
+    
+    def __init__(self, adapters, symbols):
+        """
+        Инициализация провайдера
+        
+        Args:
+            adapters: Словарь {биржа: ExchangeAdapter}
+            symbols: Монеты, запрашиваемые по одной у бирж без пакетного эндпоинта
+        """
+        self.adapters = adapters
+        self.symbols = symbols
+    
+    def fetch(self, exchange):
+        """
+        Получение цен всех пар к USDT на бирже
+        
+        Returns:
+            Словарь {символ: цена}, например {'BTC': 65000.0}, или None при ошибке
+        """
+        try:
+            adapter = self.adapters[exchange]
+            if adapter.supports_bulk_ticker:
+                return adapter.fetch_tickers()
+            
+            prices = {}
+            for symbol in self.symbols:
+                price = adapter.fetch_ticker(symbol)
+                if price is not None:
+                    prices[symbol] = price
+            return prices
+        except Exception as e:
+            METRICS.inc('update_errors_total', stage="tickers")
+            print(f"Ошибка получения тикеров {exchange}: {e}")
+            return None
+    
+    def fetch_book(self, exchange):
+        """
+        Получение лучших цен покупки и продажи всех пар к USDT на бирже
+        
+        Returns:
+            Словарь {символ: (bid, ask)} или None при ошибке и для бирж без пакетного эндпоинта
+        """
+        try:
+            adapter = self.adapters[exchange]
+            if adapter.supports_bulk_ticker:
+                return adapter.fetch_book_tickers()
+            return None
+        except Exception as e:
+            METRICS.inc('update_errors_total', stage="book_tickers")
+            print(f"Ошибка получения лучших цен {exchange}: {e}")
+            return None
+
+# ==============================================
+# ПОИСК МЕЖБИРЖЕВОГО АРБИТРАЖА
+# ==============================================
+class ArbitrageScanner:
+    """
+    Поиск межбиржевого арбитража по всем общим парам к USDT
+    
+    Лучшие цены всех бирж раскладываются в матрицы (символ x биржа),
+    после чего лучшая цена покупки (минимальный ask), лучшая цена продажи
+    (максимальный bid) и спред между ними считаются для всех пар сразу.
+    """
+    
+    def __init__(self, exchanges, top_n=ARBITRAGE_TOP_N, max_percent=ARBITRAGE_MAX_PERCENT):
+        """
+        Инициализация сканера
+        
+        Args:
+            exchanges: Список бирж (порядок столбцов матриц)
+            top_n: Число возвращаемых лучших возможностей
+            max_percent: Спреды выше этого значения отбрасываются как ошибочные
+        """
+        self.exchanges = list(exchanges)
+        self.top_n = top_n
+        self.max_percent = max_percent
+        self.last_scan_ms = 0.0
+        self.last_pairs = 0
+    
+    def scan(self, books):
+        """
+        Расчет лучших арбитражных возможностей
+        
+        Args:
+            books: Словарь {биржа: {символ: (bid, ask)}}
+        
+        Returns:
+            Список словарей с ключами symbol, buy_exchange, ask, sell_exchange,
+            bid, spread и percent, отсортированный по убыванию percent
+        """
+        started = time.perf_counter()
+        
+        batch = QuoteBatch.from_books(books, exchanges=self.exchanges)
+        
+        # Только пары, которые торгуются хотя бы на двух биржах
+        matrix = QuoteMatrix.from_batch(batch, self.exchanges, min_venues=2)
+        opportunities = self._rank(matrix.symbols, matrix.metrics())
+        self.last_pairs = len(matrix.symbols)
+        self.last_scan_ms = (time.perf_counter() - started) * 1000
+        return opportunities
+    
+    def _rank(self, symbols, metrics):
+        """Отбор top_n лучших возможностей по межбиржевому базису"""
+        if len(symbols) == 0:
+            return []
+        
+        percent = metrics.basis_percent
+        with np.errstate(invalid='ignore'):
+            valid = (np.isfinite(percent) & (metrics.best_ask_venue != metrics.best_bid_venue)
+                     & (metrics.basis > 0) & (percent <= self.max_percent))
+        candidates = np.flatnonzero(valid)
+        order = candidates[np.argsort(-percent[candidates])][:self.top_n]
+        
+        return [
+            {
+                'symbol': symbols[i],
+                'buy_exchange': metrics.venue(metrics.best_ask_venue[i]),
+                'ask': float(metrics.best_ask[i]),
+                'sell_exchange': metrics.venue(metrics.best_bid_venue[i]),
+                'bid': float(metrics.best_bid[i]),
+                'spread': float(metrics.basis[i]),
+                'percent': float(percent[i]),
+            }
+            for i in order
+        ]
+
+# ==============================================
+# СНИМОК КОТИРОВОК
+# ==============================================
+class QuoteSnapshot:
+    """Неизменяемый снимок цен всех бирж, получаемый один раз за тик и общий для всех панелей"""
+    
+    __slots__ = ('prices', 'timestamp', 'times')
+    
+    def __init__(self, prices, timestamp, times=None):
+        """
+        Создание снимка
+        
+        Args:
+            prices: Словарь {биржа: {символ: цена}} (None для биржи без данных)
+            timestamp: Время получения снимка (time.time())
+            times: Время получения цен отдельных бирж {биржа: время}, если оно раньше
+                timestamp (цены перенесены из прошлых данных); по умолчанию timestamp
+        """
+        frozen = MappingProxyType({
+            exchange: MappingProxyType(dict(exchange_prices or {}))
+            for exchange, exchange_prices in prices.items()
+        })
+        object.__setattr__(self, 'prices', frozen)
+        object.__setattr__(self, 'timestamp', timestamp)
+        object.__setattr__(self, 'times', MappingProxyType(dict(times or {})))
+    
+    def __setattr__(self, name, value):
+        """Запрет изменения снимка после создания"""
+        raise AttributeError("QuoteSnapshot нельзя изменить")
+    
+    def get(self, exchange, symbol):
+        """Цена символа на бирже или None"""
+        return self.prices.get(exchange, {}).get(symbol)
+    
+    def exchange_prices(self, exchange):
+        """Все цены одной биржи"""
+        return self.prices.get(exchange, MappingProxyType({}))
+    
+    def symbol_prices(self, symbol):
+        """Цены одного символа по всем биржам, где он есть"""
+        return {
+            exchange: prices[symbol]
+            for exchange, prices in self.prices.items()
+            if symbol in prices
+        }
+    
+    def exchange_time(self, exchange):
+        """Время получения цен биржи"""
+        return self.times.get(exchange, self.timestamp)
+    
+    def is_fresh(self, exchange):
+        """Получены ли цены биржи в этом снимке (а не перенесены из прошлых данных)"""
+        return self.exchange_time(exchange) >= self.timestamp
+    
+    def age(self, exchange=None):
+        """Возраст снимка или цен одной биржи в секундах"""
+        return time.time() - (self.timestamp if exchange is None else self.exchange_time(exchange))
+
+# ==============================================
+# КЭШ ИСТОРИЧЕСКИХ СВЕЧЕЙ
+# ==============================================
+class KlineCache:
+    """
+    LRU-кэш свечей с временем жизни, зависящим от интервала
+    
+    Закрытые свечи не меняются, поэтому после первой полной загрузки
+    в инкрементальном режиме перезапрашиваются только две последние свечи:
+    текущая открытая и предыдущая, которая могла закрыться с момента прошлого запроса.
+    """
+    
+    def __init__(self, loader, max_size=KLINE_CACHE_SIZE, incremental=True):
+        """
+        Инициализация кэша
+        
+        Args:
+            loader: Функция loader(exchange, symbol, interval, limit) -> [Candle] от старых к новым
+            max_size: Максимальное число хранимых серий
+            incremental: Обновлять только открытую свечу вместо полной загрузки
+        """
+        self.loader = loader
+        self.max_size = max_size
+        self.incremental = incremental
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'incremental': 0, 'full': 0}
+    
+    def get(self, exchange, symbol, interval="1d", limit=7):
+        """Получение серии свечей из кэша или с биржи"""
+        key = (exchange, symbol, interval, limit)
+        now = time.time()
+        
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                if now - entry['updated'] < KLINE_TTL.get(interval, 60):
+                    self.stats['hits'] += 1
+                    return entry['candles']
+        
+        # Пока прошло меньше одного интервала, сдвинуться могла не более чем одна свеча
+        if (entry is not None and self.incremental
+                and now - entry['updated'] < KLINE_INTERVAL_SECONDS.get(interval, 0)):
+            fresh = self.loader(exchange, symbol, interval, 2)
+            candles = self._merge(entry['candles'], fresh, limit) if fresh else None
+            stat = 'incremental'
+        else:
+            candles = self.loader(exchange, symbol, interval, limit)
+            stat = 'full'
+        
+        if not candles:
+            # При ошибке возвращаем последние известные данные
+            return entry['candles'] if entry is not None else None
+        
+        with self.lock:
+            self.stats[stat] += 1
+            self.entries[key] = {'candles': candles, 'updated': now}
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+        return candles
+    
+    @staticmethod
+    def _merge(candles, fresh, limit):
+        """Замена свечей с совпадающим временем открытия и добавление новых"""
+        merged = {candle.ts: candle for candle in candles}
+        merged.update((candle.ts, candle) for candle in fresh)
+        return [merged[ts] for ts in sorted(merged)][-limit:]
+    
+    def clear(self):
+        """Очистка кэша"""
+        with self.lock:
+            self.entries.clear()
+
+# ==============================================
+# ПОТОКОВЫЕ КОТИРОВКИ (WEBSOCKET)
+# ==============================================
+class MarketStream:
+    """Подписка на каналы тикеров и лучших цен бирж по WebSocket с переподключением"""
+    
+    def __init__(self, symbols, adapters, urls=None):
+        """
+        Инициализация потока
+        
+        Args:
+            symbols: Список символов для подписки (без USDT)
+            adapters: Словарь {биржа: ExchangeAdapter}; используются биржи с supports_streaming
+            urls: Словарь {биржа: адрес WebSocket}, по умолчанию stream_url адаптеров
+        """
+        self.symbols = list(symbols)
+        if urls is None:
+            urls = {
+                exchange: adapter.stream_url
+                for exchange, adapter in adapters.items()
+                if adapter.supports_streaming
+            }
+        self.urls = dict(urls)
+        self.adapters = {exchange: adapters[exchange] for exchange in self.urls}
+        self.prices = {exchange: {} for exchange in self.urls}
+        self.books = {exchange: {} for exchange in self.urls}
+        self.last_message = {exchange: 0.0 for exchange in self.urls}
+        self.lock = threading.Lock()
+        self.running = False
+        self.threads = []
+        self.sockets = {}
+    
+    @staticmethod
+    def available():
+        """Проверка наличия библиотеки websocket-client"""
+        return websocket is not None
+    
+    def start(self):
+        """Запуск отдельного потока подключения для каждой биржи"""
+        self.running = True
+        for exchange in self.urls:
+            thread = threading.Thread(target=self._run, args=(exchange,), daemon=True)
+            thread.start()
+            self.threads.append(thread)
+    
+    def stop(self):
+        """Остановка всех подключений"""
+        self.running = False
+        for ws in list(self.sockets.values()):
+            try:
+                ws.close()
+            except Exception:
+                pass
+    
+    def is_live(self, exchange):
+        """Есть ли по бирже свежие данные из потока"""
+        return time.time() - self.last_message.get(exchange, 0.0) < STREAM_STALE_AFTER
+    
+    def exchange_prices(self, exchange):
+        """Копия последних цен биржи {символ: цена}"""
+        with self.lock:
+            return dict(self.prices.get(exchange, {}))
+    
+    def book(self, exchange, symbol):
+        """Лучшие цены (bid, ask) символа или (None, None), в том же порядке, что и пакетные book-тикеры"""
+        with self.lock:
+            return self.books.get(exchange, {}).get(symbol, (None, None))
+    
+    def connect_url(self, exchange):
+        """Адрес подключения к бирже"""
+        return self.adapters[exchange].stream_connect_url(self.urls[exchange], self.symbols)
+    
+    def subscribe_messages(self, exchange):
+        """Сообщения подписки после подключения"""
+        return self.adapters[exchange].stream_subscribe_messages(self.symbols)
+    
+    def on_connect(self, exchange):
+        """Действия после (пере)подключения"""
+        pass
+    
+    def reconnect(self, exchange):
+        """Разрыв соединения с биржей; цикл подключения сразу установит новое"""
+        ws = self.sockets.get(exchange)
+        if ws is not None:
+            try:
+                ws.close()
+            except Exception:
+                pass
+    
+    def _run(self, exchange):
+        """Цикл подключения к бирже с экспоненциальной паузой между попытками"""
+        delay = 1
+        while self.running:
+            ws = None
+            try:
+                adapter = self.adapters[exchange]
+                ws = websocket.create_connection(self.connect_url(exchange), timeout=STREAM_PING_INTERVAL)
+                self.sockets[exchange] = ws
+                self.on_connect(exchange)
+                for message in self.subscribe_messages(exchange):
+                    ws.send(json.dumps(message))
+                
+                delay = 1
+                last_ping = time.time()
+                while self.running:
+                    try:
+                        raw = ws.recv()
+                    except websocket.WebSocketTimeoutException:
+                        raw = None
+                    if raw:
+                        self.handle_message(exchange, raw)
+                    
+                    if time.time() - last_ping >= STREAM_PING_INTERVAL:
+                        adapter.stream_ping(ws)
+                        last_ping = time.time()
+            except Exception as e:
+                if self.running:
+                    METRICS.inc('update_errors_total', stage="stream")
+                    print(f"Ошибка потока {exchange}: {e}, переподключение через {delay} с")
+            finally:
+                self.sockets.pop(exchange, None)
+                if ws is not None:
+                    try:
+                        ws.close()
+                    except Exception:
+                        pass
+            
+            # Пауза перед переподключением со случайным разбросом
+            wait_until = time.time() + delay * random.uniform(0.8, 1.2)
+            while self.running and time.time() < wait_until:
+                time.sleep(0.2)
+            delay = min(delay * 2, STREAM_BACKOFF_MAX)
+    
+    def handle_message(self, exchange, raw):
+        """Разбор сообщения потока и обновление цен"""
+        try:
+            message = decode_json(raw)
+        except ValueError:
+            # Служебные текстовые ответы вроде "pong"
+            return
+        if not isinstance(message, dict):
+            return
+        
+        updates = self.adapters[exchange].parse_stream_message(message)
+        with self.lock:
+            for symbol, last_price, bid_price, ask_price in updates:
+                if not symbol:
+                    continue
+                if last_price:
+                    self.prices[exchange][symbol] = float(last_price)
+                if ask_price or bid_price:
+                    old_bid, old_ask = self.books[exchange].get(symbol, (None, None))
+                    self.books[exchange][symbol] = (
+                        float(bid_price) if bid_price else old_bid,
+                        float(ask_price) if ask_price else old_ask
+                    )
+            self.last_message[exchange] = time.time()
+
+# ==============================================
+# СТАКАНЫ И VWAP
+# ==============================================
+class OrderBook:
+    """
+    Локальный стакан одной пары: снимок и поток изменений с проверкой последовательности
+    
+    Правило проверки задается биржей (ExchangeAdapter.depth_sequence):
+    'contiguous' - изменение [first, last] должно начинаться не позже seq + 1 (Binance),
+    'prev' - изменение ссылается на номер предыдущего (OKX),
+    'monotonic' - отбрасываются только устаревшие изменения (Bybit).
+    При разрыве последовательности стакан помечается несинхронизированным
+    и ждет нового снимка; изменения, пришедшие до снимка, буферизуются.
+    
+    Изменения могут добавлять уровни глубже снимка, о соседях которых ничего
+    не известно, поэтому levels() отдает не больше depth уровней.
+    """
+    
+    def __init__(self, sequence='contiguous', depth=DEPTH_LEVELS):
+        """Инициализация пустого несинхронизированного стакана"""
+        self.sequence = sequence
+        self.depth = depth
+        self.bids = {}
+        self.asks = {}
+        self.seq = None
+        self.synced = False
+        self.updated = 0.0
+        self.pending = []
+        self.lock = threading.Lock()
+        self._arrays = {}
+    
+    def apply_snapshot(self, bids, asks, seq=None):
+        """Замена стакана снимком и применение изменений, пришедших до него"""
+        with self.lock:
+            self.bids = {float(price): float(qty) for price, qty, *_ in bids if float(qty) > 0}
+            self.asks = {float(price): float(qty) for price, qty, *_ in asks if float(qty) > 0}
+            self.seq = seq
+            self.synced = True
+            self.updated = time.time()
+            self._arrays = {}
+            # Под той же блокировкой: новое изменение из потока не может
+            # попасть между снимком и буферизованными изменениями
+            pending, self.pending = self.pending, []
+            for update in pending:
+                if not self._apply_locked(*update):
+                    break
+    
+    def apply_diff(self, bids, asks, first=None, last=None, prev=None):
+        """
+        Применение изменений уровней (объем 0 - удаление уровня)
+        
+        Returns:
+            False при разрыве последовательности (нужен новый снимок), иначе True
+        """
+        with self.lock:
+            return self._apply_locked(bids, asks, first, last, prev)
+    
+    def _apply_locked(self, bids, asks, first, last, prev):
+        """Применение изменений (вызывается под блокировкой)"""
+        if not self.synced:
+            if len(self.pending) < DEPTH_PENDING_MAX:
+                self.pending.append((bids, asks, first, last, prev))
+            return True
+        
+        if self.seq is not None and last is not None:
+            if self.sequence == 'prev':
+                if prev is not None and prev != self.seq:
+                    return self._desync()
+            elif last <= self.seq:
+                return True  # Изменение уже учтено в снимке
+            elif self.sequence == 'contiguous' and first is not None and first > self.seq + 1:
+                return self._desync()
+        
+        for levels, book in ((bids, self.bids), (asks, self.asks)):
+            for price, qty, *_ in levels:
+                price, qty = float(price), float(qty)
+                if qty > 0:
+                    book[price] = qty
+                else:
+                    book.pop(price, None)
+        if last is not None:
+            self.seq = last
+        self.updated = time.time()
+        self._arrays = {}
+        return True
+    
+    def _desync(self):
+        """Пометка о разрыве последовательности (вызывается под блокировкой)"""
+        self.synced = False
+        self.pending = []
+        return False
+    
+    def reset(self):
+        """Сброс синхронизации (например, после переподключения потока)"""
+        with self.lock:
+            self._desync()
+    
+    def levels(self, side):
+        """
+        Уровни стороны 'bids' или 'asks' от лучшей цены
+        
+        Returns:
+            (массив цен, массив объемов); результат кэшируется до следующего изменения
+        """
+        with self.lock:
+            arrays = self._arrays.get(side)
+            if arrays is None:
+                book = self.bids if side == 'bids' else self.asks
+                prices = np.fromiter(book.keys(), dtype=np.float64, count=len(book))
+                qtys = np.fromiter(book.values(), dtype=np.float64, count=len(book))
+                order = np.argsort(-prices if side == 'bids' else prices)[:self.depth]
+                arrays = self._arrays[side] = (prices[order], qtys[order])
+            return arrays
+    
+    def top(self):
+        """Лучшие цены (bid, ask) или None для пустой стороны"""
+        bid_prices, _ = self.levels('bids')
+        ask_prices, _ = self.levels('asks')
+        return (float(bid_prices[0]) if len(bid_prices) else None,
+                float(ask_prices[0]) if len(ask_prices) else None)
+
+
+def depth_vwap(books, notional):
+    """
+    Средневзвешенные цены исполнения сделки объемом notional (USDT) на каждой бирже
+    
+    Уровни всех бирж раскладываются в матрицы (биржа x уровень), накопленный
+    объем и точка, где он достигает notional, считаются для всех бирж сразу.
+    
+    Args:
+        books: Словарь {биржа: OrderBook}
+        notional: Объем сделки в USDT
+    
+    Returns:
+        Словарь {'buy': {биржа: (vwap, исполненный объем)}, 'sell': {...},
+        'best_buy': (биржа, vwap) или None, 'best_sell': (биржа, vwap) или None};
+        лучшие цены выбираются только среди бирж, где объем исполняется целиком
+    """
+    exchanges = list(books)
+    result = {'buy': {}, 'sell': {}, 'best_buy': None, 'best_sell': None}
+    for side, key, pick in (('asks', 'buy', np.argmin), ('bids', 'sell', np.argmax)):
+        levels = [books[exchange].levels(side) for exchange in exchanges]
+        width = max((len(prices) for prices, _ in levels), default=0)
+        if width == 0:
+            continue
+        
+        prices = np.full((len(exchanges), width), np.nan)
+        qtys = np.zeros((len(exchanges), width))
+        for row, (level_prices, level_qtys) in enumerate(levels):
+            prices[row, :len(level_prices)] = level_prices
+            qtys[row, :len(level_qtys)] = level_qtys
+        
+        cost = np.cumsum(np.nan_to_num(prices) * qtys, axis=1)
+        volume = np.cumsum(qtys, axis=1)
+        rows = np.arange(len(exchanges))
+        
+        # Уровень, на котором накопленная стоимость достигает notional, и остаток на нем
+        filled = cost[:, -1] >= notional
+        level = np.where(filled, np.argmax(cost >= notional, axis=1), width - 1)
+        cost_before = np.where(level > 0, cost[rows, level - 1], 0.0)
+        volume_before = np.where(level > 0, volume[rows, level - 1], 0.0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            qty = np.where(filled, volume_before + (notional - cost_before) / prices[rows, level], volume[:, -1])
+            vwap = np.where(filled, notional, cost[:, -1]) / qty
+        
+        for row, exchange in enumerate(exchanges):
+            if np.isfinite(vwap[row]):
+                result[key][exchange] = (float(vwap[row]), float(min(cost[row, -1], notional)))
+        
+        candidates = np.where(filled & np.isfinite(vwap), vwap, np.inf if key == 'buy' else -np.inf)
+        best = pick(candidates)
+        if np.isfinite(candidates[best]):
+            result['best_' + key] = (exchanges[best], float(vwap[best]))
+    return result
+
+
+class DepthStream(MarketStream):
+    """
+    Потоки изменений стаканов бирж с supports_depth_stream
+    
+    Bybit и OKX присылают снимок сразу после подписки, поэтому при разрыве
+    последовательности соединение переподключается. Для Binance снимок
+    загружается через REST (ExchangeAdapter.fetch_depth_snapshot), а изменения,
+    пришедшие до него, применяются поверх с проверкой номеров.
+    """
+    
+    def __init__(self, symbols, adapters, urls=None, levels=DEPTH_LEVELS):
+        """
+        Инициализация потоков стаканов
+        
+        Args:
+            symbols: Список символов
+            adapters: Словарь {биржа: ExchangeAdapter}; используются биржи с supports_depth_stream
+            urls: Словарь {биржа: адрес WebSocket}, по умолчанию stream_url адаптеров
+            levels: Глубина снимка, загружаемого через REST
+        """
+        if urls is None:
+            urls = {
+                exchange: adapter.stream_url
+                for exchange, adapter in adapters.items()
+                if adapter.supports_depth_stream
+            }
+        super().__init__(symbols, adapters, urls)
+        self.levels = levels
+        self.order_books = {
+            (exchange, symbol): OrderBook(self.adapters[exchange].depth_sequence, levels)
+            for exchange in self.urls
+            for symbol in self.symbols
+        }
+    
+    def start(self):
+        """Запуск подключений и потока загрузки снимков"""
+        super().start()
+        thread = threading.Thread(target=self._snapshot_loop, daemon=True)
+        thread.start()
+        self.threads.append(thread)
+    
+    def order_book(self, exchange, symbol):
+        """Синхронизированный стакан пары с живым потоком или None"""
+        book = self.order_books.get((exchange, symbol))
+        if book is None or not book.synced or not self.is_live(exchange):
+            return None
+        return book
+    
+    def connect_url(self, exchange):
+        return self.adapters[exchange].depth_stream_connect_url(self.urls[exchange], self.symbols)
+    
+    def subscribe_messages(self, exchange):
+        return self.adapters[exchange].depth_stream_subscribe_messages(self.symbols)
+    
+    def on_connect(self, exchange):
+        # Изменения, пропущенные за время разрыва, не восстановить: нужен новый снимок
+        for symbol in self.symbols:
+            self.order_books[(exchange, symbol)].reset()
+    
+    def handle_message(self, exchange, raw):
+        """Применение снимков и изменений стаканов"""
+        try:
+            message = decode_json(raw)
+        except ValueError:
+            return
+        if not isinstance(message, dict):
+            return
+        
+        adapter = self.adapters[exchange]
+        for symbol, is_snapshot, bids, asks, first, last, prev in adapter.parse_depth_message(message):
+            book = self.order_books.get((exchange, symbol))
+            if book is None:
+                continue
+            if is_snapshot:
+                book.apply_snapshot(bids, asks, last)
+            elif not book.apply_diff(bids, asks, first, last, prev):
+                print(f"Разрыв последовательности стакана {exchange} {symbol}, повторная синхронизация")
+                if adapter.depth_snapshot_in_stream:
+                    self.reconnect(exchange)
+        self.last_message[exchange] = time.time()
+    
+    def _snapshot_loop(self):
+        """Загрузка снимков через REST для несинхронизированных стаканов"""
+        while self.running:
+            for (exchange, symbol), book in self.order_books.items():
+                adapter = self.adapters[exchange]
+                if not self.running or book.synced or adapter.depth_snapshot_in_stream:
+                    continue
+                if exchange not in self.sockets:
+                    continue
+                try:
+                    asks, bids, seq = adapter.fetch_depth_snapshot(symbol, self.levels)
+                    book.apply_snapshot(bids, asks, seq)
+                except Exception as e:
+                    METRICS.inc('update_errors_total', stage="depth_snapshot")
+                    print(f"Ошибка загрузки снимка стакана {exchange} {symbol}: {e}")
+            time.sleep(0.5)
+
+# ==============================================
+# ХРАНИЛИЩЕ ТИКОВ НА ДИСКЕ
+# ==============================================
+class TickSeries:
+    """
+    Ряд тиков одной пары (биржа, символ) в виде двух столбцов на диске
+    
+    Время (int64, мс) и цена (float64) хранятся в отдельных файлах,
+    отображенных в память. Файлы растут блоками по TICK_STORE_CHUNK записей,
+    число записанных тиков хранится в отдельном файле из одного int64.
+    Чтение возвращает срезы отображения без копирования данных.
+    """
+    
+    def __init__(self, directory, chunk=TICK_STORE_CHUNK, read_only=False):
+        """
+        Открытие (или создание) ряда в указанной папке
+        
+        При read_only открывается только существующий ряд (FileNotFoundError, если его нет),
+        файлы не создаются и не изменяются, append недоступен
+        """
+        self.directory = Path(directory)
+        self.read_only = read_only
+        if not read_only:
+            self.directory.mkdir(parents=True, exist_ok=True)
+        self.chunk = chunk
+        self.lock = threading.Lock()
+        
+        length_path = self.directory / "length.i64"
+        if not length_path.exists() and not read_only:
+            np.zeros(1, dtype=np.int64).tofile(length_path)
+        self.length = np.memmap(length_path, dtype=np.int64, mode='r' if read_only else 'r+', shape=(1,))
+        
+        if read_only:
+            self._map_columns(min(self._file_records('time.i64', 8), self._file_records('price.f64', 8)))
+        else:
+            self._map_columns(max(self._file_records('time.i64', 8), self.length[0], chunk))
+    
+    def _file_records(self, name, itemsize):
+        """Число записей, помещающихся в существующий файл столбца"""
+        path = self.directory / name
+        return path.stat().st_size // itemsize if path.exists() else 0
+    
+    def _map_columns(self, capacity):
+        """Отображение столбцов в память с заданной вместимостью"""
+        if self.read_only:
+            # Пустой файл нельзя отобразить в память
+            self.times = np.memmap(self.directory / "time.i64", dtype=np.int64, mode='r', shape=(capacity,)) \
+                if capacity else np.empty(0, dtype=np.int64)
+            self.prices = np.memmap(self.directory / "price.f64", dtype=np.float64, mode='r', shape=(capacity,)) \
+                if capacity else np.empty(0, dtype=np.float64)
+            self.capacity = capacity
+            return
+        for name, itemsize in (("time.i64", 8), ("price.f64", 8)):
+            path = self.directory / name
+            with open(path, 'ab') as f:
+                if f.tell() < capacity * itemsize:
+                    f.truncate(capacity * itemsize)
+        self.times = np.memmap(self.directory / "time.i64", dtype=np.int64, mode='r+', shape=(capacity,))
+        self.prices = np.memmap(self.directory / "price.f64", dtype=np.float64, mode='r+', shape=(capacity,))
+        self.capacity = capacity
+    
+    def __len__(self):
+        """Число сохраненных тиков"""
+        return min(int(self.length[0]), self.capacity)
+    
+    def append(self, timestamp_ms, price):
+        """Добавление тика в конец ряда"""
+        with self.lock:
+            count = int(self.length[0])
+            if count >= self.capacity:
+                # Старые срезы остаются валидными: файл только растет
+                self._map_columns(self.capacity + self.chunk)
+            self.times[count] = timestamp_ms
+            self.prices[count] = price
+            self.length[0] = count + 1
+    
+    def window(self, last=None, since_ms=None):
+        """
+        Срез последних тиков без копирования
+        
+        Args:
+            last: Вернуть не более last последних тиков
+            since_ms: Вернуть тики не старше указанного времени (мс)
+        
+        Returns:
+            Кортеж (массив времени в мс, массив цен)
+        """
+        with self.lock:
+            count = min(int(self.length[0]), self.capacity)
+            times, prices = self.times, self.prices
+        
+        start = 0
+        if since_ms is not None:
+            start = int(np.searchsorted(times[:count], since_ms))
+        if last is not None:
+            start = max(start, count - last)
+        return times[start:count], prices[start:count]
+    
+    def flush(self):
+        """Сброс изменений на диск"""
+        if self.read_only:
+            return
+        with self.lock:
+            self.times.flush()
+            self.prices.flush()
+            self.length.flush()
+
+
+class TickStore:
+    """Набор рядов тиков по парам (биржа, символ), открываемых по требованию"""
+    
+    def __init__(self, root=TICK_STORE_DIR):
+        """Инициализация хранилища в указанной папке"""
+        self.root = Path(root)
+        self.series = {}
+        self.lock = threading.Lock()
+    
+    def get_series(self, exchange, symbol):
+        """Ряд тиков пары (создается при первом обращении)"""
+        key = (exchange, symbol)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = TickSeries(self.root / exchange / symbol)
+                self.series[key] = series
+            return series
+    
+    def find_series(self, exchange, symbol):
+        """
+        Ряд тиков пары для чтения без создания файлов
+        
+        Returns:
+            Открытый ряд, существующий на диске ряд только для чтения или None
+        """
+        with self.lock:
+            series = self.series.get((exchange, symbol))
+        if series is not None:
+            return series
+        try:
+            return TickSeries(self.root / exchange / symbol, read_only=True)
+        except (FileNotFoundError, ValueError):
+            return None
+    
+    def append(self, exchange, symbol, timestamp, price):
+        """Добавление тика; timestamp - время в секундах (time.time())"""
+        self.get_series(exchange, symbol).append(int(timestamp * 1000), price)
+    
+    def window(self, exchange, symbol, last=None, since=None):
+        """Срез последних тиков пары; since - время в секундах. Для неизвестной пары - пустые массивы"""
+        since_ms = int(since * 1000) if since is not None else None
+        series = self.find_series(exchange, symbol)
+        if series is None:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+        return series.window(last=last, since_ms=since_ms)
+    
+    def flush(self):
+        """Сброс всех открытых рядов на диск"""
+        with self.lock:
+            series = list(self.series.values())
+        for item in series:
+            item.flush()
+
+# ==============================================
+# ЛОКАЛЬНАЯ ИСТОРИЯ СВЕЧЕЙ
+# ==============================================
+class CandleSeries:
+    """
+    Свечи одной серии (биржа, символ, интервал) в столбцах на диске
+    
+    Устроена так же, как TickSeries: время открытия (int64, мс) и значения
+    open, high, low, close, volume (float64, по строке на свечу) в файлах,
+    отображенных в память, и число записей в отдельном файле. Свечи идут
+    по возрастанию времени; последняя (еще открытая) свеча перезаписывается.
+    """
+    
+    FIELDS = 5
+    
+    def __init__(self, directory, chunk=CANDLE_STORE_CHUNK, read_only=False):
+        """
+        Открытие (или создание) серии в указанной папке
+        
+        При read_only открывается только существующая серия, как в TickSeries
+        """
+        self.directory = Path(directory)
+        self.read_only = read_only
+        if not read_only:
+            self.directory.mkdir(parents=True, exist_ok=True)
+        self.chunk = chunk
+        self.lock = threading.Lock()
+        
+        length_path = self.directory / "length.i64"
+        if not length_path.exists() and not read_only:
+            np.zeros(1, dtype=np.int64).tofile(length_path)
+        self.length = np.memmap(length_path, dtype=np.int64, mode='r' if read_only else 'r+', shape=(1,))
+        
+        time_path = self.directory / "time.i64"
+        stored = time_path.stat().st_size // 8 if time_path.exists() else 0
+        if read_only:
+            values_path = self.directory / "ohlcv.f64"
+            rows = values_path.stat().st_size // (self.FIELDS * 8) if values_path.exists() else 0
+            self._map_columns(min(stored, rows))
+        else:
+            self._map_columns(max(stored, self.length[0], chunk))
+    
+    def _map_columns(self, capacity):
+        """Отображение столбцов в память с заданной вместимостью"""
+        if self.read_only:
+            # Пустой файл нельзя отобразить в память
+            self.times = np.memmap(self.directory / "time.i64", dtype=np.int64, mode='r', shape=(capacity,)) \
+                if capacity else np.empty(0, dtype=np.int64)
+            self.values = np.memmap(self.directory / "ohlcv.f64", dtype=np.float64, mode='r',
+                                    shape=(capacity, self.FIELDS)) \
+                if capacity else np.empty((0, self.FIELDS), dtype=np.float64)
+            self.capacity = capacity
+            return
+        for name, size in (("time.i64", capacity * 8), ("ohlcv.f64", capacity * self.FIELDS * 8)):
+            with open(self.directory / name, 'ab') as f:
+                if f.tell() < size:
+                    f.truncate(size)
+        self.times = np.memmap(self.directory / "time.i64", dtype=np.int64, mode='r+', shape=(capacity,))
+        self.values = np.memmap(self.directory / "ohlcv.f64", dtype=np.float64, mode='r+',
+                                shape=(capacity, self.FIELDS))
+        self.capacity = capacity
+    
+    def __len__(self):
+        """Число сохраненных свечей"""
+        return min(int(self.length[0]), self.capacity)
+    
+    def last_ts(self):
+        """Время открытия последней свечи (мс) или None для пустой серии"""
+        with self.lock:
+            count = int(self.length[0])
+            return int(self.times[count - 1]) if count else None
+    
+    def upsert(self, candles):
+        """
+        Запись свечей, упорядоченных по времени
+        
+        Свечи новее последней добавляются в конец, свечи с уже известным временем
+        открытия перезаписываются; более старые свечи, которых нет в серии, пропускаются.
+        
+        Returns:
+            Число добавленных свечей
+        """
+        added = 0
+        with self.lock:
+            count = int(self.length[0])
+            for candle in candles:
+                row = (candle.open, candle.high, candle.low, candle.close, candle.volume)
+                row = tuple(np.nan if value is None else value for value in row)
+                if count and candle.ts <= self.times[count - 1]:
+                    i = int(np.searchsorted(self.times[:count], candle.ts))
+                    if self.times[i] == candle.ts:
+                        self.values[i] = row
+                    continue
+                if count >= self.capacity:
+                    self._map_columns(self.capacity + self.chunk)
+                self.times[count] = candle.ts
+                self.values[count] = row
+                count += 1
+                added += 1
+            self.length[0] = count
+        return added
+    
+    def window(self, last=None, since_ms=None):
+        """
+        Срез свечей без копирования
+        
+        Args:
+            last: Вернуть не более last последних свечей
+            since_ms: Вернуть свечи, открытые не раньше указанного времени (мс)
+        
+        Returns:
+            CandleBatch
+        """
+        with self.lock:
+            count = min(int(self.length[0]), self.capacity)
+            times, values = self.times, self.values
+        
+        start = 0
+        if since_ms is not None:
+            start = int(np.searchsorted(times[:count], since_ms))
+        if last is not None:
+            start = max(start, count - last)
+        rows = values[start:count]
+        return CandleBatch(times[start:count], rows[:, 0], rows[:, 1], rows[:, 2], rows[:, 3], rows[:, 4])
+    
+    def flush(self):
+        """Сброс изменений на диск"""
+        if self.read_only:
+            return
+        with self.lock:
+            self.times.flush()
+            self.values.flush()
+            self.length.flush()
+
+
+class CandleStore:
+    """Набор серий свечей по (биржа, символ, интервал), открываемых по требованию"""
+    
+    def __init__(self, root=CANDLE_STORE_DIR):
+        """Инициализация хранилища в указанной папке"""
+        self.root = Path(root)
+        self.series = {}
+        self.lock = threading.Lock()
+    
+    def get_series(self, exchange, symbol, interval):
+        """Серия свечей (создается при первом обращении)"""
+        key = (exchange, symbol, interval)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = CandleSeries(self.root / exchange / symbol / interval)
+                self.series[key] = series
+            return series
+    
+    def find_series(self, exchange, symbol, interval):
+        """
+        Серия свечей для чтения без создания файлов
+        
+        Returns:
+            Открытая серия, существующая на диске серия только для чтения или None
+        """
+        with self.lock:
+            series = self.series.get((exchange, symbol, interval))
+        if series is not None:
+            return series
+        try:
+            return CandleSeries(self.root / exchange / symbol / interval, read_only=True)
+        except (FileNotFoundError, ValueError):
+            return None
+    
+    def window(self, exchange, symbol, interval, last=None, since=None):
+        """Срез свечей серии (CandleBatch); since - время в секундах. Для неизвестной серии - пустой набор"""
+        since_ms = int(since * 1000) if since is not None else None
+        series = self.find_series(exchange, symbol, interval)
+        if series is None:
+            return CandleBatch.from_candles([])
+        return series.window(last=last, since_ms=since_ms)
+    
+    def flush(self):
+        """Сброс всех открытых серий на диск"""
+        with self.lock:
+            series = list(self.series.values())
+        for item in series:
+            item.flush()
+
+
+class HistorySync:
+    """
+    Фоновая загрузка истории свечей в CandleStore
+    
+    При первом запуске для каждой серии загружается HISTORY_BACKFILL свечей
+    страницами по HISTORY_PAGE, дальше раз в HISTORY_SYNC_INTERVAL секунд
+    запрашиваются только свечи начиная с последней сохраненной (она могла
+    быть еще открытой). Серии выбранной монеты (focus) загружаются первыми.
+    """
+    
+    def __init__(self, store, loader, exchanges, symbols, intervals=None, on_update=None):
+        """
+        Инициализация загрузки
+        
+        Args:
+            store: CandleStore
+            loader: Функция loader(exchange, symbol, interval, limit, start) -> [Candle] или None при ошибке
+            exchanges: Список бирж
+            symbols: Список монет
+            intervals: Интервалы свечей (по умолчанию все из HISTORY_BACKFILL)
+            on_update: Функция (exchange, symbol, interval), вызываемая после изменения серии
+        """
+        self.store = store
+        self.loader = loader
+        self.exchanges = list(exchanges)
+        self.symbols = list(symbols)
+        self.intervals = list(intervals or HISTORY_BACKFILL)
+        self.on_update = on_update
+        self.focus_symbol = None
+        self.wake = threading.Event()
+        self.running = False
+        self.thread = None
+        # Серии, по которым биржа не вернула ни одной свечи (пары нет), до перезапуска не запрашиваются
+        self.missing = set()
+    
+    def start(self):
+        """Запуск фонового потока"""
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        return self
+    
+    def stop(self):
+        """Остановка фонового потока"""
+        self.running = False
+        self.wake.set()
+        if self.thread is not None:
+            self.thread.join(timeout=1)
+    
+    def focus(self, symbol):
+        """Загрузить серии монеты в первую очередь (прерывает текущий проход)"""
+        self.focus_symbol = symbol
+        self.wake.set()
+    
+    def _run(self):
+        """Проходы по всем сериям: сначала выбранная монета, затем остальные"""
+        while self.running:
+            self.wake.clear()
+            symbols = list(self.symbols)
+            if self.focus_symbol is not None:
+                symbols = [self.focus_symbol] + [s for s in symbols if s != self.focus_symbol]
+            
+            interrupted = False
+            for symbol in symbols:
+                for interval in self.intervals:
+                    for exchange in self.exchanges:
+                        if not self.running or self.wake.is_set():
+                            interrupted = True
+                            break
+                        self.sync(exchange, symbol, interval)
+                    if interrupted:
+                        break
+                if interrupted:
+                    break
+            
+            if not interrupted:
+                self.wake.wait(HISTORY_SYNC_INTERVAL)
+    
+    def sync(self, exchange, symbol, interval):
+        """
+        Загрузка недостающих свечей одной серии
+        
+        Returns:
+            Число добавленных свечей
+        """
+        key = (exchange, symbol, interval)
+        if key in self.missing:
+            return 0
+        
+        series = self.store.get_series(exchange, symbol, interval)
+        step = KLINE_INTERVAL_SECONDS[interval] * 1000
+        now_ms = int(time.time() * 1000)
+        last = series.last_ts()
+        if last is not None:
+            start = last
+        else:
+            start = (now_ms // step - HISTORY_BACKFILL[interval] + 1) * step
+        
+        added = 0
+        changed = False
+        while self.running and start <= now_ms:
+            candles = self.loader(exchange, symbol, interval, HISTORY_PAGE, start)
+            if candles is None:
+                break  # Ошибка запроса: повтор при следующем проходе
+            candles = [candle for candle in candles if candle.ts >= start]
+            if candles:
+                added += series.upsert(candles)
+                changed = True
+                start = candles[-1].ts + step
+            else:
+                # Период без свечей (монета еще не торговалась): следующая страница
+                start += HISTORY_PAGE * step
+        
+        if last is None and not changed and start > now_ms:
+            self.missing.add(key)
+        if changed and self.on_update is not None:
+            self.on_update(exchange, symbol, interval)
+        return added
+
+# ==============================================
+# ЭКСПОРТ ДАННЫХ
+# ==============================================
+EXPORT_FIELDS = ("ts", "kind", "exchange", "symbol", "bid", "ask", "last")
+
+
+def export_directory():
+    """Папка для сохранения данных: CryptoData на рабочем столе"""
+    desktop = Path.home() / "Desktop"
+    if not desktop.exists():
+        desktop = Path.home() / "Рабочий стол"
+    return desktop / "CryptoData"
+
+
+def snapshot_rows(snapshot, symbols=None, quotes=(), fresh_only=False):
+    """
+    Строки экспорта из снимка котировок и цен стаканов
+    
+    Args:
+        snapshot: QuoteSnapshot или None
+        symbols: Ограничить снимок этими монетами (None - все пары снимка)
+        quotes: Quote с ценами покупки и продажи (None пропускаются)
+        fresh_only: Пропускать цены, перенесенные из прошлых снимков (для непрерывной записи)
+    
+    Yields:
+        Кортежи в порядке EXPORT_FIELDS; kind - 'last' (последняя цена) или 'book' (стакан)
+    """
+    if snapshot is not None:
+        for exchange, prices in snapshot.prices.items():
+            if fresh_only and not snapshot.is_fresh(exchange):
+                continue
+            ts = snapshot.exchange_time(exchange)
+            items = prices.items() if symbols is None else ((s, prices.get(s)) for s in symbols)
+            for symbol, price in items:
+                if price is not None:
+                    yield (ts, 'last', exchange, symbol, None, None, price)
+    for quote in quotes:
+        if quote is not None:
+            yield (quote.ts, 'book', quote.exchange, quote.symbol, quote.bid, quote.ask, quote.last)
+
+
+def tick_rows(exchange, symbol, times_ms, prices):
+    """Строки экспорта из истории тиков (массивы TickStore.window)"""
+    for ts, price in zip((times_ms / 1000.0).tolist(), prices.tolist()):
+        yield (ts, 'tick', exchange, symbol, None, None, price)
+
+
+class ExportWriter:
+    """
+    Запись строк EXPORT_FIELDS в один файл
+    
+    Форматы: 'csv' и 'jsonl' (сжатие gzip, bz2 или xz средствами Python) и
+    'parquet' (нужен pyarrow, сжатие - кодек Parquet: snappy, gzip, zstd...).
+    """
+    
+    TEXT_COMPRESSION = {"gzip": (gzip.open, ".gz"), "bz2": (bz2.open, ".bz2"), "xz": (lzma.open, ".xz")}
+    
+    def __init__(self, path, fmt, compression=None):
+        """Открытие файла на запись"""
+        self.path = Path(path)
+        self.fmt = fmt
+        self.rows = 0
+        if fmt == 'parquet':
+            schema = pa.schema([
+                ("ts", pa.float64()), ("kind", pa.string()), ("exchange", pa.string()), ("symbol", pa.string()),
+                ("bid", pa.float64()), ("ask", pa.float64()), ("last", pa.float64()),
+            ])
+            self.file = pq.ParquetWriter(str(self.path), schema, compression=compression or 'snappy')
+            self.schema = schema
+        else:
+            opener = self.TEXT_COMPRESSION[compression][0] if compression else open
+            self.file = opener(self.path, 'wt', encoding='utf-8', newline='')
+            if fmt == 'csv':
+                self.csv = csv.writer(self.file)
+                self.csv.writerow(EXPORT_FIELDS)
+    
+    @classmethod
+    def extension(cls, fmt, compression=None):
+        """Расширение файла для формата и сжатия"""
+        if fmt == 'parquet' or not compression:
+            return f".{fmt}"
+        return f".{fmt}{cls.TEXT_COMPRESSION[compression][1]}"
+    
+    def write(self, rows):
+        """Запись списка строк"""
+        if not rows:
+            return
+        if self.fmt == 'parquet':
+            columns = {field: list(values) for field, values in zip(EXPORT_FIELDS, zip(*rows))}
+            self.file.write_table(pa.Table.from_pydict(columns, schema=self.schema))
+        elif self.fmt == 'csv':
+            self.csv.writerows(rows)
+            self.file.flush()
+        else:
+            self.file.writelines(
+                json.dumps(dict(zip(EXPORT_FIELDS, row)), ensure_ascii=False) + "\n" for row in rows
+            )
+            self.file.flush()
+        self.rows += len(rows)
+    
+    def size(self):
+        """Объем записанных данных (байт): для csv и jsonl - до сжатия, для parquet - размер файла"""
+        if self.fmt != 'parquet':
+            return self.file.buffer.tell()
+        try:
+            return self.path.stat().st_size
+        except OSError:
+            return 0
+    
+    def close(self):
+        """Закрытие файла"""
+        self.file.close()
+
+
+class ExportPipeline:
+    """
+    Фоновая запись данных в файлы без блокировки интерфейса
+    
+    submit() только кладет источник строк в очередь: генераторы вроде
+    snapshot_rows и tick_rows вычисляются уже в потоке записи. При
+    переполнении очереди новые данные отбрасываются (dropped), а не ждут.
+    Файлы сменяются по размеру (roll_size) и по времени (roll_seconds),
+    имя файла - prefix и время его создания.
+    """
+    
+    def __init__(self, directory, prefix, fmt=EXPORT_FORMAT, compression=EXPORT_COMPRESSION,
+                 roll_size=EXPORT_ROLL_SIZE, roll_seconds=EXPORT_ROLL_SECONDS):
+        """
+        Инициализация экспорта
+        
+        Args:
+            directory: Папка для файлов (создается в потоке записи)
+            prefix: Начало имени файлов
+            fmt: 'csv', 'jsonl' или 'parquet'; без pyarrow parquet заменяется на csv
+            compression: Сжатие (см. ExportWriter) или None
+            roll_size: Объем файла, после которого начинается новый (байт, см. ExportWriter.size),
+                None - без ограничения
+            roll_seconds: Длительность записи в один файл (сек), None - без ограничения
+        """
+        if fmt == 'parquet' and pq is None:
+            print("pyarrow не установлен, экспорт в CSV вместо Parquet")
+            fmt, compression = 'csv', None
+        if fmt not in ('csv', 'jsonl', 'parquet'):
+            raise ValueError(f"Неизвестный формат экспорта: {fmt}")
+        if fmt != 'parquet' and compression and compression not in ExportWriter.TEXT_COMPRESSION:
+            raise ValueError(f"Неизвестное сжатие для {fmt}: {compression}")
+        
+        self.directory = Path(directory)
+        self.prefix = prefix
+        self.fmt = fmt
+        self.compression = compression
+        self.roll_size = roll_size
+        self.roll_seconds = roll_seconds
+        self.queue = Queue(maxsize=EXPORT_QUEUE_SIZE)
+        self.writer = None
+        self.opened = 0.0
+        self.files = []
+        self.rows = 0
+        self.dropped = 0
+        self.error = None
+        self.on_done = None
+        self.thread = None
+    
+    def start(self):
+        """Запуск потока записи"""
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        return self
+    
+    def submit(self, rows):
+        """
+        Постановка строк (итерируемого источника) в очередь записи без ожидания
+        
+        Returns:
+            False, если очередь переполнена или запись остановлена из-за ошибки
+        """
+        if self.error is not None:
+            return False
+        try:
+            self.queue.put_nowait(rows)
+            return True
+        except Full:
+            self.dropped += 1
+            return False
+    
+    def close(self, on_done=None, timeout=None):
+        """
+        Завершение записи после всех поставленных данных
+        
+        Args:
+            on_done: Функция (список файлов, ошибка или None), вызываемая потоком записи
+            timeout: Ждать завершения не дольше timeout секунд (None - не ждать)
+        """
+        self.on_done = on_done
+        self.queue.put(None)
+        if timeout is not None and self.thread is not None:
+            self.thread.join(timeout)
+    
+    def _open(self):
+        """Открытие нового файла"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        stamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        extension = ExportWriter.extension(self.fmt, self.compression)
+        path = self.directory / f"{self.prefix}_{stamp}{extension}"
+        # Файлы, начатые в одну секунду, получают номер
+        number = 1
+        while path.exists():
+            path = self.directory / f"{self.prefix}_{stamp}_{number}{extension}"
+            number += 1
+        self.writer = ExportWriter(path, self.fmt, self.compression)
+        self.opened = time.time()
+        self.files.append(path)
+    
+    def _roll_due(self):
+        """Пора ли начать новый файл"""
+        if self.roll_seconds is not None and time.time() - self.opened >= self.roll_seconds:
+            return True
+        return self.roll_size is not None and self.writer.size() >= self.roll_size
+    
+    def _run(self):
+        """Поток записи: очередь -> строки -> файл"""
+        finished = False
+        while not finished:
+            sources = [self.queue.get()]
+            # Все, что уже накопилось, пишется одной пачкой
+            while len(sources) < 256:
+                try:
+                    sources.append(self.queue.get_nowait())
+                except Empty:
+                    break
+            if None in sources:
+                finished = True
+                sources = sources[:sources.index(None)]
+            
+            if self.error is not None:
+                continue
+            try:
+                # Большие источники (история тиков) пишутся частями, чтобы не держать их в памяти целиком
+                rows = itertools.chain.from_iterable(sources)
+                while True:
+                    chunk = list(itertools.islice(rows, EXPORT_CHUNK_ROWS))
+                    if not chunk:
+                        break
+                    if self.writer is not None and self._roll_due():
+                        self.writer.close()
+                        self.writer = None
+                    if self.writer is None:
+                        self._open()
+                    self.writer.write(chunk)
+                    self.rows += len(chunk)
+            except Exception as e:
+                print(f"Ошибка экспорта данных: {e}")
+                self.error = e
+        
+        try:
+            if self.writer is not None:
+                self.writer.close()
+        except Exception as e:
+            self.error = self.error or e
+        if self.on_done is not None:
+            self.on_done(list(self.files), self.error)
+
+# ==============================================
+# ЗАПИСЬ И ВОСПРОИЗВЕДЕНИЕ СЕССИЙ
+# ==============================================
+SESSION_FORMAT = "crypto_session"
+
+
+def session_key(exchange, path, params):
+    """Ключ ответа: биржа, путь и параметры запроса без параметров времени"""
+    items = params.items() if isinstance(params, dict) else (params or ())
+    query = "&".join(
+        f"{name}={value}" for name, value in sorted((str(name), str(value)) for name, value in items)
+        if name not in SESSION_TIME_PARAMS
+    )
+    return exchange, path, query
+
+
+def read_session(path):
+    """
+    Чтение файла сессии
+    
+    Формат: gzip, первая строка - заголовок JSON, далее для каждого ответа строка
+    JSON {t: сек от начала, e: биржа, p: путь, q: запрос, s: HTTP-статус, n: длина тела}
+    и само тело ответа (n байт) с переводом строки.
+    
+    Returns:
+        (заголовок, итератор записей (t, ключ session_key, статус, тело в байтах))
+    """
+    file = gzip.open(path, "rb")
+    header = json.loads(file.readline())
+    if header.get("format") != SESSION_FORMAT:
+        file.close()
+        raise ValueError(f"{path}: не файл записи сессии")
+    
+    def records():
+        with file:
+            for line in file:
+                meta = json.loads(line)
+                body = file.read(meta["n"])
+                file.read(1)
+                yield meta["t"], (meta["e"], meta["p"], meta["q"]), meta["s"], body
+    
+    return header, records()
+
+
+def split_adapter_url(adapters, url):
+    """Биржа и путь запроса по base_url адаптеров {биржа: адаптер}; (None, url) для чужого адреса"""
+    for name, adapter in adapters.items():
+        if url.startswith(adapter.base_url):
+            return name, url[len(adapter.base_url):]
+    return None, url
+
+
+class SessionRecorder:
+    """
+    Запись всех ответов бирж с временем получения в сжатый файл
+    
+    Оборачивает HTTP-транспорт адаптеров: запрос выполняется как обычно, а тело
+    ответа ставится в очередь и пишется отдельным потоком, поэтому запись не
+    задерживает цикл обновления. Воспроизводится ReplayTransport.
+    """
+    
+    def __init__(self, transport, path, exchanges=(), symbols=()):
+        """
+        Инициализация записи
+        
+        Args:
+            transport: HttpTransport, через который идут запросы
+            path: Файл записи (gzip)
+            exchanges, symbols: Биржи и монеты сессии (для заголовка файла)
+        """
+        self.transport = transport
+        self.path = Path(path)
+        self.adapters = {}  # Заполняется ядром после создания адаптеров
+        self.started = time.time()
+        self.header = {"format": SESSION_FORMAT, "version": 1, "started": self.started,
+                       "exchanges": list(exchanges), "symbols": list(symbols)}
+        self.queue = Queue(maxsize=SESSION_QUEUE_SIZE)
+        self.records = 0
+        self.dropped = 0
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+    
+    def get(self, url, params=None, timeout=None):
+        """GET через транспорт с записью ответа"""
+        response = self.transport.get(url, params=params, timeout=timeout)
+        exchange, path = split_adapter_url(self.adapters, url)
+        if exchange is not None:
+            try:
+                self.queue.put_nowait((time.time() - self.started, session_key(exchange, path, params),
+                                       response.status_code, response.content))
+            except Full:
+                self.dropped += 1
+        return response
+    
+    def status(self):
+        """Счетчики транспорта и записи"""
+        return {**self.transport.status(), "recorded": self.records, "record_dropped": self.dropped}
+    
+    def close(self, timeout=5):
+        """Запись оставшихся ответов и закрытие файла"""
+        self.queue.put(None)
+        self.thread.join(timeout)
+    
+    def _run(self):
+        """Поток записи: очередь -> файл"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with gzip.open(self.path, "wb", compresslevel=6) as file:
+            file.write(json.dumps(self.header).encode() + b"\n")
+            while True:
+                item = self.queue.get()
+                if item is None:
+                    break
+                t, (exchange, path, query), status, body = item
+                meta = {"t": round(t, 3), "e": exchange, "p": path, "q": query, "s": status, "n": len(body)}
+                file.write(json.dumps(meta, ensure_ascii=False).encode() + b"\n" + body + b"\n")
+                self.records += 1
+        print(f"Сессия записана: {self.path}, ответов: {self.records}, отброшено: {self.dropped}")
+
+
+class ReplayResponse:
+    """Записанный ответ в виде ответа requests (status_code, headers, content, json())"""
+    
+    def __init__(self, status_code, content, url=""):
+        """Ответ со статусом и телом; заголовков запись не хранит"""
+        self.status_code = status_code
+        self.content = content
+        self.headers = {}
+        self.url = url
+    
+    def json(self):
+        """Разобранное тело ответа"""
+        return decode_json(self.content)
+    
+    def raise_for_status(self):
+        """Исключение requests.HTTPError для статусов ошибок"""
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} (запись сессии): {self.url}", response=self)
+
+
+class ReplayTransport:
+    """
+    Воспроизведение записанной сессии вместо сетевых запросов
+    
+    Запись читается последовательно, а прочитанные ответы раскладываются по
+    очередям своих запросов (session_key): параллельные запросы приходят в другом
+    порядке, чем при записи, но каждый получает ответы на свой запрос в записанном
+    порядке. Вперед читается только то, что нужно для текущего запроса, поэтому в
+    памяти держатся ответы, до которых приложение еще не дошло.
+    
+    При скорости speed часы сессии идут в speed раз быстрее настоящих, и запрос
+    получает последний ответ на него, записанный к этому моменту. При максимальной
+    скорости (speed=None) каждый запрос сразу получает следующий ответ на него,
+    а после последнего повторяет его. Паузы между обновлениями приложение
+    сокращает через scale().
+    """
+    
+    def __init__(self, path, speed=REPLAY_SPEED):
+        """
+        Открытие записи
+        
+        Args:
+            path: Файл сессии (SessionRecorder)
+            speed: Ускорение (1 - как при записи) или None - максимальная скорость
+        """
+        self.path = path
+        self.speed = speed
+        self.adapters = {}  # Заполняется ядром после создания адаптеров
+        self.lock = threading.Lock()
+        
+        # Первый проход: какие запросы есть в записи и ее длительность (тела не разбираются)
+        self.header, records = read_session(path)
+        self.keys = set()
+        self.duration = 0.0
+        for t, key, _, _ in records:
+            self.keys.add(key)
+            self.duration = t
+        
+        _, self.records = read_session(path)
+        self.next = next(self.records, None)
+        self.queues = defaultdict(deque)  # {ключ: прочитанные, но еще не отданные (t, статус, тело)}
+        self.latest = {}                  # {ключ: последний отданный (статус, тело)}
+        self.latest_by_path = {}
+        self.started = None
+        self.served = 0
+        self.reported = False
+    
+    @property
+    def finished(self):
+        """Все записанные ответы отданы"""
+        return self.next is None and not any(self.queues.values())
+    
+    def scale(self, seconds):
+        """Пауза приложения с учетом скорости воспроизведения"""
+        return 0 if self.speed is None else seconds / self.speed
+    
+    def clock(self):
+        """Время сессии (сек от начала записи)"""
+        if self.started is None:
+            self.started = time.monotonic()
+        return (time.monotonic() - self.started) * self.speed
+    
+    def _read(self):
+        """Чтение следующей записи файла в очередь ее запроса"""
+        t, key, status, body = self.next
+        self.queues[key].append((t, status, body))
+        self.latest_by_path[key[:2]] = (status, body)
+        self.next = next(self.records, None)
+    
+    def _read_until(self, key, clock=None):
+        """
+        Чтение записи вперед: все записи не позже clock (если задано) и дальше,
+        пока для запроса key нет ни одного ответа
+        """
+        queue = self.queues[key]
+        while self.next is not None:
+            if clock is not None and self.next[0] <= clock:
+                self._read()
+            elif queue or key in self.latest and clock is not None:
+                break
+            else:
+                self._read()
+        return queue
+    
+    def get(self, url, params=None, timeout=None):
+        """Записанный ответ на запрос (404, если такого запроса в записи нет)"""
+        exchange, path = split_adapter_url(self.adapters, url)
+        key = session_key(exchange, path, params)
+        with self.lock:
+            if key not in self.keys:
+                # Запрос с другими параметрами (например, монета, которой не было при записи)
+                status, body = self.latest_by_path.get(key[:2], (404, b'{}'))
+                return ReplayResponse(status, body, url)
+            if self.speed is None:
+                queue = self._read_until(key)
+                if queue:
+                    self.latest[key] = queue.popleft()[1:]
+            else:
+                clock = self.clock()
+                queue = self._read_until(key, clock)
+                # Последний ответ к текущему времени сессии; запрос раньше первого
+                # ответа на него получает этот первый ответ
+                while queue and (queue[0][0] <= clock or key not in self.latest):
+                    self.latest[key] = queue.popleft()[1:]
+            self.served += 1
+            status, body = self.latest[key]
+            if not self.reported and self.finished:
+                self.reported = True
+                print(f"Воспроизведение {self.path} завершено, дальше повторяются последние ответы")
+        return ReplayResponse(status, body, url)
+    
+    def status(self):
+        """Положение воспроизведения для диагностики"""
+        return {"replay": str(self.path), "speed": self.speed, "served": self.served,
+                "clock": None if self.speed is None or self.started is None else self.clock(),
+                "duration": self.duration, "finished": self.finished}
+    
+    def close(self):
+        """Закрытие файла записи"""
+        self.records.close()
+
+# ==============================================
+# ЯДРО ПОЛУЧЕНИЯ ДАННЫХ
+# ==============================================
+class MarketDataCore:
+    """
+    Получение и хранение рыночных данных без зависимости от интерфейса
+    
+    Используется и окном приложения, и фоновым режимом без окна: владеет
+    HTTP-транспортом, адаптерами бирж, кэшами, потоком котировок и хранилищем тиков.
+    
+    При SESSION_RECORD_FILE все ответы бирж записываются в файл, при
+    SESSION_REPLAY_FILE вместо сети воспроизводится запись. В обоих режимах
+    котировки и свечи идут только через REST (без WebSocket и локальной истории
+    свечей), чтобы при воспроизведении приложение делало те же запросы, что и при записи.
+    """
+    
+    def __init__(self, exchanges, symbols, realtime_interval=3):
+        """
+        Инициализация ядра
+        
+        Args:
+            exchanges: Список бирж (порядок столбцов в таблицах)
+            symbols: Монеты для потока котировок и бирж без пакетного эндпоинта
+            realtime_interval: Допустимый возраст снимка котировок (сек)
+        """
+        self.exchanges = list(exchanges)
+        self.symbols = list(symbols)
+        self.realtime_interval = realtime_interval
+        
+        # HTTP-транспорт с пулом постоянных соединений и повторами
+        self.transport = HttpTransport()
+        
+        # Запись ответов бирж в файл или воспроизведение записи вместо сети
+        self.session_recorder = None
+        self.replay = None
+        session = self.transport
+        if SESSION_REPLAY_FILE is not None:
+            self.replay = session = ReplayTransport(SESSION_REPLAY_FILE, REPLAY_SPEED)
+        elif SESSION_RECORD_FILE is not None:
+            self.session_recorder = session = SessionRecorder(
+                self.transport, SESSION_RECORD_FILE, self.exchanges, self.symbols
+            )
+        live = session is self.transport
+        
+        # Регулятор частоты запросов, общий для всех адаптеров
+        self.rate_governor = RateLimitGovernor()
+        
+        # Адаптеры бирж; записанные ответы воспроизводятся без ограничения частоты
+        self.adapters = create_adapters(
+            self.exchanges, session, self.rate_governor if self.replay is None else None
+        )
+        if not live:
+            session.adapters = self.adapters
+        
+        # Движок параллельных запросов
+        self.fetch_engine = FetchEngine()
+        
+        # Провайдер пакетных тикеров: один запрос на биржу за цикл
+        self.ticker_provider = BulkTickerProvider(self.adapters, self.symbols)
+        
+        # Последний снимок котировок, общий для всех панелей и потоков
+        self.snapshot = None
+        self.snapshot_lock = threading.Lock()
+        
+        # Кэш исторических свечей
+        self.kline_cache = KlineCache(self.fetch_klines)
+        
+        # Сканер арбитража по всем общим парам
+        self.arbitrage_scanner = ArbitrageScanner(self.exchanges)
+        
+        # Потоковые котировки (при недоступности используется REST), запускаются в start()
+        self.market_stream = None
+        if USE_STREAMING and live and MarketStream.available():
+            self.market_stream = MarketStream(self.symbols, self.adapters)
+        
+        # Локальные стаканы: из потока изменений, а для остальных бирж - из снимков REST
+        self.depth_stream = None
+        if USE_STREAMING and USE_DEPTH_STREAMS and live and MarketStream.available():
+            self.depth_stream = DepthStream(self.symbols, self.adapters)
+        self.rest_books = {}
+        # Пары (биржа, символ) монет не из списка в порядке обновления стаканов
+        self.extra_books = OrderedDict()
+        
+        # Хранилище тиков на диске (история сохраняется между запусками);
+        # воспроизведенные цены в него не попадают
+        self.tick_store = None
+        if USE_TICK_STORE and self.replay is None:
+            try:
+                self.tick_store = TickStore()
+            except OSError as e:
+                print(f"Хранилище тиков недоступно: {e}")
+        
+        # Локальная история свечей, которую докачивает фоновый поток (запускается в start())
+        self.candle_store = None
+        self.history_sync = None
+        self.on_history_update = None
+        if USE_CANDLE_STORE and live:
+            try:
+                self.candle_store = CandleStore()
+                self.history_sync = HistorySync(
+                    self.candle_store, self.fetch_klines, self.exchanges, self.symbols,
+                    on_update=self._history_updated
+                )
+            except OSError as e:
+                print(f"Локальная история свечей недоступна: {e}")
+        
+        # Результаты последнего цикла; version растет при каждом изменении
+        self.state_lock = threading.Lock()
+        self.books = {}
+        self.books_ts = {}
+        self.depth_quotes = {}
+        self.late_prices = {}
+        self.opportunities = []
+        self.version = 0
+    
+    def start(self):
+        """Запуск потоковых котировок"""
+        if self.market_stream is not None:
+            self.market_stream.start()
+        if self.depth_stream is not None:
+            self.depth_stream.start()
+        if self.history_sync is not None:
+            self.history_sync.start()
+        return self
+    
+    def close(self):
+        """Остановка потока котировок, сброс хранилища и закрытие соединений"""
+        if self.market_stream is not None:
+            self.market_stream.stop()
+        if self.depth_stream is not None:
+            self.depth_stream.stop()
+        if self.history_sync is not None:
+            self.history_sync.stop()
+        if self.tick_store is not None:
+            self.tick_store.flush()
+        if self.candle_store is not None:
+            self.candle_store.flush()
+        self.fetch_engine.shutdown()
+        if self.session_recorder is not None:
+            self.session_recorder.close()
+        if self.replay is not None:
+            self.replay.close()
+        self.transport.close()
+    
+    def scaled(self, seconds):
+        """Пауза между обновлениями с учетом скорости воспроизведения сессии"""
+        return seconds if self.replay is None else self.replay.scale(seconds)
+    
+    def session_status(self):
+        """Состояние записи или воспроизведения сессии или None"""
+        session = self.replay or self.session_recorder
+        return session.status() if session is not None else None
+    
+    def _bump_version(self):
+        """Отметка об изменении данных"""
+        with self.state_lock:
+            self.version += 1
+    
+    def get_snapshot(self, max_age=0):
+        """
+        Получение снимка котировок
+        
+        Если последний снимок моложе max_age секунд, он переиспользуется без запросов.
+        Блокировка гарантирует, что одновременные вызовы из разных потоков
+        дождутся одной загрузки вместо того, чтобы делать свои.
+        
+        Биржи, не ответившие за SNAPSHOT_DEADLINE, не задерживают снимок: их цены
+        переносятся из прошлых данных со старым временем (QuoteSnapshot.times),
+        а опоздавший ответ попадает в следующий снимок.
+        """
+        with self.snapshot_lock:
+            snapshot = self.snapshot
+            if snapshot is not None and snapshot.age() < max_age:
+                return snapshot
+            
+            # Биржи с живым потоком берутся из WebSocket, остальные через REST
+            prices = {}
+            tasks = {}
+            for exchange in self.exchanges:
+                if self.market_stream is not None and self.market_stream.is_live(exchange):
+                    prices[exchange] = self.market_stream.exchange_prices(exchange)
+                else:
+                    tasks[exchange] = (self.rate_governor.call, (PRIORITY_REALTIME, self.ticker_provider.fetch, exchange))
+            fetched = {}
+            if tasks:
+                fetched = self.fetch_engine.run_cycle(
+                    tasks, deadline=min(SNAPSHOT_DEADLINE, self.realtime_interval), on_late=self._late_prices,
+                    name="snapshot"
+                )
+            
+            now = time.time()
+            times = {}
+            for exchange in tasks:
+                if fetched.get(exchange):
+                    prices[exchange] = fetched[exchange]
+                    continue
+                # Самые свежие из известных цен: опоздавший ответ или прошлый снимок
+                with self.state_lock:
+                    late = self.late_prices.pop(exchange, None)
+                if snapshot is not None and snapshot.exchange_prices(exchange):
+                    previous = (snapshot.exchange_prices(exchange), snapshot.exchange_time(exchange))
+                    if late is None or late[1] < previous[1]:
+                        late = previous
+                if late is not None:
+                    prices[exchange], times[exchange] = late
+            snapshot = QuoteSnapshot(prices, now, times)
+            self.snapshot = snapshot
+        
+        self._bump_version()
+        return snapshot
+    
+    def _late_prices(self, exchange, prices):
+        """Сохранение цен биржи, пришедших после дедлайна снимка"""
+        if prices:
+            with self.state_lock:
+                self.late_prices[exchange] = (prices, time.time())
+    
+    def history(self, exchange, symbol, interval, seconds):
+        """
+        Свечи за последние seconds секунд
+        
+        Берутся из локальной истории без запросов к бирже; пока история не загружена,
+        результат может быть пустым (HistorySync сообщит о загрузке через on_history_update).
+        Без локальной истории свечи загружаются через кэш.
+        
+        Returns:
+            CandleBatch (копия данных) или None
+        """
+        if self.candle_store is not None:
+            batch = self.candle_store.window(exchange, symbol, interval, since=time.time() - seconds)
+            return CandleBatch(*(np.array(column) for column in (
+                batch.ts, batch.open, batch.high, batch.low, batch.close, batch.volume
+            )))
+        candles = self.kline_cache.get(exchange, symbol, interval, seconds // KLINE_INTERVAL_SECONDS[interval])
+        return CandleBatch.from_candles(candles) if candles else None
+    
+    def _history_updated(self, exchange, symbol, interval):
+        """Отметка о новых свечах в локальной истории и уведомление интерфейса"""
+        self._bump_version()
+        if self.on_history_update is not None:
+            self.on_history_update(exchange, symbol, interval)
+    
+    def fetch_klines(self, exchange, symbol, interval, limit, start=None):
+        """
+        Загрузка свечей с биржи (start - время открытия первой свечи в мс, см. ExchangeAdapter.fetch_klines)
+        
+        Returns:
+            Список Candle, упорядоченный от старых к новым
+        """
+        try:
+            adapter = self.adapters[exchange]
+            if not adapter.supports_klines:
+                return None
+            with self.rate_governor.priority(PRIORITY_KLINES):
+                return adapter.fetch_klines(symbol, interval, limit, start)
+        except Exception as e:
+            METRICS.inc('update_errors_total', stage="klines")
+            print(f"Ошибка получения исторических данных {exchange} для {symbol}: {e}")
+            return None
+    
+    def fetch_quote(self, symbol, exchange):
+        """
+        Получение цен покупки и продажи для указанной криптовалюты на бирже (Quote или None)
+        
+        Синхронизированный стакан из потока используется без запроса; иначе загружается
+        снимок стакана глубиной DEPTH_LEVELS, который нужен и для расчета VWAP.
+        """
+        try:
+            adapter = self.adapters[exchange]
+            book = self.depth_stream.order_book(exchange, symbol) if self.depth_stream is not None else None
+            if book is None:
+                if not adapter.supports_depth:
+                    return None
+                with self.rate_governor.priority(PRIORITY_BEST):
+                    asks, bids = adapter.fetch_depth(symbol, DEPTH_LEVELS)
+                book = OrderBook(adapter.depth_sequence)
+                book.apply_snapshot(bids, asks)
+                with self.state_lock:
+                    self._store_rest_book(exchange, symbol, book)
+            bid_price, ask_price = book.top()
+            if bid_price is None or ask_price is None:
+                return None
+            return Quote(exchange, symbol, bid=bid_price, ask=ask_price, ts=book.updated)
+        except Exception as e:
+            METRICS.inc('update_errors_total', stage="quote")
+            print(f"Ошибка получения цен покупки/продажи {exchange} для {symbol}: {e}")
+            return None
+    
+    def _store_rest_book(self, exchange, symbol, book):
+        """Сохранение снимка стакана; стаканы монет не из списка ограничены REST_BOOKS_EXTRA (под state_lock)"""
+        key = (exchange, symbol)
+        self.rest_books[key] = book
+        if symbol in self.symbols:
+            return
+        self.extra_books[key] = None
+        self.extra_books.move_to_end(key)
+        while len(self.extra_books) > REST_BOOKS_EXTRA:
+            old_exchange, old_symbol = self.extra_books.popitem(last=False)[0]
+            self.rest_books.pop((old_exchange, old_symbol), None)
+            self.depth_quotes.pop((old_symbol, old_exchange), None)
+    
+    def order_book(self, exchange, symbol):
+        """Самый свежий локальный стакан пары (из потока или последнего снимка REST) или None"""
+        if self.depth_stream is not None:
+            book = self.depth_stream.order_book(exchange, symbol)
+            if book is not None:
+                return book
+        with self.state_lock:
+            return self.rest_books.get((exchange, symbol))
+    
+    def refresh_books(self, symbol, max_age=0):
+        """Параллельная загрузка снимков стаканов символа на биржах, где локальный стакан старше max_age"""
+        now = time.time()
+        tasks = {}
+        for exchange in self.exchanges:
+            book = self.order_book(exchange, symbol)
+            if book is None or now - book.updated >= max_age:
+                tasks[exchange] = (self.fetch_quote, (symbol, exchange))
+        if tasks:
+            self.fetch_engine.run_cycle(tasks, deadline=self.realtime_interval, name="books")
+    
+    def vwap(self, symbol, notional=TRADE_NOTIONAL):
+        """
+        Средневзвешенные цены покупки и продажи символа на объем notional (USDT) по всем биржам
+        
+        Returns:
+            Результат depth_vwap с добавленным возрастом стаканов {'age': {биржа: сек}}
+        """
+        books = {}
+        for exchange in self.exchanges:
+            book = self.order_book(exchange, symbol)
+            if book is not None:
+                books[exchange] = book
+        result = depth_vwap(books, notional)
+        now = time.time()
+        result['age'] = {exchange: now - book.updated for exchange, book in books.items()}
+        return result
+    
+    def fetch_current_price(self, symbol, exchange):
+        """Получение текущей цены криптовалюты на бирже"""
+        try:
+            with self.rate_governor.priority(PRIORITY_BEST):
+                return self.adapters[exchange].fetch_ticker(symbol)
+        except Exception as e:
+            METRICS.inc('update_errors_total', stage="ticker")
+            print(f"Ошибка получения данных {exchange} для {symbol}: {e}")
+            return None
+    
+    def build_cycle_tasks(self, symbol=None):
+        """
+        Формирование списка всех запросов одного цикла обновления
+        
+        Если symbol не задан, загружаются только общие данные: лучшие цены всех пар и снимок.
+        История свечей в цикл не входит: ее загружает HistorySync.
+        
+        Returns:
+            (задачи запросов, вложенные задачи): снимок сам запускает запросы бирж
+            в пуле FetchEngine, поэтому передается в run_cycle отдельно (nested)
+        """
+        tasks = {}
+        if symbol is not None:
+            for exchange in self.exchanges:
+                tasks[('quote', symbol, exchange)] = (self.fetch_quote, (symbol, exchange))
+        
+        # Лучшие цены всех пар для поиска арбитража
+        for exchange in self.exchanges:
+            tasks[('book', None, exchange)] = (self.rate_governor.call, (PRIORITY_TOP10, self.ticker_provider.fetch_book, exchange))
+        
+        # Снимок котировок общий с потоком реального времени: свежий снимок не загружается повторно
+        nested = {('snapshot', None, None): (self.get_snapshot, (self.realtime_interval,))}
+        return tasks, nested
+    
+    def run_cycle(self, symbol=None, on_result=None):
+        """
+        Один цикл обновления: параллельная загрузка, поиск арбитража и сохранение результатов
+        
+        Args:
+            symbol: Выбранная монета (цены стакана) или None
+            on_result: Функция (ключ, результат), вызываемая по мере готовности запросов
+        
+        Returns:
+            Словарь {ключ: результат} всех успевших запросов
+        """
+        def on_late(key, result):
+            # Ответ, не успевший к сроку цикла, дополняет уже показанные данные
+            # (ошибка не затирает последние полученные цены)
+            kind, item_symbol, exchange = key
+            with self.state_lock:
+                if kind == 'quote' and result is not None:
+                    self.depth_quotes[(item_symbol, exchange)] = result
+                    self.version += 1
+                elif kind == 'book' and result:
+                    self.books[exchange] = result
+                    self.books_ts[exchange] = time.time()
+                    self.version += 1
+            if on_result is not None:
+                on_result(key, result)
+        
+        tasks, nested = self.build_cycle_tasks(symbol)
+        results = self.fetch_engine.run_cycle(
+            tasks,
+            nested=nested,
+            on_result=on_result,
+            deadline=CYCLE_DEADLINE,
+            on_late=on_late,
+            name="update" if symbol is not None else "books_all"
+        )
+        now = time.time()
+        
+        with self.state_lock:
+            # Биржа, не ответившая в этом цикле, сохраняет прошлые цены со временем их получения
+            for (kind, item_symbol, exchange), result in results.items():
+                if kind == 'book' and result:
+                    self.books[exchange] = result
+                    self.books_ts[exchange] = now
+                elif kind == 'quote' and result is not None:
+                    self.depth_quotes[(item_symbol, exchange)] = result
+            # Арбитраж считается только по свежим ценам: устаревшие дают ложные расхождения
+            books = {
+                exchange: book
+                for exchange, book in self.books.items()
+                if now - self.books_ts.get(exchange, 0) <= STALE_AFTER
+            }
+        opportunities = self.arbitrage_scanner.scan(books)
+        
+        with self.state_lock:
+            self.opportunities = opportunities
+            self.version += 1
+        return results
+    
+    def quote(self, exchange, symbol):
+        """
+        Лучшие цены символа на бирже из последних известных данных
+        
+        Returns:
+            Quote или None
+        """
+        if self.market_stream is not None and self.market_stream.is_live(exchange):
+            bid_price, ask_price = self.market_stream.book(exchange, symbol)
+            if ask_price is not None and bid_price is not None:
+                return Quote(exchange, symbol, bid=bid_price, ask=ask_price, ts=time.time())
+        with self.state_lock:
+            depth_quote = self.depth_quotes.get((symbol, exchange))
+            book = self.books.get(exchange, {}).get(symbol)
+            if book is None:
+                return depth_quote
+            books_ts = self.books_ts.get(exchange)
+            # Из двух источников берется более свежий
+            if depth_quote is not None and (depth_quote.ts or 0) > (books_ts or 0):
+                return depth_quote
+            bid_price, ask_price = book
+            return Quote(exchange, symbol, bid=bid_price, ask=ask_price, ts=books_ts)
+
+# ==============================================
+# ОСНОВНОЙ КЛАСС ПРИЛОЖЕНИЯ
+# ==============================================
+class CryptoAggregatorApp:
+    """Основной класс приложения-агрегатора криптовалют"""
+    
+    def __init__(self, root):
+        """Инициализация основного приложения"""
+        self.root = root
+        self.root.title("Агрегатор криптовалюты")
+        self.root.geometry("1350x1100")
+        self.root.configure(bg=DARK_BG)
+        
+        # Настройка приложения
+        self._setup_styles()
+        self._create_ui()
+        
+        # Настройки обновления
+        self.running = True
+        self.update_interval = 10  # Интервал основного обновления (сек)
+        self.realtime_interval = 3  # Интервал обновления реального времени (сек)
+        
+        # Ядро получения данных: сессия, адаптеры бирж, кэши, поток котировок, хранилище тиков
+        self.core = MarketDataCore(self.exchanges, self.top10_symbols, self.realtime_interval).start()
+        self.last_realtime_snapshot = None
+        if self.core.replay is not None:
+            speed = self.core.replay.speed
+            self.root.title(f"Агрегатор криптовалюты - воспроизведение {'макс.' if speed is None else f'x{speed:g}'}")
+        
+        # Очередь для безопасного обновления UI из других потоков
+        self.ui_queue = Queue()
+        
+        # Планировщик отрисовки: потоки публикуют данные, виджеты меняются только в потоке Tk
+        self.render_scheduler = RenderScheduler()
+        self.render_scheduler.register('realtime', self._render_realtime_chart)
+        self.render_scheduler.register('weekly', self._render_week_chart)
+        self.render_scheduler.register('price_row', self._render_price_row)
+        self.render_scheduler.register('top10', self._render_top10_column)
+        self.render_scheduler.register('best', self._render_best_prices)
+        self.render_scheduler.register('vwap', self._render_vwap)
+        self.render_scheduler.register('arbitrage', self._render_arbitrage)
+        self.render_scheduler.register('diagnostics', self._render_diagnostics)
+        
+        # Метрики для Prometheus (по --metrics-port); порт может быть занят
+        # другим окном или экспортером - тогда окно работает без /metrics
+        self.metrics_server = None
+        if METRICS_PORT is not None:
+            try:
+                self.metrics_server = MetricsServer(port=METRICS_PORT).start()
+            except OSError as e:
+                if e.errno == errno.EADDRINUSE:
+                    print(f"Порт метрик {METRICS_PORT} занят, /metrics не запущен")
+                else:
+                    print(f"Сервер метрик не запущен: {e}")
+        
+        # Исторические графики перерисовываются, когда фоновая загрузка добавляет свечи
+        self.history_shown = None
+        self.core.on_history_update = self.on_history_update
+        if self.core.history_sync is not None:
+            self.core.history_sync.focus(self.crypto_var.get())
+        
+        # Структуры для хранения данных
+        self.price_history = {exchange: [] for exchange in self.exchanges}
+        self.time_history = []
+        
+        # Ряды реального времени всех монет списка копятся в фоне, чтобы при
+        # переключении монеты сразу показывать накопленные данные
+        self.warm_realtime = {symbol: self.load_realtime_data(symbol) for symbol in self.top10_symbols}
+        self.realtime_data = self.realtime_series(self.crypto_var.get())
+        
+        # Инициализация анимации загрузки
+        self._init_loading_animation()
+        
+        # Запуск фоновых потоков
+        self._start_background_threads()
+        
+        # Обработчики событий
+        self.root.after(100, self.process_ui_queue)
+        self.root.after(150, self.initial_loading)
+        self.root.after(DIAGNOSTICS_INTERVAL * 1000, self.update_diagnostics)
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+    
+    def _init_loading_animation(self):
+        """Инициализация анимации загрузки"""
+        self.loading_canvas = tk.Canvas(
+            self.main_frame.scrollable_frame, 
+            bg=DARK_BG, 
+            height=30, 
+            highlightthickness=0
+        )
+        self.loading_animation = LoadingAnimation(
+            self.loading_canvas, 
+            x=50, 
+            y=5, 
+            size=8, 
+            color=ACCENT_COLOR
+        )
+        self.loading_canvas.pack_forget()
+    
+    def _start_background_threads(self):
+        """Запуск фоновых потоков для обновления данных"""
+        # Поток для основного обновления данных
+        self.update_thread = threading.Thread(target=self.auto_update, daemon=True)
+        self.update_thread.start()
+        
+        # Поток для обновления данных в реальном времени
+        self.realtime_thread = threading.Thread(target=self.auto_update_realtime, daemon=True)
+        self.realtime_thread.start()
+    
+    def initial_loading(self):
+        """Показ анимации загрузки при старте"""
+        self.show_loading()
+        self.root.after(1000, self.hide_loading)
+    
+    def show_loading(self):
+        """Показать анимацию загрузки"""
+        self.loading_canvas.pack(fill='x', pady=10)
+        self.loading_animation.start()
+        self.root.update()
+    
+    def hide_loading(self):
+        """Скрыть анимацию загрузки"""
+        self.loading_animation.stop()
+        self.loading_canvas.pack_forget()
+        self.root.update()
+    
+    def _setup_styles(self):
+        """Настройка стилей для элементов интерфейса"""
+        style = ttk.Style()
+        style.theme_use('clam')
+        
+        # Базовые стили
+        style.configure('.', background=DARK_BG, foreground=TEXT_COLOR)
+        style.configure('TFrame', background=DARK_BG)
+        style.configure('TLabel', background=DARK_BG, foreground=TEXT_COLOR, font=('Arial', 10))
+        style.configure('TButton', background=CARD_BG, foreground=TEXT_COLOR, 
+                       font=('Arial', 10, 'bold'), borderwidth=0)
+        style.map('TButton', background=[('active', ACCENT_COLOR)])
+        
+        # Специальные стили
+        style.configure('Accent.TButton', background=ACCENT_COLOR, foreground=DARK_BG)
+        style.configure('Save.TButton', background=SAVE_COLOR, foreground=DARK_BG)
+        style.map('Save.TButton', 
+                 background=[('active', '#3aa856')],
+                 foreground=[('active', DARK_BG)])
+        style.configure('Header.TLabel', font=('Arial', 16, 'bold'), foreground=ACCENT_COLOR)
+        style.configure('Buy.TLabel', foreground=GREEN_COLOR, font=('Arial', 12, 'bold'))
+        style.configure('Sell.TLabel', foreground=RED_COLOR, font=('Arial', 12, 'bold'))
+        style.configure('Table.TLabel', font=('Arial', 11), anchor='center')
+        style.configure('TableHeader.TLabel', font=('Arial', 11, 'bold'), anchor='center')
+        style.configure('Loading.TCanvas', background=DARK_BG)
+    
+    def _create_ui(self):
+        """Создание пользовательского интерфейса"""
+        self.main_frame = ModernScrollableFrame(self.root)
+        self.main_frame.pack(fill="both", expand=True)
+        
+        # Биржи, по которым строятся таблицы и графики
+        self.exchanges = list(ENABLED_EXCHANGES)
+        
+        # Создание всех компонентов интерфейса
+        self._create_header()
+        self._create_best_price_card()
+        self._create_centered_price_table()
+        self._create_realtime_charts()
+        self._create_weekly_charts()
+        self._create_top10_table()
+        self._create_arbitrage_table()
+        self._create_diagnostics_card()
+    
+    def _create_header(self):
+        """Создание верхней панели приложения"""
+        header_frame = ModernCard(self.main_frame.scrollable_frame)
+        header_frame.pack(fill="x", padx=10, pady=10)
+        
+        # Заголовок приложения
+        title_label = tk.Label(
+            header_frame.card_container, 
+            text="АГРЕГАТОР КРИПТОВАЛЮТЫ", 
+            bg=CARD_BG, 
+            fg=TEXT_COLOR,
+            font=('Arial', 20, 'bold')
+        )
+        title_label.pack(side="left", padx=10, pady=5)
+        
+        # Панель управления
+        control_frame = tk.Frame(header_frame.card_container, bg=CARD_BG)
+        control_frame.pack(side="right", padx=10, pady=5)
+        
+        # Кнопка сохранения данных
+        save_btn = ttk.Button(
+            control_frame, 
+            text="💾 Сохранить", 
+            style='Save.TButton', 
+            command=self.save_data_to_file
+        )
+        save_btn.pack(side="left", padx=5)
+        
+        # Кнопка непрерывной записи котировок в файлы
+        self.recorder = None
+        self.record_btn = ttk.Button(
+            control_frame, 
+            text="⏺ Запись", 
+            style='Save.TButton', 
+            command=self.toggle_recording
+        )
+        self.record_btn.pack(side="left", padx=5)
+        
+        # Выбор криптовалюты
+        self.crypto_var = tk.StringVar(value="BTC")
+        crypto_menu = ttk.Combobox(
+            control_frame,
+            textvariable=self.crypto_var,
+            values=TOP_SYMBOLS,
+            state="readonly",
             width=10,
             font=('Arial', 11)
         )
@@ -432,98 +4805,93 @@ class CryptoAggregatorApp:
         refresh_btn.pack(side="left", padx=5)
     
     def save_data_to_file(self):
-        """Сохранение текущих данных в файл на рабочем столе"""
-        try:
-            # Определение пути к рабочему столу
-            desktop = Path.home() / "Desktop"
-            if not desktop.exists():
-                desktop = Path.home() / "Рабочий стол"
-            
-            # Создание папки для сохранения
-            save_dir = desktop / "CryptoData"
-            save_dir.mkdir(exist_ok=True)
-            
-            # Формирование имени файла
-            timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-            filename = save_dir / f"crypto_data_{self.crypto_var.get()}_{timestamp}.txt"
-            
-            # Сбор данных для сохранения
-            data = {
-                "crypto": self.crypto_var.get(),
-                "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                "best_prices": {
-                    "buy": self.best_buy_label.cget("text"),
-                    "sell": self.best_sell_label.cget("text")
-                },
-                "exchange_prices": {},
-                "top10_prices": {}
-            }
-            
-            # Сбор данных по биржам
-            for i, exchange in enumerate(self.exchanges):
-                data["exchange_prices"][exchange] = {
-                    "buy": self.price_labels[i][0].cget("text"),
-                    "sell": self.price_labels[i][1].cget("text"),
-                    "spread": self.price_labels[i][2].cget("text")
-                }
-            
-            # Сбор данных топ-10 криптовалют
-            for i, symbol in enumerate(self.top10_symbols):
-                data["top10_prices"][symbol] = {
-                    "Bybit": self.top10_labels[i][0].cget("text"),
-                    "MEXC": self.top10_labels[i][1].cget("text"),
-                    "Binance": self.top10_labels[i][2].cget("text")
-                }
-            
-            # Сохранение в читаемом текстовом формате
-            with open(filename, 'w', encoding='utf-8') as f:
-                f.write(f"Данные криптовалютного агрегатора\n")
-                f.write(f"Дата: {data['timestamp']}\n")
-                f.write(f"Криптовалюта: {data['crypto']}\n\n")
-                
-                f.write("=== Лучшие цены ===\n")
-                f.write(f"{data['best_prices']['buy']}\n")
-                f.write(f"{data['best_prices']['sell']}\n\n")
-                
-                f.write("=== Цены по биржам ===\n")
-                for exchange, prices in data['exchange_prices'].items():
-                    f.write(f"{exchange}:\n")
-                    f.write(f"  Купить: {prices['buy']}\n")
-                    f.write(f"  Продать: {prices['sell']}\n")
-                    f.write(f"  Спред: {prices['spread']}\n\n")
-                
-                f.write("=== Топ-10 криптовалют ===\n")
-                for symbol, prices in data['top10_prices'].items():
-                    f.write(f"{symbol}:\n")
-                    f.write(f"  Bybit: {prices['Bybit']}\n")
-                    f.write(f"  MEXC: {prices['MEXC']}\n")
-                    f.write(f"  Binance: {prices['Binance']}\n\n")
-            
-            # Уведомление об успешном сохранении
-            messagebox.showinfo(
-                "Сохранение данных",
-                f"Данные успешно сохранены в файл:\n{filename}"
-            )
-            
-            # Дополнительное сохранение в JSON
-            json_filename = save_dir / f"crypto_data_{self.crypto_var.get()}_{timestamp}.json"
-            with open(json_filename, 'w', encoding='utf-8') as f:
-                json.dump(data, f, indent=2, ensure_ascii=False)
-                
-        except Exception as e:
+        """
+        Сохранение снимка котировок и истории тиков выбранной монеты в файл
+        
+        В потоке Tk только собираются ссылки на уже загруженные данные (снимок,
+        цены стаканов, срезы хранилища тиков), строки формируются и пишутся
+        на диск в потоке ExportPipeline.
+        """
+        symbol = self.crypto_var.get()
+        symbols = list(dict.fromkeys(self.top10_symbols + [symbol]))
+        quotes = [self.core.quote(exchange, symbol) for exchange in self.exchanges]
+        
+        export = ExportPipeline(
+            export_directory(), f"crypto_data_{symbol}", roll_size=None, roll_seconds=None
+        ).start()
+        export.submit(snapshot_rows(self.core.snapshot, symbols, quotes))
+        if self.core.tick_store is not None:
+            for exchange in self.exchanges:
+                export.submit(tick_rows(exchange, symbol, *self.core.tick_store.window(exchange, symbol)))
+        export.close(on_done=lambda files, error: self.post_ui(self._on_export_done, files, error))
+    
+    def _on_export_done(self, files, error):
+        """Сообщение о результате сохранения (поток Tk)"""
+        if error is not None:
             messagebox.showerror(
                 "Ошибка сохранения",
-                f"Не удалось сохранить данные:\n{str(e)}"
+                f"Не удалось сохранить данные:\n{str(error)}"
+            )
+        elif files:
+            messagebox.showinfo(
+                "Сохранение данных",
+                f"Данные успешно сохранены в файл:\n{files[0]}"
             )
+        else:
+            messagebox.showinfo("Сохранение данных", "Нет данных для сохранения")
+    
+    def toggle_recording(self):
+        """Включение и выключение непрерывной записи котировок"""
+        if self.recorder is None:
+            try:
+                self.recorder = ExportPipeline(export_directory(), "crypto_record").start()
+            except ValueError as e:
+                messagebox.showerror("Ошибка записи", str(e))
+                return
+            self.record_btn.config(text="⏹ Стоп")
+        else:
+            recorder, self.recorder = self.recorder, None
+            recorder.close(on_done=lambda files, error: print(
+                f"Запись остановлена: {len(files)} файл(ов), строк: {recorder.rows}, отброшено пачек: {recorder.dropped}"
+            ))
+            self.record_btn.config(text="⏺ Запись")
+    
+    def record_snapshot(self, snapshot, symbol):
+        """Постановка нового снимка и цен стаканов выбранной монеты в очередь записи"""
+        recorder = self.recorder
+        if recorder is None:
+            return
+        quotes = [self.core.quote(exchange, symbol) for exchange in self.exchanges]
+        recorder.submit(snapshot_rows(
+            snapshot, list(dict.fromkeys(self.top10_symbols + [symbol])), quotes, fresh_only=True
+        ))
     
     def on_crypto_change(self):
-        """Обработчик изменения выбранной криптовалюты"""
-        self.show_loading()
-        try:
-            self.reset_chart_data()
-            self.update_data()
-        finally:
-            self.hide_loading()
+        """
+        Обработчик изменения выбранной криптовалюты
+        
+        Монета сразу показывается по уже загруженным данным (ряды реального времени,
+        локальная история свечей, последние снимок и стаканы), а свежие данные
+        загружаются в фоновом потоке: в потоке Tk нет запросов к биржам.
+        """
+        symbol = self.crypto_var.get()
+        if self.core.history_sync is not None:
+            self.core.history_sync.focus(symbol)
+        self.reset_chart_data()
+        self.show_symbol(symbol)
+        threading.Thread(target=self.update_data, daemon=True).start()
+    
+    def show_symbol(self, symbol):
+        """Публикация всех панелей монеты по уже имеющимся данным без запросов к биржам"""
+        for exchange in self.exchanges:
+            self.update_price_row(exchange, self.core.quote(exchange, symbol))
+            self.render_scheduler.publish('realtime', exchange, (symbol, self.realtime_data[exchange]))
+        if self.core.snapshot is not None:
+            self.update_market_prices(self.core.snapshot, symbol)
+        self.update_vwap(symbol)
+        # Без локальной истории свечи загружаются по сети: это сделает фоновый update_data
+        if self.core.candle_store is not None:
+            self.update_history_charts(symbol)
     
     def manual_refresh(self):
         """Ручное обновление данных"""
@@ -539,7 +4907,7 @@ class CryptoAggregatorApp:
         try:
             self.update_data()
         finally:
-            self.ui_queue.put((self.hide_loading, ()))
+            self.post_ui(self.hide_loading)
     
     def _create_best_price_card(self):
         """Создание карточки с лучшими ценами"""
@@ -589,6 +4957,40 @@ class CryptoAggregatorApp:
             font=('Arial', 11, 'bold')
         )
         self.best_sell_label.pack(side="left", padx=5)
+        
+        # Фрейм для средневзвешенных цен сделки заданного объема
+        self.best_vwap_frame = tk.Frame(content, bg=CARD_BG)
+        self.best_vwap_frame.pack(fill="x", pady=5)
+        
+        tk.Label(
+            self.best_vwap_frame, 
+            text="ОБЪЕМ СДЕЛКИ (USDT):", 
+            bg=CARD_BG, 
+            fg=TEXT_COLOR,
+            font=('Arial', 11)
+        ).pack(side="left")
+        
+        self.trade_notional = float(TRADE_NOTIONAL)
+        self.trade_size_var = tk.StringVar(value=str(TRADE_NOTIONAL))
+        tk.Entry(
+            self.best_vwap_frame,
+            textvariable=self.trade_size_var,
+            width=10,
+            bg=DARK_BG,
+            fg=TEXT_COLOR,
+            insertbackground=TEXT_COLOR,
+            font=('Arial', 11)
+        ).pack(side="left", padx=5)
+        self.trade_size_var.trace_add('write', lambda *args: self.on_trade_size_change())
+        
+        self.best_vwap_label = tk.Label(
+            self.best_vwap_frame, 
+            text="загрузка...", 
+            bg=CARD_BG, 
+            fg=ACCENT_COLOR,
+            font=('Arial', 11, 'bold')
+        )
+        self.best_vwap_label.pack(side="left", padx=5)
     
     def _create_centered_price_table(self):
         """Создание таблицы с ценами по биржам"""
@@ -615,7 +5017,6 @@ class CryptoAggregatorApp:
             ).grid(row=0, column=col)
         
         # Данные по биржам
-        self.exchanges = ["Bybit", "MEXC", "Binance"]
         self.price_labels = []
         
         # Заполнение таблицы данными
@@ -683,10 +5084,24 @@ class CryptoAggregatorApp:
         self._init_realtime_charts()
     
     def _create_weekly_charts(self):
-        """Создание исторических графиков за неделю"""
-        self.weekly_charts_frame = ModernCard(self.main_frame.scrollable_frame, title="История за 7 дней")
+        """Создание исторических графиков с выбором периода (неделя, месяц, год)"""
+        self.weekly_charts_frame = ModernCard(self.main_frame.scrollable_frame, title="История цен")
         self.weekly_charts_frame.pack(fill="x", padx=10, pady=10)
         
+        # Выбор периода: графики строятся по локальной истории свечей
+        self.history_period = next(iter(HISTORY_PERIODS))
+        self.history_period_var = tk.StringVar(value=self.history_period)
+        period_menu = ttk.Combobox(
+            self.weekly_charts_frame.title_frame,
+            textvariable=self.history_period_var,
+            values=list(HISTORY_PERIODS),
+            state="readonly",
+            width=10,
+            font=('Arial', 10)
+        )
+        period_menu.pack(side="right")
+        self.history_period_var.trace_add('write', lambda *args: self.on_history_period_change())
+        
         self.weekly_chart_frames = []
         for exchange in self.exchanges:
             chart_frame = tk.Frame(self.weekly_charts_frame.content, bg=CARD_BG)
@@ -707,7 +5122,7 @@ class CryptoAggregatorApp:
         self.top10_table.pack(pady=10)
         
         # Заголовки таблицы
-        headers = ["Криптовалюта", "Bybit", "MEXC", "Binance"]
+        headers = ["Криптовалюта"] + self.exchanges
         for col, header in enumerate(headers):
             tk.Label(
                 self.top10_table, 
@@ -720,7 +5135,7 @@ class CryptoAggregatorApp:
             ).grid(row=0, column=col)
         
         # Список криптовалют
-        self.top10_symbols = ["BTC", "ETH", "BNB", "SOL", "XRP", "ADA", "DOGE", "DOT", "AVAX"]
+        self.top10_symbols = list(TOP_SYMBOLS)
         self.top10_labels = []
         
         # Заполнение таблицы данными
@@ -733,62 +5148,110 @@ class CryptoAggregatorApp:
                 fg=TEXT_COLOR,
                 font=('Arial', 11),
                 padx=10,
-                pady=2
-            ).grid(row=row, column=0)
-            
-            # Цены по биржам
-            for col, exchange in enumerate(self.exchanges, start=1):
+                pady=2
+            ).grid(row=row, column=0)
+            
+            # Цены по биржам
+            row_labels = []
+            for col, exchange in enumerate(self.exchanges, start=1):
+                label = tk.Label(
+                    self.top10_table, 
+                    text="...", 
+                    bg=CARD_BG, 
+                    fg=TEXT_COLOR,
+                    font=('Arial', 11),
+                    padx=10,
+                    pady=2
+                )
+                label.grid(row=row, column=col)
+                row_labels.append(label)
+            self.top10_labels.append(tuple(row_labels))
+    
+    def _create_arbitrage_table(self):
+        """Создание таблицы лучших арбитражных возможностей между биржами"""
+        self.arbitrage_card = ModernCard(self.main_frame.scrollable_frame, title="Арбитраж между биржами")
+        self.arbitrage_card.pack(fill="x", padx=10, pady=10)
+        
+        table_container = tk.Frame(self.arbitrage_card.content, bg=CARD_BG)
+        table_container.pack(expand=True)
+        
+        self.arbitrage_table = tk.Frame(table_container, bg=CARD_BG)
+        self.arbitrage_table.pack(pady=10)
+        
+        # Заголовки таблицы
+        headers = ["Криптовалюта", "Купить на", "Цена покупки", "Продать на", "Цена продажи", "Спред"]
+        for col, header in enumerate(headers):
+            tk.Label(
+                self.arbitrage_table, 
+                text=header, 
+                bg=CARD_BG, 
+                fg=ACCENT_COLOR,
+                font=('Arial', 11, 'bold'),
+                padx=10,
+                pady=5
+            ).grid(row=0, column=col)
+        
+        # Строки таблицы создаются заранее и заполняются при каждом сканировании
+        self.arbitrage_labels = []
+        for row in range(1, ARBITRAGE_TOP_N + 1):
+            labels = []
+            for col in range(len(headers)):
                 label = tk.Label(
-                    self.top10_table, 
-                    text="...", 
+                    self.arbitrage_table, 
+                    text="", 
                     bg=CARD_BG, 
-                    fg=TEXT_COLOR,
+                    fg=GREEN_COLOR if col == len(headers) - 1 else TEXT_COLOR,
                     font=('Arial', 11),
                     padx=10,
                     pady=2
                 )
                 label.grid(row=row, column=col)
-                if col == 1:
-                    self.top10_labels.append((label, None, None))
-                elif col == 2:
-                    self.top10_labels[-1] = (self.top10_labels[-1][0], label, None)
-                else:
-                    self.top10_labels[-1] = (self.top10_labels[-1][0], self.top10_labels[-1][1], label)
+                labels.append(label)
+            self.arbitrage_labels.append(labels)
+        
+        # Строка состояния сканера
+        self.arbitrage_status = tk.Label(
+            self.arbitrage_card.content, 
+            text="загрузка...", 
+            bg=CARD_BG, 
+            fg=TEXT_COLOR,
+            font=('Arial', 9)
+        )
+        self.arbitrage_status.pack(anchor="w")
+    
+    def _create_diagnostics_card(self):
+        """Создание карточки диагностики: длительности горячих путей и счетчики ошибок"""
+        self.diagnostics_card = ModernCard(self.main_frame.scrollable_frame, title="Диагностика")
+        self.diagnostics_card.pack(fill="x", padx=10, pady=10)
+        
+        reset_btn = tk.Button(
+            self.diagnostics_card.title_frame,
+            text="Сбросить",
+            command=METRICS.reset,
+            bg=ACCENT_COLOR,
+            fg=DARK_BG,
+            font=('Arial', 9),
+            relief="flat"
+        )
+        reset_btn.pack(side="right")
+        
+        self.diagnostics_label = tk.Label(
+            self.diagnostics_card.content,
+            text="нет данных",
+            bg=CARD_BG,
+            fg=TEXT_COLOR,
+            font=('Courier', 9),
+            justify="left",
+            anchor="w"
+        )
+        self.diagnostics_label.pack(fill="x")
     
     def _init_realtime_charts(self):
         """Инициализация графиков реального времени"""
-        self.realtime_figures = []
-        self.realtime_axes = []
-        self.realtime_canvases = []
-        
-        for i, exchange in enumerate(self.exchanges):
-            # Создание фигуры matplotlib
-            fig = Figure(figsize=(4, 2.5), dpi=100, facecolor=CARD_BG)
-            ax = fig.add_subplot(111)
-            ax.set_facecolor(CARD_BG)
-            
-            # Настройка осей
-            ax.tick_params(axis='x', colors=TEXT_COLOR, labelsize=7)
-            ax.tick_params(axis='y', colors=TEXT_COLOR, labelsize=8)
-            ax.yaxis.label.set_color(TEXT_COLOR)
-            ax.set_title(f'{exchange} (Real-time)', color=TEXT_COLOR, fontsize=9)
-            
-            # Форматирование чисел
-            ax.yaxis.set_major_formatter(plt.FormatStrFormatter('%.2f'))
-            
-            # Настройка границ
-            for spine in ax.spines.values():
-                spine.set_color(ACCENT_COLOR)
-            
-            # Встраивание в Tkinter
-            canvas = FigureCanvasTkAgg(fig, master=self.realtime_chart_frames[i])
-            canvas.draw()
-            canvas.get_tk_widget().pack(fill="both", expand=True)
-            
-            # Сохранение ссылок
-            self.realtime_figures.append(fig)
-            self.realtime_axes.append(ax)
-            self.realtime_canvases.append(canvas)
+        self.realtime_charts = [
+            RealtimeChart(self.realtime_chart_frames[i], exchange)
+            for i, exchange in enumerate(self.exchanges)
+        ]
     
     def _init_weekly_charts(self):
         """Инициализация недельных графиков"""
@@ -806,7 +5269,7 @@ class CryptoAggregatorApp:
             ax.tick_params(axis='x', colors=TEXT_COLOR, labelsize=7, rotation=45)
             ax.tick_params(axis='y', colors=TEXT_COLOR, labelsize=8)
             ax.yaxis.label.set_color(TEXT_COLOR)
-            ax.set_title(f'{exchange} (7 days)', color=TEXT_COLOR, fontsize=9, pad=10)
+            ax.set_title(f'{exchange} ({self.history_period.lower()})', color=TEXT_COLOR, fontsize=9, pad=10)
             
             # Настройка отображения дат
             fig.autofmt_xdate(bottom=0.2, rotation=45, ha='right')
@@ -821,6 +5284,7 @@ class CryptoAggregatorApp:
             
             # Встраивание в Tkinter
             canvas = FigureCanvasTkAgg(fig, master=self.weekly_chart_frames[i])
+            canvas.draw = METRICS.timed(canvas.draw, 'chart_draw_seconds', chart='history')
             canvas.draw()
             canvas.get_tk_widget().pack(fill="both", expand=True)
             
@@ -829,93 +5293,133 @@ class CryptoAggregatorApp:
             self.weekly_axes.append(ax)
             self.weekly_canvases.append(canvas)
     
+    def post_ui(self, task, *args):
+        """Постановка задачи в очередь потока Tk (можно вызывать из любого потока)"""
+        self.ui_queue.put((task, args, time.perf_counter()))
+    
     def process_ui_queue(self):
-        """Обработка очереди задач для обновления UI из других потоков"""
+        """Обработка очереди задач и отрисовка изменившихся виджетов в потоке Tk (один кадр)"""
+        start = time.perf_counter()
         try:
-            while not self.ui_queue.empty():
-                task, args = self.ui_queue.get_nowait()
-                task(*args)
-        except:
-            pass
+            METRICS.set('ui_queue_depth', self.ui_queue.qsize())
+            while True:
+                try:
+                    task, args, queued = self.ui_queue.get_nowait()
+                except Empty:
+                    break
+                METRICS.observe('ui_queue_wait_seconds', time.perf_counter() - queued)
+                try:
+                    task(*args)
+                except Exception as e:
+                    METRICS.inc('update_errors_total', stage="ui_task")
+                    print(f"Ошибка задачи UI: {e}")
+            
+            self.render_scheduler.render_frame()
+            METRICS.observe('ui_frame_seconds', time.perf_counter() - start)
         finally:
-            self.root.after(100, self.process_ui_queue)
+            self.root.after(self.render_scheduler.frame_interval, self.process_ui_queue)
     
     def reset_chart_data(self):
         """Сброс данных графиков при изменении криптовалюты"""
-        self.price_history = {'Bybit': [], 'MEXC': [], 'Binance': []}
+        self.price_history = {exchange: [] for exchange in self.exchanges}
         self.time_history = []
-        self.realtime_data = {
-            'Bybit': {'prices': [], 'times': []},
-            'MEXC': {'prices': [], 'times': []},
-            'Binance': {'prices': [], 'times': []}
-        }
+        self.realtime_data = self.realtime_series(self.crypto_var.get())
+        
+        # Данные, опубликованные для прежней монеты, больше не отрисовываются
+        for kind in ('realtime', 'weekly', 'price_row', 'best', 'vwap'):
+            self.render_scheduler.discard(kind)
         
         # Очистка графиков
-        for i in range(len(self.exchanges)):
-            self.realtime_axes[i].clear()
-            self.weekly_axes[i].clear()
-            
-            self.realtime_axes[i].set_title(f'{self.exchanges[i]} (Real-time)', color=TEXT_COLOR, fontsize=9)
-            self.weekly_axes[i].set_title(f'{self.exchanges[i]} (7 days)', color=TEXT_COLOR, fontsize=9)
+        for i, exchange in enumerate(self.exchanges):
+            chart = self.realtime_charts[i]
+            chart.reset()
+            chart.set_data(*self.realtime_data[exchange].views())
+            chart.draw()
             
-            self.realtime_canvases[i].draw()
-            self.weekly_canvases[i].draw()
+            self.weekly_axes[i].clear()
+            self.weekly_axes[i].set_title(f'{exchange} ({self.history_period.lower()})', color=TEXT_COLOR, fontsize=9)
+            self.weekly_canvases[i].draw_idle()
+    
+    def load_realtime_data(self, symbol):
+        """Создание рядов графиков реального времени и заполнение их последними тиками из хранилища"""
+        realtime_data = {}
+        for exchange in self.exchanges:
+            series = RealtimeSeries(REALTIME_HISTORY)
+            if self.core.tick_store is not None:
+                times_ms, prices = self.core.tick_store.window(exchange, symbol, last=series.prices.capacity)
+                series.extend(times_ms / 1000.0, prices)
+            realtime_data[exchange] = series
+        return realtime_data
+    
+    def realtime_series(self, symbol):
+        """Ряды реального времени монеты по биржам (для монеты вне списка создаются при первом обращении)"""
+        series = self.warm_realtime.get(symbol)
+        if series is None:
+            series = self.warm_realtime[symbol] = self.load_realtime_data(symbol)
+        return series
     
     def update_realtime_charts(self):
         """Обновление графиков в реальном времени"""
         symbol = self.crypto_var.get()
         
         try:
-            for i, exchange in enumerate(self.exchanges):
-                # Получение текущей цены
-                price = self.fetch_current_price(symbol, exchange)
-                
-                if price is not None:
-                    # Добавление новых данных
-                    self.realtime_data[exchange]['prices'].append(price)
-                    self.realtime_data[exchange]['times'].append(datetime.now())
-                    
-                    # Ограничение истории
-                    if len(self.realtime_data[exchange]['prices']) > 20:
-                        self.realtime_data[exchange]['prices'] = self.realtime_data[exchange]['prices'][-20:]
-                        self.realtime_data[exchange]['times'] = self.realtime_data[exchange]['times'][-20:]
-                    
-                    # Очистка и перерисовка графика
-                    self.realtime_axes[i].clear()
-                    
-                    # Настройка осей
-                    self.realtime_axes[i].tick_params(axis='x', colors=TEXT_COLOR, labelsize=7, rotation=45)
-                    self.realtime_axes[i].tick_params(axis='y', colors=TEXT_COLOR, labelsize=8)
-                    self.realtime_axes[i].yaxis.set_major_formatter(plt.FormatStrFormatter('%.2f'))
-                    self.realtime_axes[i].xaxis.set_major_formatter(DateFormatter('%H:%M'))
-                    self.realtime_figures[i].subplots_adjust(bottom=0.25, left=0.15)
-                    
-                    # Построение графика
-                    self.realtime_axes[i].plot(
-                        self.realtime_data[exchange]['times'],
-                        self.realtime_data[exchange]['prices'],
-                        color=GREEN_COLOR, linewidth=1
+            snapshot = self.core.get_snapshot(max_age=self.core.scaled(self.realtime_interval))
+            
+            # Один и тот же снимок не добавляется на график дважды
+            if snapshot is self.last_realtime_snapshot:
+                return
+            self.last_realtime_snapshot = snapshot
+            
+            # Снимок содержит цены всех монет: ряды остальных монет пополняются без публикации
+            for item_symbol in list(self.warm_realtime):
+                for exchange in self.exchanges:
+                    # Цены, перенесенные из прошлых снимков, не добавляются как новые тики
+                    if not snapshot.is_fresh(exchange):
+                        continue
+                    self.update_realtime_chart(
+                        exchange, item_symbol, snapshot.get(exchange, item_symbol), snapshot.timestamp,
+                        publish=item_symbol == symbol
                     )
-                    
-                    # Настройка заголовков
-                    self.realtime_axes[i].set_title(f'{exchange} - {symbol} (Real-time)', color=TEXT_COLOR, fontsize=9)
-                    self.realtime_axes[i].set_xlabel('Время', color=TEXT_COLOR, fontsize=8)
-                    self.realtime_axes[i].set_ylabel('Цена (USD)', color=TEXT_COLOR, fontsize=8)
-                    
-                    # Настройка границ
-                    for spine in self.realtime_axes[i].spines.values():
-                        spine.set_color(ACCENT_COLOR)
-                    
-                    # Автомасштабирование
-                    self.realtime_axes[i].relim()
-                    self.realtime_axes[i].autoscale_view()
-                    
-                    # Обновление canvas через очередь UI
-                    self.ui_queue.put((self.realtime_canvases[i].draw, ()))
+            self.record_snapshot(snapshot, symbol)
+            
+            # Стаканы из потока меняются непрерывно: VWAP пересчитывается вместе с графиками
+            self.update_vwap(symbol)
         
         except Exception as e:
+            METRICS.inc('update_errors_total', stage="realtime")
             print(f"Ошибка обновления графиков реального времени: {e}")
     
+    def update_realtime_chart(self, exchange, symbol, price, timestamp, publish=True):
+        """
+        Добавление новой цены и публикация графика одной биржи
+        
+        Args:
+            timestamp: Время Unix в секундах
+            publish: Публиковать график (False - только пополнить ряд невыбранной монеты)
+        """
+        if price is None:
+            return
+        
+        # Добавление новых данных (старые точки вытесняются кольцевым буфером)
+        series = self.realtime_series(symbol)[exchange]
+        series.append(timestamp, price)
+        
+        # Сохранение тика на диск
+        if self.core.tick_store is not None:
+            self.core.tick_store.append(exchange, symbol, timestamp, price)
+        
+        # Публикуется сам ряд: поток Tk возьмет срезы при отрисовке
+        if publish:
+            self.render_scheduler.publish('realtime', exchange, (symbol, series))
+    
+    def _render_realtime_chart(self, exchange, data):
+        """Отрисовка графика реального времени (поток Tk)"""
+        symbol, series = data
+        chart = self.realtime_charts[self.exchanges.index(exchange)]
+        chart.set_symbol(symbol)
+        chart.set_data(*series.views())
+        chart.draw()
+    
     def auto_update_realtime(self):
         """Автоматическое обновление графиков реального времени в отдельном потоке"""
         while self.running:
@@ -925,244 +5429,305 @@ class CryptoAggregatorApp:
                 print(f"Ошибка в потоке реального времени: {e}")
             
             # Пауза между обновлениями
-            for _ in range(self.realtime_interval):
-                if not self.running:
-                    return
-                time.sleep(1)
+            if not self.pause(self.realtime_interval):
+                return
     
-    def fetch_historical_data(self, symbol, exchange):
-        """Получение исторических данных за 7 дней для указанной криптовалюты и биржи"""
-        try:
-            if exchange == "Binance":
-                url = f"https://api.binance.com/api/v3/klines?symbol={symbol}USDT&interval=1d&limit=7"
-                response = self.session.get(url, timeout=5)
-                response.raise_for_status()
-                data = response.json()
-                return [float(item[4]) for item in data]
-            
-            elif exchange == "Bybit":
-                url = f"https://api.bybit.com/v5/market/kline?category=spot&symbol={symbol}USDT&interval=D&limit=7"
-                response = self.session.get(url, timeout=5)
-                response.raise_for_status()
-                data = response.json()
-                if data['retCode'] == 0:
-                    return [float(item[4]) for item in data['result']['list']]
-            
-            elif exchange == "MEXC":
-                url = f"https://api.mexc.com/api/v3/klines?symbol={symbol}USDT&interval=1d&limit=7"
-                response = self.session.get(url, timeout=5)
-                response.raise_for_status()
-                data = response.json()
-                return [float(item[4]) for item in data]
-        except Exception as e:
-            print(f"Ошибка получения исторических данных {exchange} для {symbol}: {e}")
-            return None
+    def on_history_period_change(self):
+        """Обработчик выбора периода исторических графиков"""
+        self.history_period = self.history_period_var.get()
+        self.render_scheduler.discard('weekly')
+        threading.Thread(target=self.update_history_charts, args=(self.crypto_var.get(),), daemon=True).start()
     
-    def update_week_charts(self):
-        """Обновление недельных графиков"""
-        symbol = self.crypto_var.get()
-        dates = [datetime.now() - timedelta(days=i) for i in range(6, -1, -1)]
+    def on_history_update(self, exchange, symbol, interval):
+        """Новые свечи в локальной истории (вызывается потоком HistorySync)"""
+        if symbol == self.crypto_var.get() and interval == HISTORY_PERIODS[self.history_period][0]:
+            self.update_history_chart(exchange, symbol, self.history_period)
+    
+    def update_history_charts(self, symbol):
+        """Публикация исторических графиков выбранного периода по всем биржам"""
+        period = self.history_period
+        for exchange in self.exchanges:
+            self.update_history_chart(exchange, symbol, period)
+        self.history_shown = (symbol, period)
+    
+    def update_history_chart(self, exchange, symbol, period):
+        """Публикация исторического графика одной биржи по реальному времени открытия свечей"""
+        interval, seconds = HISTORY_PERIODS[period]
+        batch = self.core.history(exchange, symbol, interval, seconds)
+        if batch is None or len(batch) < 2:
+            print(f"Недостаточно данных для {exchange} (получено {len(batch) if batch else 0} свечей)")
+            return
+        self.render_scheduler.publish('weekly', exchange, (symbol, period, batch.ts / 1000.0, batch.close))
+    
+    def _render_week_chart(self, exchange, data):
+        """Перерисовка исторического графика одной биржи (поток Tk)"""
+        symbol, period, timestamps, closes = data
+        i = self.exchanges.index(exchange)
+        dates = chart_time(timestamps)
         
-        try:
-            for i, exchange in enumerate(self.exchanges):
-                # Получение исторических данных
-                data = self.fetch_historical_data(symbol, exchange)
-                
-                if data and len(data) == 7:
-                    # Очистка и перерисовка графика
-                    self.weekly_axes[i].clear()
-                    self.weekly_axes[i].plot(dates, data[-7:], color=GREEN_COLOR, linewidth=1)
-                    
-                    # Настройка осей
-                    self.weekly_axes[i].tick_params(axis='x', colors=TEXT_COLOR, labelsize=7, rotation=45)
-                    self.weekly_axes[i].tick_params(axis='y', colors=TEXT_COLOR, labelsize=8)
-                    self.weekly_axes[i].yaxis.set_major_formatter(plt.FormatStrFormatter('%.2f'))
-                    self.weekly_axes[i].xaxis.set_major_formatter(DateFormatter('%d.%m'))
-                    self.weekly_figures[i].subplots_adjust(bottom=0.25, left=0.15)
-                    
-                    # Настройка заголовков
-                    self.weekly_axes[i].set_title(f'{exchange} - {symbol} (7 дней)', color=TEXT_COLOR, fontsize=9)
-                    self.weekly_axes[i].set_xlabel('Дата', color=TEXT_COLOR, fontsize=8)
-                    self.weekly_axes[i].set_ylabel('Цена (USD)', color=TEXT_COLOR, fontsize=8)
-                    
-                    # Настройка границ
-                    for spine in self.weekly_axes[i].spines.values():
-                        spine.set_color(ACCENT_COLOR)
-                    
-                    # Автомасштабирование
-                    self.weekly_axes[i].relim()
-                    self.weekly_axes[i].autoscale_view()
-                    
-                    # Обновление canvas через очередь UI
-                    self.ui_queue.put((self.weekly_canvases[i].draw, ()))
-                else:
-                    print(f"Недостаточно данных для {exchange} (получено {len(data) if data else 0} точек)")
+        # Очистка и перерисовка графика
+        self.weekly_axes[i].clear()
+        self.weekly_axes[i].plot(dates, closes, color=GREEN_COLOR, linewidth=1)
         
-        except Exception as e:
-            print(f"Ошибка обновления недельных графиков: {e}")
-    
-    def fetch_bid_ask_prices(self, symbol, exchange):
-        """Получение цен покупки и продажи для указанной криптовалюты на бирже"""
-        try:
-            if exchange == "Bybit":
-                url = f"https://api.bybit.com/v5/market/orderbook?category=spot&symbol={symbol}USDT&limit=1"
-                response = self.session.get(url, timeout=3)
-                response.raise_for_status()
-                data = response.json()
-                if data['retCode'] == 0:
-                    return float(data['result']['a'][0][0]), float(data['result']['b'][0][0])
-            
-            elif exchange == "MEXC":
-                url = f"https://api.mexc.com/api/v3/depth?symbol={symbol}USDT&limit=1"
-                response = self.session.get(url, timeout=3)
-                response.raise_for_status()
-                data = response.json()
-                return float(data['asks'][0][0]), float(data['bids'][0][0])
-            
-            elif exchange == "Binance":
-                url = f"https://api.binance.com/api/v3/depth?symbol={symbol}USDT&limit=1"
-                response = self.session.get(url, timeout=3)
-                response.raise_for_status()
-                data = response.json()
-                return float(data['asks'][0][0]), float(data['bids'][0][0])
-        except Exception as e:
-            print(f"Ошибка получения цен покупки/продажи {exchange} для {symbol}: {e}")
-            return None, None
+        # Настройка осей
+        self.weekly_axes[i].tick_params(axis='x', colors=TEXT_COLOR, labelsize=7, rotation=45)
+        self.weekly_axes[i].tick_params(axis='y', colors=TEXT_COLOR, labelsize=8)
+        self.weekly_axes[i].yaxis.set_major_formatter(plt.FormatStrFormatter('%.2f'))
+        self.weekly_axes[i].xaxis.set_major_formatter(DateFormatter('%m.%Y' if period == "Год" else '%d.%m'))
+        self.weekly_figures[i].subplots_adjust(bottom=0.25, left=0.15)
+        
+        # Настройка заголовков
+        self.weekly_axes[i].set_title(f'{exchange} - {symbol} ({period.lower()})', color=TEXT_COLOR, fontsize=9)
+        self.weekly_axes[i].set_xlabel('Дата', color=TEXT_COLOR, fontsize=8)
+        self.weekly_axes[i].set_ylabel('Цена (USD)', color=TEXT_COLOR, fontsize=8)
+        
+        # Настройка границ
+        for spine in self.weekly_axes[i].spines.values():
+            spine.set_color(ACCENT_COLOR)
+        
+        # Автомасштабирование
+        self.weekly_axes[i].relim()
+        self.weekly_axes[i].autoscale_view()
+        
+        # Перерисовка canvas при ближайшем простое Tk
+        self.weekly_canvases[i].draw_idle()
     
-    def calculate_spread(self, ask_price, bid_price):
-        """Расчет спреда между ценой покупки и продажи"""
-        if ask_price is None or bid_price is None:
+    @staticmethod
+    def format_spread(spread, spread_percent):
+        """Текст спреда для таблицы цен"""
+        if spread is None:
             return "Ошибка"
-        spread = ask_price - bid_price
-        spread_percent = (spread / bid_price) * 100 if bid_price != 0 else 0
         return f"{spread:,.4f} ({spread_percent:.2f}%)"
     
-    def update_price_table(self, symbol):
-        """Обновление таблицы с ценами по биржам"""
-        for i, exchange in enumerate(self.exchanges):
-            # Получение цен покупки и продажи
-            ask_price, bid_price = self.fetch_bid_ask_prices(symbol, exchange)
-            
-            if ask_price is not None and bid_price is not None:
-                # Обновление UI через очередь
-                self.ui_queue.put((
-                    lambda b, s, d, i=i: (
-                        self.price_labels[i][0].config(text=f"${b:,.4f}"),
-                        self.price_labels[i][1].config(text=f"${s:,.4f}"),
-                        self.price_labels[i][2].config(text=d)
-                    ),
-                    (bid_price, ask_price, self.calculate_spread(ask_price, bid_price))
-                ))
-            else:
-                self.ui_queue.put((
-                    lambda i=i: (
-                        self.price_labels[i][0].config(text="Ошибка"),
-                        self.price_labels[i][1].config(text="Ошибка"),
-                        self.price_labels[i][2].config(text="Ошибка")
-                    ),
-                    ()
-                ))
+    @staticmethod
+    def format_age(seconds):
+        """Краткий текст возраста данных"""
+        if seconds < 60:
+            return f"{seconds:.0f} с"
+        if seconds < 3600:
+            return f"{seconds / 60:.0f} мин"
+        return f"{seconds / 3600:.0f} ч"
     
-    def fetch_current_price(self, symbol, exchange):
-        """Получение текущей цены криптовалюты на бирже"""
-        try:
-            if exchange == "Bybit":
-                url = f"https://api.bybit.com/v5/market/tickers?category=spot&symbol={symbol}USDT"
-                response = self.session.get(url, timeout=3)
-                response.raise_for_status()
-                data = response.json()
-                if data['retCode'] == 0 and data['result']['list']:
-                    return float(data['result']['list'][0]['lastPrice'])
-            
-            elif exchange == "MEXC":
-                url = f"https://api.mexc.com/api/v3/ticker/24hr?symbol={symbol}USDT"
-                response = self.session.get(url, timeout=3)
-                response.raise_for_status()
-                data = response.json()
-                if 'lastPrice' in data:
-                    return float(data['lastPrice'])
-            
-            elif exchange == "Binance":
-                url = f"https://api.binance.com/api/v3/ticker/24hr?symbol={symbol}USDT"
-                response = self.session.get(url, timeout=3)
-                response.raise_for_status()
-                data = response.json()
-                if 'lastPrice' in data:
-                    return float(data['lastPrice'])
-        except Exception as e:
-            print(f"Ошибка получения данных {exchange} для {symbol}: {e}")
-            return None
+    def update_price_row(self, exchange, quote):
+        """Публикация цен покупки и продажи одной биржи (Quote или None) для таблицы цен"""
+        self.render_scheduler.publish('price_row', exchange, quote)
     
-    def update_top10_prices(self):
-        """Обновление цен для топ-10 криптовалют"""
-        for i, symbol in enumerate(self.top10_symbols):
-            # Получение цен с разных бирж
-            bybit_price = self.fetch_current_price(symbol, "Bybit")
-            mexc_price = self.fetch_current_price(symbol, "MEXC")
-            binance_price = self.fetch_current_price(symbol, "Binance")
-            
-            # Обновление UI через очередь
-            self.ui_queue.put((
-                lambda b, m, bn, i=i: (
-                    self.top10_labels[i][0].config(text=f"${b:,.2f}" if b else "Ошибка"),
-                    self.top10_labels[i][1].config(text=f"${m:,.2f}" if m else "Ошибка"),
-                    self.top10_labels[i][2].config(text=f"${bn:,.2f}" if bn else "Ошибка")
-                ),
-                (bybit_price, mexc_price, binance_price)
-            ))
+    def _render_price_row(self, exchange, quote):
+        """Обновление строки таблицы цен (поток Tk)"""
+        buy_label, sell_label, diff_label = self.price_labels[self.exchanges.index(exchange)]
+        
+        if quote is not None and quote.has_book:
+            # Устаревшие цены остаются на месте, но приглушены и подписаны возрастом
+            age = time.time() - quote.ts if quote.ts is not None else 0
+            stale = age > STALE_AFTER
+            suffix = f" ({self.format_age(age)})" if stale else ""
+            buy_label.config(text=f"${quote.bid:,.4f}{suffix}", fg=STALE_COLOR if stale else GREEN_COLOR)
+            sell_label.config(text=f"${quote.ask:,.4f}{suffix}", fg=STALE_COLOR if stale else RED_COLOR)
+            diff_label.config(
+                text=self.format_spread(quote.spread, quote.spread_percent),
+                fg=STALE_COLOR if stale else TEXT_COLOR
+            )
+        else:
+            buy_label.config(text="Ошибка", fg=GREEN_COLOR)
+            sell_label.config(text="Ошибка", fg=RED_COLOR)
+            diff_label.config(text="Ошибка", fg=TEXT_COLOR)
     
-    def update_best_prices(self):
-        """Обновление лучших цен покупки и продажи"""
-        symbol = self.crypto_var.get()
-        prices = {}
+    def update_market_prices(self, snapshot, symbol):
+        """
+        Публикация таблицы топ-10 и лучших цен выбранной монеты по снимку
         
-        # Сбор цен со всех бирж
-        for exchange in self.exchanges:
-            price = self.fetch_current_price(symbol, exchange)
-            if price is not None:
-                prices[exchange] = price
+        Цены всех монет и бирж раскладываются в одну матрицу, лучшие биржи
+        считаются по ней сразу для всех строк; в UI уходят только числа.
+        """
+        symbols = list(dict.fromkeys(self.top10_symbols + [symbol]))
+        matrix = QuoteMatrix.from_snapshot(snapshot, self.exchanges, symbols)
+        
+        top10 = matrix.lasts[:len(self.top10_symbols)]
+        for col, exchange in enumerate(self.exchanges):
+            stale = snapshot.age(exchange) > STALE_AFTER
+            self.render_scheduler.publish('top10', exchange, (top10[:, col].copy(), stale))
         
+        metrics = matrix.metrics()
+        row = matrix.row(symbol)
+        best = None
+        if metrics.low_last_venue[row] >= 0:
+            best = (
+                metrics.venue(metrics.low_last_venue[row]), float(metrics.low_last[row]),
+                metrics.venue(metrics.high_last_venue[row]), float(metrics.high_last[row])
+            )
+        self.render_scheduler.publish('best', None, best)
+    
+    def _render_top10_column(self, exchange, data):
+        """Обновление столбца таблицы топ-10 (поток Tk); устаревший столбец приглушается"""
+        column, stale = data
+        col = self.exchanges.index(exchange)
+        color = STALE_COLOR if stale else TEXT_COLOR
+        for row, price in enumerate(column):
+            # NaN - цены нет
+            self.top10_labels[row][col].config(text=f"${price:,.2f}" if price > 0 else "Ошибка", fg=color)
+    
+    def _render_best_prices(self, key, best):
+        """Обновление карточки лучших цен покупки и продажи (поток Tk)"""
         # Проверка наличия данных
-        if not prices:
-            self.ui_queue.put((
-                lambda: (
-                    self.best_buy_label.config(text="Невозможно определить цены: ошибка данных"),
-                    self.best_sell_label.config(text="")
-                ),
-                ()
-            ))
+        if best is None:
+            self.best_buy_label.config(text="Невозможно определить цены: ошибка данных")
+            self.best_sell_label.config(text="")
             return
         
-        # Определение лучших цен
-        best_buy_exchange = min(prices, key=prices.get)
-        best_buy_price = prices[best_buy_exchange]
-        
-        best_sell_exchange = max(prices, key=prices.get)
-        best_sell_price = prices[best_sell_exchange]
+        best_buy_exchange, best_buy_price, best_sell_exchange, best_sell_price = best
+        self.best_buy_label.config(text=f"{best_buy_exchange}: ${best_buy_price:,.4f}")
+        self.best_sell_label.config(text=f"{best_sell_exchange}: ${best_sell_price:,.4f}")
+    
+    def on_trade_size_change(self):
+        """Обработчик изменения объема сделки: пересчет VWAP по уже загруженным стаканам"""
+        try:
+            notional = float(self.trade_size_var.get().replace(',', '.').replace(' ', ''))
+        except ValueError:
+            return
+        if notional > 0:
+            self.trade_notional = notional
+            self.update_vwap(self.crypto_var.get())
+    
+    def update_vwap(self, symbol):
+        """Расчет и публикация средневзвешенных цен сделки объемом trade_notional"""
+        notional = self.trade_notional
+        self.render_scheduler.publish('vwap', None, (notional, self.core.vwap(symbol, notional)))
+    
+    def _render_vwap(self, key, data):
+        """Обновление строки VWAP в карточке лучших цен (поток Tk)"""
+        notional, result = data
+        best_buy, best_sell = result['best_buy'], result['best_sell']
+        if best_buy is None and best_sell is None:
+            text = "нет данных стакана" if not result['buy'] and not result['sell'] else "недостаточно глубины стакана"
+            self.best_vwap_label.config(text=text)
+            return
         
-        # Обновление UI
-        self.ui_queue.put((
-            lambda: (
-                self.best_buy_label.config(text=f"{best_buy_exchange}: ${best_buy_price:,.4f}"),
-                self.best_sell_label.config(text=f"{best_sell_exchange}: ${best_sell_price:,.4f}")
-            ),
-            ()
+        parts = []
+        if best_buy is not None:
+            parts.append(f"покупка {best_buy[0]} ${best_buy[1]:,.4f}")
+        if best_sell is not None:
+            parts.append(f"продажа {best_sell[0]} ${best_sell[1]:,.4f}")
+        self.best_vwap_label.config(text=" / ".join(parts))
+    
+    def update_arbitrage(self, opportunities):
+        """Публикация результатов поиска арбитража"""
+        self.render_scheduler.publish('arbitrage', None, (
+            opportunities,
+            self.core.arbitrage_scanner.last_pairs,
+            self.core.arbitrage_scanner.last_scan_ms
         ))
     
+    def _render_arbitrage(self, key, data):
+        """Обновление таблицы арбитража (поток Tk)"""
+        opportunities, pairs, scan_ms = data
+        for row, labels in enumerate(self.arbitrage_labels):
+            if row < len(opportunities):
+                item = opportunities[row]
+                texts = (
+                    item['symbol'],
+                    item['buy_exchange'],
+                    f"${item['ask']:,.6g}",
+                    item['sell_exchange'],
+                    f"${item['bid']:,.6g}",
+                    f"{item['percent']:.2f}%"
+                )
+            else:
+                texts = ("",) * len(labels)
+            for label, text in zip(labels, texts):
+                label.config(text=text)
+        
+        self.arbitrage_status.config(text=f"Проверено пар: {pairs}, расчет: {scan_ms:.1f} мс")
+    
+    def update_diagnostics(self):
+        """Периодическая публикация сводки метрик для панели диагностики (поток Tk)"""
+        if not self.running:
+            return
+        self.render_scheduler.publish('diagnostics', None, METRICS.summary())
+        self.root.after(DIAGNOSTICS_INTERVAL * 1000, self.update_diagnostics)
+    
+    @staticmethod
+    def format_diagnostics(summary):
+        """Текст панели диагностики: длительности в мс (число, среднее, p50, p95, максимум) и счетчики"""
+        lines = []
+        if summary['histograms']:
+            lines.append(f"{'метрика':<60} {'число':>7} {'сред':>8} {'p50':>8} {'p95':>8} {'макс':>8}")
+        for name, labels, count, mean, p50, p95, peak in summary['histograms']:
+            title = " ".join([name] + [str(label) for label in labels.values()])
+            lines.append(
+                f"{title[:60]:<60} {count:>7} {mean * 1000:>8.1f} {p50 * 1000:>8.1f} "
+                f"{p95 * 1000:>8.1f} {peak * 1000:>8.1f}"
+            )
+        for name, labels, value in summary['gauges'] + summary['counters']:
+            title = " ".join([name] + [str(label) for label in labels.values()])
+            lines.append(f"{title[:60]:<60} {value:>7g}")
+        return "\n".join(lines) if lines else "нет данных"
+    
+    def _render_diagnostics(self, key, summary):
+        """Обновление панели диагностики (поток Tk)"""
+        self.diagnostics_label.config(text=self.format_diagnostics(summary))
+    
+    def _on_cycle_result(self, key, result, symbol):
+        """Доставка результата одного запроса в UI сразу после его получения"""
+        kind, item_symbol, exchange = key
+        
+        # Пока шел цикл, пользователь мог выбрать другую монету
+        if symbol != self.crypto_var.get():
+            return
+        
+        if kind == 'quote':
+            # Биржа без ответа показывает последние известные цены с их возрастом
+            self.update_price_row(exchange, result if result is not None else self.core.quote(exchange, symbol))
+        
+        elif kind == 'snapshot':
+            # Снимок не загрузился: таблица строится по последнему снимку ядра
+            snapshot = result if result is not None else self.core.snapshot
+            if snapshot is not None:
+                self.update_market_prices(snapshot, symbol)
+    
     def update_data(self):
         """Основной метод обновления всех данных"""
         try:
             symbol = self.crypto_var.get()
-            self.update_best_prices()
-            self.update_price_table(symbol)
-            self.update_week_charts()
-            self.update_top10_prices()
+            
+            # История берется из локального хранилища, поэтому строится сразу, без ожидания сети
+            if self.history_shown != (symbol, self.history_period):
+                self.update_history_charts(symbol)
+            
+            # Все запросы цикла выполняются параллельно, результаты уходят в UI по мере готовности
+            results = self.core.run_cycle(
+                symbol,
+                on_result=lambda key, result: self._on_cycle_result(key, result, symbol)
+            )
+            
+            # Не успевшие к сроку биржи показываются сразу по последним данным;
+            # их ответ, пришедший позже, обновит строку через тот же обработчик
+            for exchange in self.exchanges:
+                if ('quote', symbol, exchange) not in results:
+                    self._on_cycle_result(('quote', symbol, exchange), None, symbol)
+            self.update_arbitrage(self.core.opportunities)
+            self.update_vwap(symbol)
         except Exception as e:
+            METRICS.inc('update_errors_total', stage="update")
             print(f"Ошибка при обновлении данных: {e}")
             raise
         finally:
             if hasattr(self, 'loading_animation'):
-                self.ui_queue.put((self.hide_loading, ()))
+                self.post_ui(self.hide_loading)
+    
+    def pause(self, seconds):
+        """
+        Пауза фонового потока (короче в speed раз при воспроизведении сессии)
+        
+        Returns:
+            False, если приложение закрывается
+        """
+        deadline = time.monotonic() + self.core.scaled(seconds)
+        while self.running:
+            left = deadline - time.monotonic()
+            if left <= 0:
+                return True
+            time.sleep(min(1, left))
+        return False
     
     def auto_update(self):
         """Автоматическое обновление данных в отдельном потоке"""
@@ -1173,10 +5738,8 @@ class CryptoAggregatorApp:
                 print(f"Ошибка при автоматическом обновлении: {e}")
             
             # Пауза между обновлениями
-            for _ in range(self.update_interval):
-                if not self.running:
-                    return
-                time.sleep(1)
+            if not self.pause(self.update_interval):
+                return
     
     def on_close(self):
         """Обработчик закрытия приложения"""
@@ -1185,13 +5748,424 @@ class CryptoAggregatorApp:
             self.update_thread.join(timeout=1)
         if self.realtime_thread.is_alive():
             self.realtime_thread.join(timeout=1)
-        self.session.close()
+        if self.recorder is not None:
+            self.recorder.close(timeout=2)
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
+        self.core.close()
         self.root.destroy()
 
+# ==============================================
+# ФОНОВЫЙ РЕЖИМ БЕЗ ОКНА
+# ==============================================
+class DaemonRequestHandler(MetricsRequestHandler):
+    """Обработчик запросов к локальному API: только GET, ответы в JSON (кроме /metrics)"""
+    
+    def do_GET(self):
+        """Ответ на GET с поддержкой условных запросов по ETag"""
+        parts = urlsplit(self.path)
+        if parts.path.rstrip('/') == '/metrics':
+            self.send_metrics()
+            return
+        status, body, etag = self.server.headless.respond(parts.path, parts.query)
+        
+        # Клиент уже получил эту версию ответа: отправляется только заголовок
+        if etag is not None and self._etag_matches(etag):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', 'no-cache')
+            self.end_headers()
+            return
+        
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'no-cache')
+        if etag is not None:
+            self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def _etag_matches(self, etag):
+        """Проверка заголовка If-None-Match (список тегов, слабые теги, '*')"""
+        header = self.headers.get('If-None-Match')
+        if not header:
+            return False
+        tags = [tag.strip() for tag in header.split(',')]
+        return '*' in tags or any(tag.replace('W/', '', 1) == etag for tag in tags)
+    
+
+
+class HeadlessDaemon:
+    """
+    Работа без окна: фоновое обновление данных и локальный HTTP/JSON API
+    
+    Потоки обновления заполняют MarketDataCore так же, как в окне приложения,
+    а HTTP-сервер только читает последние результаты и не ходит на биржи
+    (кроме истории свечей, которая берется через кэш). Ответы кэшируются до
+    следующего изменения данных, клиенты могут опрашивать API с If-None-Match
+    и получать 304 без тела, пока данные не изменились.
+    """
+    
+    def __init__(self, core, host=DAEMON_HOST, port=DAEMON_PORT, update_interval=DAEMON_UPDATE_INTERVAL,
+                 recorder=None):
+        """
+        Инициализация фонового режима
+        
+        Args:
+            core: MarketDataCore
+            host: Адрес HTTP-сервера
+            port: Порт HTTP-сервера (0 - выбрать свободный)
+            update_interval: Интервал загрузки лучших цен и арбитража (сек)
+            recorder: ExportPipeline для непрерывной записи снимков или None
+        """
+        self.core = core
+        self.update_interval = update_interval
+        self.recorder = recorder
+        self.stop_event = threading.Event()
+        self.threads = []
+        
+        # Ответы, зависящие только от данных ядра: {(путь, запрос): (версия, тело, ETag)}
+        self.responses = {}
+        self.responses_lock = threading.Lock()
+        
+        self.routes = {
+            '/api/status': (self.api_status, True),
+            '/api/snapshot': (self.api_snapshot, True),
+            '/api/best': (self.api_best, True),
+            '/api/spreads': (self.api_spreads, True),
+            '/api/arbitrage': (self.api_arbitrage, True),
+            '/api/vwap': (self.api_vwap, False),
+            '/api/history': (self.api_history, False),
+            '/api/ticks': (self.api_ticks, False),
+        }
+        
+        self.server = ThreadingHTTPServer((host, port), DaemonRequestHandler)
+        self.server.daemon_threads = True
+        self.server.headless = self
+        self.host, self.port = self.server.server_address[:2]
+    
+    @property
+    def url(self):
+        """Адрес API"""
+        return f"http://{self.host}:{self.port}/api/"
+    
+    def start(self):
+        """Запуск ядра, потоков обновления и HTTP-сервера"""
+        self.core.start()
+        for target in (self._update_loop, self._realtime_loop, self.server.serve_forever):
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        return self
+    
+    def stop(self):
+        """Остановка сервера, потоков и ядра"""
+        self.stop_event.set()
+        self.server.shutdown()
+        self.server.server_close()
+        for thread in self.threads:
+            thread.join(timeout=1)
+        if self.recorder is not None:
+            self.recorder.close(timeout=2)
+        self.core.close()
+    
+    def run(self):
+        """Работа до Ctrl+C"""
+        self.start()
+        print(f"API доступно по адресу {self.url}, метрики - http://{self.host}:{self.port}/metrics")
+        try:
+            while not self.stop_event.wait(1):
+                pass
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+    
+    def _update_loop(self):
+        """Периодическая загрузка лучших цен всех пар и поиск арбитража"""
+        while not self.stop_event.is_set():
+            try:
+                self.core.run_cycle()
+            except Exception as e:
+                print(f"Ошибка при автоматическом обновлении: {e}")
+            self.stop_event.wait(self.core.scaled(self.update_interval))
+    
+    def _realtime_loop(self):
+        """Обновление снимка котировок и запись тиков в хранилище"""
+        last_snapshot = None
+        while not self.stop_event.is_set():
+            try:
+                snapshot = self.core.get_snapshot(max_age=self.core.scaled(self.core.realtime_interval))
+                if snapshot is not last_snapshot and self.recorder is not None:
+                    self.recorder.submit(snapshot_rows(snapshot, self.core.symbols, fresh_only=True))
+                if snapshot is not last_snapshot and self.core.tick_store is not None:
+                    for exchange in self.core.exchanges:
+                        # Перенесенные из прошлых снимков цены уже записаны
+                        if not snapshot.is_fresh(exchange):
+                            continue
+                        for symbol in self.core.symbols:
+                            price = snapshot.get(exchange, symbol)
+                            if price is not None:
+                                self.core.tick_store.append(exchange, symbol, snapshot.timestamp, price)
+                last_snapshot = snapshot
+            except Exception as e:
+                METRICS.inc('update_errors_total', stage="snapshot")
+                print(f"Ошибка обновления котировок: {e}")
+            self.stop_event.wait(self.core.scaled(self.core.realtime_interval))
+    
+    def respond(self, path, query):
+        """
+        Формирование ответа API
+        
+        Returns:
+            (HTTP-статус, тело в байтах, ETag или None)
+        """
+        route = self.routes.get(path.rstrip('/'))
+        if route is None:
+            return self._error(404, f"Неизвестный адрес: {path}")
+        handler, versioned = route
+        
+        # Пока данные ядра не изменились, ответ отдается из кэша без сериализации
+        key = (path, query)
+        version = self.core.version
+        if versioned:
+            with self.responses_lock:
+                cached = self.responses.get(key)
+            if cached is not None and cached[0] == version:
+                return 200, cached[1], cached[2]
+        
+        params = {name: values[-1] for name, values in parse_qs(query).items()}
+        try:
+            payload = handler(params)
+        except (KeyError, ValueError) as e:
+            return self._error(400, str(e))
+        except Exception as e:
+            print(f"Ошибка обработки запроса {path}: {e}")
+            return self._error(500, "Внутренняя ошибка")
+        
+        body = json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        etag = '"' + hashlib.sha1(body).hexdigest()[:20] + '"'
+        if versioned:
+            with self.responses_lock:
+                if len(self.responses) > 256:
+                    self.responses.clear()
+                self.responses[key] = (version, body, etag)
+        return 200, body, etag
+    
+    @staticmethod
+    def _error(status, message):
+        """Ответ с ошибкой (без ETag)"""
+        return status, json.dumps({"error": message}, ensure_ascii=False).encode('utf-8'), None
+    
+    def _symbol(self, params):
+        """Монета из параметра symbol: от 2 до 20 латинских букв и цифр (имя становится частью пути в хранилищах)"""
+        symbol = params.get('symbol', '').upper()
+        if not symbol:
+            raise ValueError("Не указан параметр symbol")
+        if not (symbol.isascii() and symbol.isalnum() and 2 <= len(symbol) <= 20):
+            raise ValueError(f"Недопустимый символ: {symbol[:40]}")
+        return symbol
+    
+    def _watched_symbol(self, params):
+        """Монета из параметра symbol, только из отслеживаемых (для ответов, которые требуют запросов к биржам)"""
+        symbol = self._symbol(params)
+        if symbol not in self.core.symbols:
+            raise ValueError(f"Монета не отслеживается: {symbol}")
+        return symbol
+    
+    def _exchange(self, params):
+        """Биржа из параметра exchange"""
+        exchange = params.get('exchange', '')
+        if exchange not in self.core.exchanges:
+            raise ValueError(f"Неизвестная биржа: {exchange}")
+        return exchange
+    
+    def _snapshot(self):
+        """Последний снимок котировок без загрузки нового"""
+        return self.core.snapshot
+    
+    def api_status(self, params):
+        """Состояние: биржи, монеты, живость потоков, возраст снимка"""
+        stream = self.core.market_stream
+        snapshot = self._snapshot()
+        return {
+            "version": self.core.version,
+            "exchanges": self.core.exchanges,
+            "symbols": self.core.symbols,
+            "streaming": {
+                exchange: stream is not None and stream.is_live(exchange)
+                for exchange in self.core.exchanges
+            },
+            "snapshot_age": snapshot.age() if snapshot is not None else None,
+            "exchange_age": {
+                exchange: snapshot.age(exchange) if snapshot is not None else None
+                for exchange in self.core.exchanges
+            },
+            "rate_limits": self.core.rate_governor.status(),
+            "http": self.core.transport.status(),
+            "session": self.core.session_status(),
+        }
+    
+    def api_snapshot(self, params):
+        """Цены по биржам и время их получения; параметр symbols=BTC,ETH ограничивает список монет"""
+        snapshot = self._snapshot()
+        if snapshot is None:
+            return {"timestamp": None, "prices": {}, "times": {}}
+        symbols = [s.upper() for s in params.get('symbols', '').split(',') if s]
+        prices = {}
+        for exchange in self.core.exchanges:
+            exchange_prices = snapshot.exchange_prices(exchange)
+            if symbols:
+                prices[exchange] = {s: exchange_prices[s] for s in symbols if s in exchange_prices}
+            else:
+                prices[exchange] = dict(exchange_prices)
+        times = {exchange: snapshot.exchange_time(exchange) for exchange in self.core.exchanges}
+        return {"timestamp": snapshot.timestamp, "prices": prices, "times": times}
+    
+    def api_best(self, params):
+        """Лучшие биржи для покупки и продажи монеты по последним ценам"""
+        symbol = self._symbol(params)
+        snapshot = self._snapshot()
+        metrics = QuoteMatrix.from_snapshot(snapshot, self.core.exchanges, [symbol]).metrics()
+        if metrics.low_last_venue[0] < 0:
+            return {"symbol": symbol, "buy": None, "sell": None}
+        return {
+            "symbol": symbol,
+            "timestamp": snapshot.timestamp,
+            "buy": {"exchange": metrics.venue(metrics.low_last_venue[0]), "price": float(metrics.low_last[0])},
+            "sell": {"exchange": metrics.venue(metrics.high_last_venue[0]), "price": float(metrics.high_last[0])},
+        }
+    
+    def api_spreads(self, params):
+        """Цены покупки, продажи и спред монеты на каждой бирже"""
+        symbol = self._symbol(params)
+        spreads = {}
+        for exchange in self.core.exchanges:
+            quote = self.core.quote(exchange, symbol)
+            if quote is None or not quote.has_book:
+                spreads[exchange] = None
+                continue
+            spreads[exchange] = {
+                "ask": quote.ask,
+                "bid": quote.bid,
+                "spread": quote.spread,
+                "percent": quote.spread_percent,
+                "ts": quote.ts,
+            }
+        return {"symbol": symbol, "spreads": spreads}
+    
+    def api_arbitrage(self, params):
+        """Лучшие арбитражные возможности последнего сканирования"""
+        scanner = self.core.arbitrage_scanner
+        return {
+            "pairs": scanner.last_pairs,
+            "scan_ms": scanner.last_scan_ms,
+            "opportunities": self.core.opportunities,
+        }
+    
+    def api_vwap(self, params):
+        """Средневзвешенные цены сделки объемом notional (USDT) по стаканам всех бирж"""
+        symbol = self._watched_symbol(params)
+        notional = float(params.get('notional', TRADE_NOTIONAL))
+        if not notional > 0:
+            raise ValueError("notional должен быть больше 0")
+        # Стаканы бирж без потока загружаются по запросу, не чаще раза в realtime_interval
+        self.core.refresh_books(symbol, max_age=self.core.realtime_interval)
+        result = self.core.vwap(symbol, notional)
+        venues = {}
+        for exchange in self.core.exchanges:
+            buy, sell = result['buy'].get(exchange), result['sell'].get(exchange)
+            venues[exchange] = None if buy is None and sell is None else {
+                "buy": buy[0] if buy else None,
+                "buy_filled": buy[1] if buy else 0.0,
+                "sell": sell[0] if sell else None,
+                "sell_filled": sell[1] if sell else 0.0,
+                "age": result['age'].get(exchange),
+            }
+        best_buy, best_sell = result['best_buy'], result['best_sell']
+        return {
+            "symbol": symbol,
+            "notional": notional,
+            "venues": venues,
+            "buy": {"exchange": best_buy[0], "price": best_buy[1]} if best_buy else None,
+            "sell": {"exchange": best_sell[0], "price": best_sell[1]} if best_sell else None,
+        }
+    
+    def api_history(self, params):
+        """Свечи монеты на бирже [время мс, open, high, low, close, volume]: interval=1m|1h|1d, limit до 1000"""
+        # Недостающие свечи загружаются с биржи, поэтому только для отслеживаемых монет
+        symbol = self._watched_symbol(params)
+        exchange = self._exchange(params)
+        interval = params.get('interval', '1d')
+        if interval not in KLINE_INTERVAL_SECONDS:
+            raise ValueError(f"Неизвестный интервал: {interval}")
+        limit = int(params.get('limit', 7))
+        if not 1 <= limit <= 1000:
+            raise ValueError("limit должен быть от 1 до 1000")
+        # Локальная история отвечает без запроса к бирже, если в ней уже есть limit свечей
+        candles = None
+        if self.core.candle_store is not None:
+            batch = self.core.candle_store.window(exchange, symbol, interval, last=limit)
+            if len(batch) >= limit:
+                candles = batch.candles()
+        if candles is None:
+            candles = self.core.kline_cache.get(exchange, symbol, interval, limit)
+        return {
+            "symbol": symbol,
+            "exchange": exchange,
+            "interval": interval,
+            "candles": [candle.to_list() for candle in candles or []],
+        }
+    
+    def api_ticks(self, params):
+        """Последние тики из хранилища: last=число точек, since=время в мс"""
+        symbol = self._symbol(params)
+        exchange = self._exchange(params)
+        if self.core.tick_store is None:
+            return {"symbol": symbol, "exchange": exchange, "time": [], "price": []}
+        last = int(params.get('last', 1000))
+        since = int(params['since']) / 1000 if 'since' in params else None
+        times_ms, prices = self.core.tick_store.window(exchange, symbol, last=last, since=since)
+        return {
+            "symbol": symbol,
+            "exchange": exchange,
+            "time": times_ms.tolist(),
+            "price": prices.tolist(),
+        }
+
 # ==============================================
 # ТОЧКА ВХОДА
 # ==============================================
 if __name__ == "__main__":
-    login_root = tk.Tk()
-    login_app = LoginWindow(login_root)
-    login_root.mainloop()
+    parser = argparse.ArgumentParser(description="Агрегатор криптовалюты")
+    parser.add_argument("--headless", action="store_true", help="работа без окна с локальным HTTP/JSON API")
+    parser.add_argument("--host", default=DAEMON_HOST, help="адрес API в режиме --headless")
+    parser.add_argument("--port", type=int, default=DAEMON_PORT, help="порт API в режиме --headless")
+    parser.add_argument("--record", metavar="DIR", help="непрерывная запись снимков в папку в режиме --headless")
+    parser.add_argument("--format", default=EXPORT_FORMAT, choices=("csv", "jsonl", "parquet"),
+                        help="формат файлов записи")
+    parser.add_argument("--compression", default=EXPORT_COMPRESSION, help="сжатие файлов записи")
+    session = parser.add_mutually_exclusive_group()
+    session.add_argument("--record-session", metavar="FILE", help="записать ответы бирж в файл сессии")
+    session.add_argument("--replay", metavar="FILE", help="воспроизвести файл сессии вместо запросов к биржам")
+    parser.add_argument("--speed", default="1", help="скорость воспроизведения: 1, 10... или max")
+    parser.add_argument("--metrics-port", type=int, metavar="PORT",
+                        help="порт /metrics для Prometheus в оконном режиме (по умолчанию не запускается)")
+    args = parser.parse_args()
+    
+    SESSION_RECORD_FILE = args.record_session
+    SESSION_REPLAY_FILE = args.replay
+    REPLAY_SPEED = None if args.speed == "max" else float(args.speed)
+    METRICS_PORT = args.metrics_port
+    
+    if args.headless:
+        core = MarketDataCore(ENABLED_EXCHANGES, TOP_SYMBOLS)
+        recorder = None
+        if args.record:
+            recorder = ExportPipeline(args.record, "crypto_record", args.format, args.compression).start()
+        HeadlessDaemon(core, host=args.host, port=args.port, recorder=recorder).run()
+    else:
+        login_root = tk.Tk()
+        login_app = LoginWindow(login_root)
+        login_root.mainloop()
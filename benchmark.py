@@ -0,0 +1,343 @@
+"""Бенчмарки цикла обновления и отрисовки без доступа к сети (на заглушках из mock_exchange)"""
+import sys
+import time
+import json
+import argparse
+import subprocess
+import urllib.request
+import platform
+import tracemalloc
+from pathlib import Path
+from types import SimpleNamespace
+
+import numpy as np
+
+import app
+from app import (
+    CryptoAggregatorApp, MarketDataCore, RenderScheduler, RealtimeChart, RealtimeSeries,
+    ENABLED_EXCHANGES, TOP_SYMBOLS, REALTIME_HISTORY, TRADE_NOTIONAL, HISTORY_PERIODS, chart_time
+)
+from mock_exchange import HTTP_LATENCY, HTTP_JITTER
+
+# ==============================================
+# КОНСТАНТЫ
+# ==============================================
+BASELINE_FILE = Path(__file__).with_name("benchmark_baseline.json")
+TOLERANCE = 0.25          # Допустимое ухудшение относительно базовых результатов (доля)
+MIN_REGRESSION = {        # Изменения меньше этих абсолютных величин не считаются регрессией
+    "_ms": 2.0,
+    "_kb": 256.0,
+    "requests_per_cycle": 0.5,
+    "requests_per_snapshot": 0.5,
+    "growth_kb_per_cycle": 1.0,
+}
+# Хвосты распределения на десятках замеров слишком шумные для сравнения: только выводятся.
+# Общий рост памяти зависит от --long-cycles, сравнивается рост на цикл
+INFORMATIONAL = {"p95_ms", "max_ms", "peak_kb", "growth_kb", "cycles"}
+# Параметры окружения, задающие нагрузку: с другими значениями сравнение с базой не имеет смысла
+WORKLOAD_KEYS = ("latency", "jitter", "fixtures", "json_backend", "orjson", "msgspec")
+
+# ==============================================
+# ОКРУЖЕНИЕ
+# ==============================================
+class MockProcess:
+    """
+    Заглушка REST API (mock_exchange.py --serve) в отдельном процессе
+
+    Генерация ответов не делит с приложением ни процессор, ни GIL, поэтому
+    замеры процессорного времени относятся только к коду приложения.
+    """
+
+    def __init__(self, fixtures=None, latency=HTTP_LATENCY, jitter=HTTP_JITTER):
+        """Запуск процесса и чтение адресов бирж из его вывода"""
+        command = [sys.executable, str(Path(__file__).with_name("mock_exchange.py")), "--serve",
+                   "--latency", str(latency), "--jitter", str(jitter)]
+        if fixtures:
+            command += ["--fixtures", fixtures]
+        self.process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True, encoding="utf-8")
+        self.urls = {}
+        while len(self.urls) < len(ENABLED_EXCHANGES):
+            line = self.process.stdout.readline()
+            if not line:
+                raise RuntimeError("Заглушка бирж не запустилась")
+            name, _, url = line.strip().partition(": ")
+            self.urls[name] = url
+        self.stats_url = self.urls[ENABLED_EXCHANGES[0]].rsplit("/", 1)[0] + "/_stats"
+
+    def base_url(self, exchange):
+        """Адрес API биржи на заглушке"""
+        return self.urls[exchange]
+
+    def request_count(self):
+        """Общее число запросов, обработанных заглушкой"""
+        with urllib.request.urlopen(self.stats_url) as response:
+            return json.load(response)["requests"]
+
+    def stop(self):
+        """Остановка процесса"""
+        self.process.terminate()
+        self.process.wait(timeout=5)
+
+
+def configure(server, rate_limits=False):
+    """
+    Настройка приложения на работу с заглушкой: без потоков WebSocket и записи на диск
+
+    Args:
+        server: MockProcess
+        rate_limits: Соблюдать лимиты бирж (иначе длинные прогоны упираются в лимиты MEXC)
+    """
+    app.USE_STREAMING = False
+    app.USE_TICK_STORE = False
+    app.USE_CANDLE_STORE = False
+    app.METRICS.enabled = True
+    app.EXCHANGE_SETTINGS = {name: {"base_url": server.base_url(name)} for name in ENABLED_EXCHANGES}
+
+    core = MarketDataCore(ENABLED_EXCHANGES, TOP_SYMBOLS)
+    if not rate_limits:
+        for adapter in core.adapters.values():
+            adapter.governor = None
+    return core
+
+
+def build_app(core, symbol):
+    """
+    Окно приложения без Tk: настоящие методы обновления и планировщик отрисовки,
+    функции отрисовки пустые (отрисовка графиков замеряется отдельно)
+    """
+    window = CryptoAggregatorApp.__new__(CryptoAggregatorApp)
+    window.core = core
+    window.exchanges = list(core.exchanges)
+    window.top10_symbols = list(core.symbols)
+    window.crypto_var = SimpleNamespace(get=lambda: symbol)
+    # Снимок загружается при каждом вызове, а не раз в realtime_interval
+    window.realtime_interval = 0
+    window.trade_notional = TRADE_NOTIONAL
+    window.recorder = None
+    window.last_realtime_snapshot = None
+    window.history_period = next(iter(HISTORY_PERIODS))
+    window.history_shown = (symbol, window.history_period)
+    window.warm_realtime = {
+        item: {exchange: RealtimeSeries(REALTIME_HISTORY) for exchange in window.exchanges}
+        for item in window.top10_symbols
+    }
+    window.realtime_data = window.realtime_series(symbol)
+
+    window.render_scheduler = RenderScheduler()
+    for kind in ('realtime', 'weekly', 'price_row', 'top10', 'best', 'vwap', 'arbitrage', 'diagnostics'):
+        window.render_scheduler.register(kind, lambda key, data: None)
+    return window
+
+
+def percentiles(samples):
+    """Медиана, 95-й перцентиль и максимум в миллисекундах"""
+    values = np.asarray(samples) * 1000
+    return {
+        "p50_ms": round(float(np.percentile(values, 50)), 3),
+        "p95_ms": round(float(np.percentile(values, 95)), 3),
+        "max_ms": round(float(values.max()), 3),
+    }
+
+# ==============================================
+# БЕНЧМАРКИ
+# ==============================================
+def bench_update_data(window, server, cycles):
+    """Полный цикл update_data: стаканы, лучшие цены всех пар, снимок, арбитраж, VWAP"""
+    window.update_data()  # Прогрев: соединения пула, схемы разбора
+    durations, requests_made, cpu = [], [], []
+    for _ in range(cycles):
+        before = server.request_count()
+        start, start_cpu = time.perf_counter(), time.process_time()
+        window.update_data()
+        durations.append(time.perf_counter() - start)
+        cpu.append(time.process_time() - start_cpu)
+        requests_made.append(server.request_count() - before)
+        window.render_scheduler.render_frame()
+    return {
+        **percentiles(durations),
+        "cpu_ms": round(float(np.mean(cpu)) * 1000, 3),
+        "requests_per_cycle": round(float(np.mean(requests_made)), 2),
+    }
+
+
+def bench_realtime(window, server, cycles):
+    """update_realtime_charts: снимок котировок всех бирж и пополнение рядов всех монет"""
+    window.update_realtime_charts()
+    durations, requests_made, cpu = [], [], []
+    for _ in range(cycles):
+        before = server.request_count()
+        start, start_cpu = time.perf_counter(), time.process_time()
+        window.update_realtime_charts()
+        durations.append(time.perf_counter() - start)
+        cpu.append(time.process_time() - start_cpu)
+        requests_made.append(server.request_count() - before)
+        window.render_scheduler.render_frame()
+    return {
+        **percentiles(durations),
+        "cpu_ms": round(float(np.mean(cpu)) * 1000, 3),
+        "requests_per_snapshot": round(float(np.mean(requests_made)), 2),
+    }
+
+
+def bench_redraw(redraws, points=REALTIME_HISTORY):
+    """
+    Процессорное время перерисовки графика реального времени (в памяти, без окна)
+
+    full - перерисовка с осями (смена пределов), blit - только линия поверх фона.
+    """
+    chart = RealtimeChart(None, "Bench")
+    chart.set_symbol("BTC")
+    now = time.time()
+    times = chart_time(now + np.arange(points, dtype=float))
+    prices = 65000 + np.cumsum(np.random.default_rng(0).normal(0, 5, points))
+    chart.set_data(times, prices)
+    chart.draw()
+
+    full, blit = [], []
+    for i in range(redraws):
+        # Каждая четвертая точка выходит за пределы осей и требует полной перерисовки
+        shift = prices * (1.5 if i % 4 == 0 else 1.0)
+        start = time.process_time()
+        chart.set_data(times, shift if i % 4 == 0 else prices)
+        needs_full = chart.needs_full_draw
+        chart.draw()
+        (full if needs_full else blit).append(time.process_time() - start)
+    return {
+        "full_cpu_ms": round(float(np.mean(full)) * 1000, 3) if full else None,
+        "blit_cpu_ms": round(float(np.mean(blit)) * 1000, 3) if blit else None,
+    }
+
+
+def bench_memory(window, cycles):
+    """
+    Рост памяти за долгий прогон: снимок котировок каждый шаг, полный цикл каждый десятый
+
+    Замер через tracemalloc после прогрева, поэтому учитываются только объекты Python
+    и массивы numpy, созданные за время прогона и не освобожденные.
+    """
+    for _ in range(10):
+        window.update_realtime_charts()
+    window.update_data()
+    tracemalloc.start()
+    start, _ = tracemalloc.get_traced_memory()
+    for i in range(cycles):
+        window.update_realtime_charts()
+        if i % 10 == 0:
+            window.update_data()
+        window.render_scheduler.render_frame()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "cycles": cycles,
+        "growth_kb": round((current - start) / 1024, 1),
+        "growth_kb_per_cycle": round((current - start) / 1024 / max(cycles, 1), 3),
+        "peak_kb": round((peak - start) / 1024, 1),
+    }
+
+
+def run(args):
+    """Запуск всех бенчмарков и сбор результатов"""
+    server = MockProcess(args.fixtures, latency=args.latency, jitter=args.jitter)
+    try:
+        core = configure(server, rate_limits=args.rate_limits)
+        window = build_app(core, args.symbol)
+        results = {
+            "update_data": bench_update_data(window, server, args.cycles),
+            "update_realtime_charts": bench_realtime(window, server, args.cycles),
+            "redraw": bench_redraw(args.redraws),
+            "memory": bench_memory(window, args.long_cycles),
+        }
+        core.close()
+    finally:
+        server.stop()
+    return {
+        "environment": {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "latency": args.latency,
+            "jitter": args.jitter,
+            "fixtures": args.fixtures,
+            "json_backend": app.JSON_BACKEND,
+            "orjson": app.orjson is not None,
+            "msgspec": app.msgspec is not None,
+        },
+        "results": results,
+    }
+
+# ==============================================
+# СРАВНЕНИЕ С БАЗОВЫМИ РЕЗУЛЬТАТАМИ
+# ==============================================
+def workload_mismatch(results, baseline):
+    """
+    Параметры нагрузки, отличающиеся от базовых результатов
+
+    Returns:
+        Список строк "параметр: базовое -> текущее" (пустой, если нагрузка та же)
+    """
+    current, base = results.get("environment", {}), baseline.get("environment", {})
+    return [f"{key}: {base.get(key)} -> {current.get(key)}" for key in WORKLOAD_KEYS if base.get(key) != current.get(key)]
+
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    """
+    Сравнение с базовыми результатами
+
+    Returns:
+        Список строк с регрессиями (пустой, если их нет)
+    """
+    regressions = []
+    for group, metrics in baseline["results"].items():
+        for name, base in metrics.items():
+            value = results["results"].get(group, {}).get(name)
+            if not isinstance(base, (int, float)) or not isinstance(value, (int, float)) or name in INFORMATIONAL:
+                continue
+            floor = next((limit for suffix, limit in MIN_REGRESSION.items() if name.endswith(suffix)), 0)
+            if value > base * (1 + tolerance) and value - base > floor:
+                regressions.append(f"{group}.{name}: {base} -> {value} (+{(value / base - 1) * 100 if base else 0:.0f}%)")
+    return regressions
+
+# ==============================================
+# ТОЧКА ВХОДА
+# ==============================================
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Бенчмарки агрегатора на локальной заглушке бирж")
+    parser.add_argument("--fixtures", help="записанные ответы бирж (mock_exchange.py --record-fixtures)")
+    parser.add_argument("--latency", type=float, default=HTTP_LATENCY, help="задержка ответа заглушки (сек)")
+    parser.add_argument("--jitter", type=float, default=HTTP_JITTER, help="разброс задержки (сек)")
+    parser.add_argument("--symbol", default="BTC", help="выбранная монета")
+    parser.add_argument("--cycles", type=int, default=30, help="число замеряемых циклов")
+    parser.add_argument("--redraws", type=int, default=40, help="число перерисовок графика")
+    parser.add_argument("--long-cycles", type=int, default=300, help="длина прогона для замера памяти")
+    parser.add_argument("--rate-limits", action="store_true", help="соблюдать лимиты запросов бирж")
+    parser.add_argument("--baseline", default=str(BASELINE_FILE), help="файл базовых результатов")
+    parser.add_argument("--save-baseline", action="store_true", help="записать результаты как базовые")
+    parser.add_argument("--output", help="сохранить результаты в файл")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE, help="допустимое ухудшение (доля)")
+    args = parser.parse_args()
+
+    results = run(args)
+    print(json.dumps(results["results"], indent=2, ensure_ascii=False))
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2, ensure_ascii=False), encoding="utf-8")
+
+    baseline_path = Path(args.baseline)
+    if args.save_baseline:
+        baseline_path.write_text(json.dumps(results, indent=2, ensure_ascii=False) + "\n", encoding="utf-8")
+        print(f"Базовые результаты сохранены: {baseline_path}")
+    elif baseline_path.exists():
+        baseline = json.loads(baseline_path.read_text(encoding="utf-8"))
+        mismatch = workload_mismatch(results, baseline)
+        if mismatch:
+            print("ВНИМАНИЕ: нагрузка отличается от базовых результатов, сравнение пропущено:")
+            for line in mismatch:
+                print(f"  {line}")
+            print("Для сравнения запустите с параметрами базы или запишите новую базу (--save-baseline)")
+            sys.exit(0)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print("Регрессии относительно базовых результатов:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print("Регрессий нет")
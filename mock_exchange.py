@@ -0,0 +1,625 @@
+"""Локальные заглушки бирж для проверки приложения без доступа к сети"""
+import socket
+import threading
+import time
+import json
+import gzip
+import random
+import base64
+import hashlib
+import struct
+import argparse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qsl
+
+from app import session_key
+
+# ==============================================
+# КОНСТАНТЫ
+# ==============================================
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"  # Константа из RFC 6455
+DEFAULT_PRICES = {"BTC": 65000.0, "ETH": 3500.0, "BNB": 580.0, "SOL": 150.0, "XRP": 0.6,
+                  "ADA": 0.45, "DOGE": 0.15, "DOT": 7.0, "AVAX": 35.0}
+SYNTHETIC_PAIRS = 600     # Пар в сгенерированных пакетных ответах (примерно как у Bybit)
+HTTP_LATENCY = 0.02       # Задержка ответа заглушки REST по умолчанию (сек)
+HTTP_JITTER = 0.01        # Случайная добавка к задержке: от 0 до этого значения (сек)
+KLINE_SECONDS = {"1": 60, "1m": 60, "60": 3600, "60m": 3600, "1h": 3600, "D": 86400, "1d": 86400}
+
+# ==============================================
+# ЗАГЛУШКА WEBSOCKET-ПОТОКА
+# ==============================================
+class LocalWebSocketServer:
+    """
+    Минимальный WebSocket-сервер, имитирующий поток тикеров Binance или Bybit
+
+    Поддерживает только то, что нужно MarketStream: рукопожатие, текстовые
+    кадры от сервера, прием (и игнорирование) кадров клиента, ответ на ping и close.
+    """
+
+    def __init__(self, exchange="Binance", host="127.0.0.1", port=0, interval=0.2, prices=None):
+        """
+        Инициализация сервера
+
+        Args:
+            exchange: Формат сообщений ("Binance" или "Bybit")
+            host: Адрес для прослушивания
+            port: Порт (0 - выбрать свободный)
+            interval: Пауза между рассылками тикеров (сек)
+            prices: Начальные цены {символ: цена}
+        """
+        self.exchange = exchange
+        self.interval = interval
+        self.prices = dict(prices or DEFAULT_PRICES)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((host, port))
+        self.sock.listen()
+        self.host, self.port = self.sock.getsockname()
+        self.clients = []
+        self.lock = threading.Lock()
+        self.running = False
+
+    @property
+    def url(self):
+        """Адрес сервера для MarketStream"""
+        return f"ws://{self.host}:{self.port}/"
+
+    def start(self):
+        """Запуск приема подключений и рассылки тикеров"""
+        self.running = True
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+        threading.Thread(target=self._broadcast_loop, daemon=True).start()
+        return self
+
+    def stop(self):
+        """Остановка сервера и закрытие всех соединений"""
+        self.running = False
+        self.sock.close()
+        with self.lock:
+            for client in self.clients:
+                client.close()
+            self.clients.clear()
+
+    def drop_clients(self):
+        """Разрыв всех текущих соединений (для проверки переподключения)"""
+        with self.lock:
+            for client in self.clients:
+                try:
+                    client.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+                client.close()
+            self.clients.clear()
+
+    def _accept_loop(self):
+        """Прием новых подключений"""
+        while self.running:
+            try:
+                client, _ = self.sock.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._handle_client, args=(client,), daemon=True).start()
+
+    def _handle_client(self, client):
+        """Рукопожатие и чтение кадров клиента"""
+        try:
+            request = b""
+            while b"\r\n\r\n" not in request:
+                chunk = client.recv(4096)
+                if not chunk:
+                    return
+                request += chunk
+
+            key = ""
+            for line in request.decode("latin-1").split("\r\n"):
+                if line.lower().startswith("sec-websocket-key:"):
+                    key = line.split(":", 1)[1].strip()
+            accept = base64.b64encode(hashlib.sha1((key + WS_GUID).encode()).digest()).decode()
+            client.sendall((
+                "HTTP/1.1 101 Switching Protocols\r\n"
+                "Upgrade: websocket\r\n"
+                "Connection: Upgrade\r\n"
+                f"Sec-WebSocket-Accept: {accept}\r\n\r\n"
+            ).encode())
+
+            with self.lock:
+                self.clients.append(client)
+
+            while self.running:
+                opcode, payload = self._read_frame(client)
+                if opcode is None or opcode == 0x8:
+                    break
+                if opcode == 0x9:
+                    self._send_frame(client, payload, opcode=0xA)
+        except OSError:
+            pass
+        finally:
+            with self.lock:
+                if client in self.clients:
+                    self.clients.remove(client)
+            client.close()
+
+    @staticmethod
+    def _recv_exact(client, size):
+        """Чтение ровно size байт"""
+        data = b""
+        while len(data) < size:
+            chunk = client.recv(size - len(data))
+            if not chunk:
+                return None
+            data += chunk
+        return data
+
+    def _read_frame(self, client):
+        """Чтение одного кадра клиента (кадры клиента всегда маскированы)"""
+        header = self._recv_exact(client, 2)
+        if header is None:
+            return None, None
+        opcode = header[0] & 0x0F
+        length = header[1] & 0x7F
+        if length == 126:
+            length = struct.unpack(">H", self._recv_exact(client, 2))[0]
+        elif length == 127:
+            length = struct.unpack(">Q", self._recv_exact(client, 8))[0]
+        mask = self._recv_exact(client, 4) if header[1] & 0x80 else b"\0\0\0\0"
+        payload = self._recv_exact(client, length) or b""
+        return opcode, bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+
+    @staticmethod
+    def _send_frame(client, payload, opcode=0x1):
+        """Отправка немаскированного кадра"""
+        length = len(payload)
+        if length < 126:
+            header = struct.pack(">BB", 0x80 | opcode, length)
+        elif length < 65536:
+            header = struct.pack(">BBH", 0x80 | opcode, 126, length)
+        else:
+            header = struct.pack(">BBQ", 0x80 | opcode, 127, length)
+        client.sendall(header + payload)
+
+    def _broadcast_loop(self):
+        """Рассылка тикеров всем клиентам со случайным блужданием цены"""
+        while self.running:
+            for symbol in self.prices:
+                self.prices[symbol] *= 1 + random.uniform(-0.001, 0.001)
+                for message in self.ticker_messages(symbol, self.prices[symbol]):
+                    payload = json.dumps(message).encode()
+                    with self.lock:
+                        clients = list(self.clients)
+                    for client in clients:
+                        try:
+                            self._send_frame(client, payload)
+                        except OSError:
+                            pass
+            time.sleep(self.interval)
+
+    def ticker_messages(self, symbol, price):
+        """Сообщения тикера и лучших цен в формате выбранной биржи"""
+        pair = f"{symbol}USDT"
+        bid, ask = price * 0.9999, price * 1.0001
+        if self.exchange == "Bybit":
+            return [
+                {"topic": f"tickers.{pair}", "type": "snapshot",
+                 "data": {"symbol": pair, "lastPrice": f"{price:.8f}"}},
+                {"topic": f"orderbook.1.{pair}", "type": "snapshot",
+                 "data": {"s": pair, "b": [[f"{bid:.8f}", "1"]], "a": [[f"{ask:.8f}", "1"]]}},
+            ]
+        return [
+            {"stream": f"{pair.lower()}@ticker",
+             "data": {"e": "24hrTicker", "s": pair, "c": f"{price:.8f}",
+                      "b": f"{bid:.8f}", "a": f"{ask:.8f}"}},
+            {"stream": f"{pair.lower()}@bookTicker",
+             "data": {"s": pair, "b": f"{bid:.8f}", "B": "1", "a": f"{ask:.8f}", "A": "1"}},
+        ]
+
+# ==============================================
+# ЗАГЛУШКА REST API
+# ==============================================
+def fixture_key(exchange, path, params):
+    """
+    Ключ записанного ответа: биржа, путь и параметры запроса без параметров времени
+    
+    Строится из app.session_key, чтобы записи заглушки и сессии приложения
+    сопоставлялись с запросами одинаково
+    """
+    exchange, path, query = session_key(exchange, path, params)
+    return f"{exchange} {path}?{query}"
+
+
+def load_fixtures(path):
+    """Загрузка записанных ответов {ключ: тело} из JSON-файла (можно сжатого gzip)"""
+    opener = gzip.open if str(path).endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as file:
+        return json.load(file)["responses"]
+
+
+def save_fixtures(path, responses):
+    """Сохранение записанных ответов в JSON-файл (сжатый, если имя оканчивается на .gz)"""
+    opener = gzip.open if str(path).endswith(".gz") else open
+    with opener(path, "wt", encoding="utf-8") as file:
+        json.dump({"recorded": time.time(), "responses": responses}, file, ensure_ascii=False)
+
+
+class MockHttpHandler(BaseHTTPRequestHandler):
+    """Обработчик запросов заглушки: /<биржа>/<путь API биржи>"""
+    
+    protocol_version = "HTTP/1.1"  # Постоянные соединения, как у настоящих бирж
+    
+    def do_GET(self):
+        """Ответ записанным или сгенерированным телом после задержки; /_stats - счетчики запросов"""
+        parts = urlsplit(self.path)
+        if parts.path == "/_stats":
+            status, body = 200, json.dumps({"requests": self.server.mock.request_count()}).encode()
+        else:
+            exchange, _, path = parts.path.lstrip("/").partition("/")
+            status, body = self.server.mock.respond(exchange, "/" + path, parse_qsl(parts.query))
+        
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, format, *args):
+        """Журнал запросов отключен"""
+        pass
+
+
+class LocalHttpServer:
+    """
+    Локальная заглушка REST API Bybit, Binance и MEXC с настраиваемой задержкой
+    
+    Ответы берутся из записанных файлов (fixtures), а если подходящей записи нет,
+    генерируются в формате биржи по случайно меняющимся ценам. Адаптер биржи
+    направляется на заглушку через base_url (см. base_url()). Сервер считает
+    запросы, чтобы можно было узнать число запросов за цикл обновления
+    (в том числе из другого процесса: GET /_stats).
+    """
+    
+    def __init__(self, fixtures=None, latency=HTTP_LATENCY, jitter=HTTP_JITTER, host="127.0.0.1", port=0,
+                 prices=None, pairs=SYNTHETIC_PAIRS, seed=None):
+        """
+        Инициализация сервера
+        
+        Args:
+            fixtures: Записанные ответы {ключ fixture_key: тело} или None
+            latency: Задержка ответа (сек) или словарь {биржа: задержка}
+            jitter: Случайная добавка к задержке от 0 до jitter (сек)
+            host: Адрес для прослушивания
+            port: Порт (0 - выбрать свободный)
+            prices: Начальные цены {символ: цена}
+            pairs: Общее число пар в пакетных ответах (лишние пары - COIN1, COIN2...)
+            seed: Начальное значение генератора случайных чисел (для повторяемости)
+        """
+        self.fixtures = dict(fixtures or {})
+        # Запись без параметров подходит для любого запроса того же пути
+        self.fixtures_by_path = {}
+        for key, body in self.fixtures.items():
+            self.fixtures_by_path.setdefault(key.split("?", 1)[0], body)
+        self.latency = latency
+        self.jitter = jitter
+        self.random = random.Random(seed)
+        self.prices = dict(prices or DEFAULT_PRICES)
+        for i in range(1, max(0, pairs - len(self.prices)) + 1):
+            self.prices[f"COIN{i}"] = round(self.random.uniform(0.01, 100), 4)
+        self.lock = threading.Lock()
+        self.counts = {}
+        
+        self.server = ThreadingHTTPServer((host, port), MockHttpHandler)
+        self.server.daemon_threads = True
+        self.server.mock = self
+        self.host, self.port = self.server.server_address[:2]
+    
+    def base_url(self, exchange):
+        """Адрес API биржи на заглушке (для EXCHANGE_SETTINGS или base_url адаптера)"""
+        return f"http://{self.host}:{self.port}/{exchange}"
+    
+    def start(self):
+        """Запуск сервера в фоновом потоке"""
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+    
+    def stop(self):
+        """Остановка сервера"""
+        self.server.shutdown()
+        self.server.server_close()
+    
+    def request_count(self):
+        """Общее число обработанных запросов"""
+        with self.lock:
+            return sum(self.counts.values())
+    
+    def respond(self, exchange, path, params):
+        """
+        Ответ на запрос
+        
+        Returns:
+            (HTTP-статус, тело в байтах)
+        """
+        with self.lock:
+            self.counts[(exchange, path)] = self.counts.get((exchange, path), 0) + 1
+            latency = self.latency.get(exchange, 0) if isinstance(self.latency, dict) else self.latency
+            delay = latency + self.random.uniform(0, self.jitter)
+        time.sleep(delay)
+        
+        key = fixture_key(exchange, path, params)
+        body = self.fixtures.get(key) or self.fixtures_by_path.get(key.split("?", 1)[0])
+        if body is not None:
+            return 200, body.encode("utf-8")
+        
+        payload = self.generate(exchange, path, dict(params))
+        if payload is None:
+            return 404, b'{"error": "not found"}'
+        return 200, json.dumps(payload, separators=(",", ":")).encode("utf-8")
+    
+    def _walk(self, symbols):
+        """Случайное изменение цен перед ответом"""
+        with self.lock:
+            for symbol in symbols:
+                self.prices[symbol] *= 1 + self.random.uniform(-0.001, 0.001)
+            return {symbol: self.prices[symbol] for symbol in symbols}
+    
+    def _symbols(self, pair_param, separator=""):
+        """Монеты запроса: одна из параметра symbol или все"""
+        if pair_param:
+            return [pair_param[:-len(separator + "USDT")]]
+        return list(self.prices)
+    
+    def generate(self, exchange, path, params):
+        """Тело ответа в формате биржи или None для неизвестного пути"""
+        if exchange == "Bybit":
+            return self._generate_bybit(path, params)
+        if exchange in ("Binance", "MEXC"):
+            return self._generate_binance(path, params)
+        return None
+    
+    @staticmethod
+    def _f(value):
+        """Число в виде строки, как в ответах бирж"""
+        return f"{value:.8g}"
+    
+    def _depth(self, price, limit):
+        """Уровни стакана (asks, bids) вокруг цены"""
+        step = price * 0.0001
+        asks = [[self._f(price + step * (i + 1)), self._f(self.random.uniform(0.1, 5))] for i in range(limit)]
+        bids = [[self._f(price - step * (i + 1)), self._f(self.random.uniform(0.1, 5))] for i in range(limit)]
+        return asks, bids
+    
+    def _klines(self, price, seconds, limit, start_ms):
+        """Свечи [время открытия (мс), open, high, low, close, volume] от старых к новым"""
+        if start_ms is None:
+            start_ms = (int(time.time()) // seconds - limit + 1) * seconds * 1000
+        rows = []
+        for i in range(limit):
+            close = price * (1 + self.random.uniform(-0.01, 0.01))
+            rows.append([start_ms + i * seconds * 1000, self._f(price), self._f(max(price, close) * 1.002),
+                         self._f(min(price, close) * 0.998), self._f(close), self._f(self.random.uniform(1, 1000))])
+            price = close
+        return rows
+    
+    def _generate_bybit(self, path, params):
+        """Ответы Bybit API v5"""
+        if path == "/v5/market/tickers":
+            prices = self._walk(self._symbols(params.get("symbol")))
+            items = [{
+                "symbol": f"{symbol}USDT", "bid1Price": self._f(price * 0.9999), "bid1Size": "1.5",
+                "ask1Price": self._f(price * 1.0001), "ask1Size": "2.1", "lastPrice": self._f(price),
+                "prevPrice24h": self._f(price * 0.98), "price24hPcnt": "0.0204",
+                "highPrice24h": self._f(price * 1.03), "lowPrice24h": self._f(price * 0.97),
+                "turnover24h": "123456789.12", "volume24h": "98765.43"
+            } for symbol, price in prices.items()]
+            result = {"category": "spot", "list": items}
+        elif path == "/v5/market/orderbook":
+            symbol = self._symbols(params.get("symbol"))[0]
+            asks, bids = self._depth(self._walk([symbol])[symbol], int(params.get("limit", 50)))
+            result = {"s": params.get("symbol"), "a": asks, "b": bids, "ts": int(time.time() * 1000), "u": 1}
+        elif path == "/v5/market/kline":
+            symbol = self._symbols(params.get("symbol"))[0]
+            start = int(params["start"]) if "start" in params else None
+            rows = self._klines(self.prices[symbol], KLINE_SECONDS[params.get("interval", "1")],
+                                int(params.get("limit", 200)), start)
+            # Bybit отдает свечи от новых к старым, с оборотом в конце строки
+            result = {"category": "spot", "symbol": params.get("symbol"),
+                      "list": [[str(row[0])] + row[1:] + ["0"] for row in reversed(rows)]}
+        else:
+            return None
+        return {"retCode": 0, "retMsg": "OK", "result": result, "time": int(time.time() * 1000)}
+    
+    def _generate_binance(self, path, params):
+        """Ответы Binance API v3 (формат MEXC совпадает)"""
+        pair = params.get("symbol")
+        if path == "/api/v3/ticker/24hr":
+            prices = self._walk(self._symbols(pair))
+            items = [{
+                "symbol": f"{symbol}USDT", "priceChange": self._f(price * 0.02), "priceChangePercent": "2.04",
+                "weightedAvgPrice": self._f(price), "prevClosePrice": self._f(price * 0.98),
+                "lastPrice": self._f(price), "lastQty": "0.1", "bidPrice": self._f(price * 0.9999),
+                "bidQty": "1.5", "askPrice": self._f(price * 1.0001), "askQty": "2.1",
+                "openPrice": self._f(price * 0.98), "highPrice": self._f(price * 1.03),
+                "lowPrice": self._f(price * 0.97), "volume": "98765.43", "quoteVolume": "123456789.12",
+                "openTime": 0, "closeTime": int(time.time() * 1000), "firstId": 1, "lastId": 1000, "count": 1000
+            } for symbol, price in prices.items()]
+            return items[0] if pair else items
+        if path == "/api/v3/ticker/bookTicker":
+            prices = self._walk(self._symbols(pair))
+            items = [{
+                "symbol": f"{symbol}USDT", "bidPrice": self._f(price * 0.9999), "bidQty": "1.5",
+                "askPrice": self._f(price * 1.0001), "askQty": "2.1"
+            } for symbol, price in prices.items()]
+            return items[0] if pair else items
+        if path == "/api/v3/depth":
+            symbol = self._symbols(pair)[0]
+            asks, bids = self._depth(self._walk([symbol])[symbol], int(params.get("limit", 100)))
+            return {"lastUpdateId": int(time.time() * 1000), "bids": bids, "asks": asks}
+        if path == "/api/v3/klines":
+            symbol = self._symbols(pair)[0]
+            start = int(params["startTime"]) if "startTime" in params else None
+            seconds = KLINE_SECONDS[params.get("interval", "1m")]
+            rows = self._klines(self.prices[symbol], seconds, int(params.get("limit", 500)), start)
+            return [row + [row[0] + seconds * 1000 - 1, "0", 100, "0", "0", "0"] for row in rows]
+        return None
+
+
+class FixtureRecorder:
+    """
+    Запись ответов бирж для последующего воспроизведения на LocalHttpServer
+    
+    Оборачивает HTTP-транспорт адаптеров: каждый успешный ответ сохраняется
+    под ключом fixture_key, последующий ответ на тот же запрос заменяет прежний.
+    """
+    
+    def __init__(self, session, adapters):
+        """Обертка над session (HttpTransport) для адаптеров {биржа: адаптер}"""
+        self.session = session
+        self.bases = {adapter.base_url: name for name, adapter in adapters.items()}
+        self.responses = {}
+        for adapter in adapters.values():
+            adapter.session = self
+    
+    def get(self, url, params=None, timeout=None):
+        """GET через исходный транспорт с сохранением тела ответа"""
+        response = self.session.get(url, params=params, timeout=timeout)
+        if response.status_code == 200:
+            for base, exchange in self.bases.items():
+                if url.startswith(base):
+                    key = fixture_key(exchange, url[len(base):], list((params or {}).items()))
+                    self.responses[key] = response.content.decode("utf-8")
+        return response
+
+
+def record_fixtures(path, exchanges=("Bybit", "MEXC", "Binance"), symbols=("BTC", "ETH")):
+    """
+    Запись ответов настоящих бирж (нужен доступ к сети) для бенчмарков
+    
+    Записываются пакетные тикеры и лучшие цены, стаканы и свечи всех интервалов
+    для указанных монет.
+    """
+    from app import HttpTransport, create_adapters, DEPTH_LEVELS, KLINE_INTERVAL_SECONDS
+    
+    transport = HttpTransport()
+    adapters = create_adapters(list(exchanges), transport)
+    recorder = FixtureRecorder(transport, adapters)
+    for name, adapter in adapters.items():
+        calls = [adapter.fetch_tickers, adapter.fetch_book_tickers]
+        for symbol in symbols:
+            calls.append(lambda adapter=adapter, symbol=symbol: adapter.fetch_depth(symbol, DEPTH_LEVELS))
+            for interval in KLINE_INTERVAL_SECONDS:
+                calls.append(lambda adapter=adapter, symbol=symbol, interval=interval:
+                             adapter.fetch_klines(symbol, interval, 200))
+        for call in calls:
+            try:
+                call()
+            except Exception as e:
+                print(f"Ошибка записи {name}: {e}")
+    transport.close()
+    save_fixtures(path, recorder.responses)
+    print(f"Записано ответов: {len(recorder.responses)} -> {path}")
+    return recorder.responses
+
+
+def check_replay(cycles=5, latency=0.0):
+    """
+    Проверка записи и воспроизведения сессии на заглушке REST API
+    
+    Записывает cycles снимков котировок через MarketDataCore, затем воспроизводит
+    запись на максимальной скорости (запросы бирж идут параллельно и в другом
+    порядке) и сравнивает снимки: каждый должен вернуться один раз и по порядку.
+    
+    Returns:
+        True, если все снимки совпали
+    """
+    import tempfile
+    from pathlib import Path
+    import app
+    
+    app.USE_STREAMING = False
+    app.USE_TICK_STORE = False
+    app.USE_CANDLE_STORE = False
+    server = LocalHttpServer(latency=latency, jitter=0).start()
+    app.EXCHANGE_SETTINGS = {name: {"base_url": server.base_url(name)} for name in app.ENABLED_EXCHANGES}
+    
+    def snapshots(count):
+        core = app.MarketDataCore(app.ENABLED_EXCHANGES, app.TOP_SYMBOLS)
+        for adapter in core.adapters.values():
+            adapter.governor = None
+        result = []
+        for _ in range(count):
+            snapshot = core.get_snapshot()
+            result.append({name: dict(snapshot.exchange_prices(name)) for name in core.exchanges})
+        core.close()
+        return result
+    
+    with tempfile.TemporaryDirectory() as directory:
+        path = Path(directory) / "session.gz"
+        app.SESSION_RECORD_FILE = path
+        recorded = snapshots(cycles)
+        app.SESSION_RECORD_FILE = None
+        app.SESSION_REPLAY_FILE, app.REPLAY_SPEED = path, None
+        # Лишний снимок после конца записи повторяет последний
+        replayed = snapshots(cycles + 1)
+        app.SESSION_REPLAY_FILE = None
+    server.stop()
+    
+    ok = replayed == recorded + recorded[-1:] and all(recorded)
+    for i, (expected, actual) in enumerate(zip(recorded + recorded[-1:], replayed), 1):
+        print(f"Снимок {i}: {'совпадает' if expected == actual else 'НЕ СОВПАДАЕТ'}")
+    print("Воспроизведение полное и по порядку" if ok else "Ошибка воспроизведения")
+    return ok
+
+# ==============================================
+# ТОЧКА ВХОДА
+# ==============================================
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Локальные заглушки бирж")
+    parser.add_argument("--serve", action="store_true", help="запустить заглушку REST API до Ctrl+C")
+    parser.add_argument("--port", type=int, default=0, help="порт заглушки REST API")
+    parser.add_argument("--fixtures", help="файл записанных ответов для заглушки REST API")
+    parser.add_argument("--latency", type=float, default=HTTP_LATENCY, help="задержка ответа (сек)")
+    parser.add_argument("--jitter", type=float, default=HTTP_JITTER, help="случайная добавка к задержке (сек)")
+    parser.add_argument("--record-fixtures", metavar="FILE", help="записать ответы настоящих бирж в файл")
+    parser.add_argument("--check-replay", type=int, metavar="N",
+                        help="проверить запись и воспроизведение N снимков котировок")
+    args = parser.parse_args()
+    
+    if args.check_replay:
+        raise SystemExit(0 if check_replay(args.check_replay) else 1)
+    
+    if args.record_fixtures:
+        record_fixtures(args.record_fixtures)
+        raise SystemExit
+    
+    if args.serve:
+        fixtures = load_fixtures(args.fixtures) if args.fixtures else None
+        server = LocalHttpServer(fixtures, latency=args.latency, jitter=args.jitter, port=args.port).start()
+        for name in ("Bybit", "MEXC", "Binance"):
+            print(f"{name}: {server.base_url(name)}", flush=True)
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            server.stop()
+        raise SystemExit
+    
+    # Проверка MarketStream на локальных заглушках Binance и Bybit
+    from app import MarketStream, create_adapters
+
+    servers = {name: LocalWebSocketServer(name).start() for name in ("Binance", "Bybit")}
+    adapters = create_adapters(list(servers), session=None)
+    stream = MarketStream(["BTC", "ETH"], adapters, urls={name: server.url for name, server in servers.items()})
+    stream.start()
+    time.sleep(1)
+
+    for name in servers:
+        print(f"{name}: live={stream.is_live(name)} prices={stream.exchange_prices(name)} "
+              f"BTC book={stream.book(name, 'BTC')}")
+
+    # Обрыв соединений и ожидание переподключения
+    for server in servers.values():
+        server.drop_clients()
+    time.sleep(3)
+    for name in servers:
+        print(f"{name} после переподключения: prices={stream.exchange_prices(name)}")
+
+    stream.stop()
+    for server in servers.values():
+        server.stop()